@@ -2,6 +2,8 @@
 ASGI config for core project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Run it with an ASGI server, e.g.
+``gunicorn core.asgi:application -k uvicorn.workers.UvicornWorker``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -12,5 +14,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Serve /metrics/ with the async view, backed by redis.asyncio
+os.environ.setdefault('METRICS_VIEW_ASYNC', 'true')
 
 application = get_asgi_application()
@@ -14,12 +14,18 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import os
+
 from django.contrib import admin
 from django.urls import path
-from tasks.views import trigger_task
-from monitor.views import metrics_view
+from tasks.views import trigger_batch, trigger_task
+from monitor.views import metrics_view, metrics_view_async
+
+# Set by core/asgi.py: under ASGI a sync view would run on the server's single sync thread
+METRICS_VIEW_ASYNC = os.getenv('METRICS_VIEW_ASYNC', 'false').lower() == 'true'
 
 urlpatterns = [
     path('trigger/', trigger_task, name='trigger_task'),
-    path('metrics/', metrics_view, name='metrics'),
+    path('trigger/batch/', trigger_batch, name='trigger_batch'),
+    path('metrics/', metrics_view_async if METRICS_VIEW_ASYNC else metrics_view, name='metrics'),
 ]
@@ -0,0 +1,167 @@
+"""
+asyncio runtime for the Celery exporter.
+"""
+import asyncio
+import sys
+import threading
+import time
+
+from app.monitor.exporter import CelerySuccessExporter
+from app.monitor.redis_pool import create_async_redis
+
+
+class AsyncCeleryExporter(CelerySuccessExporter):
+    """
+    The Celery exporter driven by an asyncio event loop.
+
+    Exposes the same metrics as CelerySuccessExporter, but handlers and
+    flushes all run on the event loop: flushes are a timer instead of the
+    Redis updater thread, and Redis is written
+    through ``redis.asyncio``. Kombu has no asyncio transport, so a single
+    receiver thread drains the broker connection; it only decodes events into
+    the bounded event buffer and wakes the loop when the buffer stops being
+    empty.
+
+    Run it with ``await run()``, or with ``start()``/``stop()`` like the
+    threaded exporter, which runs the event loop on a background thread.
+
+    Args:
+        async_redis_client (optional): ``redis.asyncio`` client (or compatible)
+            to write with. Created from ``redis_url`` if not given.
+        Other arguments are those of CelerySuccessExporter; pipeline mode is
+        always on since the event buffer feeds the loop.
+    """
+    def __init__(self, broker_url: str, redis_url: str = 'redis://localhost:6379/0', async_redis_client=None,
+                 **kwargs):
+        kwargs['pipeline'] = True
+        # Startup (checkpoint restore, initial store) still uses the blocking client
+        super().__init__(broker_url, redis_url=redis_url, **kwargs)
+        self.async_redis = async_redis_client if async_redis_client is not None else create_async_redis(redis_url)
+
+        self._loop = None
+        self._wakeup = None
+        self._wakeup_pending = False
+        self._stopping = None
+        # Set once run() can be stopped, for start()
+        self._running = threading.Event()
+        self._loop_thread = None
+
+    def _enqueue_event(self, event):
+        """Receiver callback: queue the event and wake the loop unless a wakeup is already pending."""
+        if self.event_buffer.put(event) and not self._wakeup_pending:
+            self._wakeup_pending = True
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _aggregate_events_async(self):
+        """Process queued events in batches whenever the receiver wakes the loop."""
+        buffer = self.event_buffer
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # Reset before draining: events queued from now on schedule a new wakeup
+            self._wakeup_pending = False
+            while True:
+                batch = buffer.drain(self.batch_size, timeout=0)
+                if not batch:
+                    break
+                self._process_batch(batch)
+                # Let the flush timer run between batches
+                await asyncio.sleep(0)
+            if buffer.closed:
+                return
+
+    async def _store_metrics_async(self):
+        """Store current metrics in Redis through the asyncio client."""
+        if not self.redis.breaker.allow():
+            # Redis is down and we are backing off, metrics stay dirty for later
+            return
+
+        started = time.perf_counter()
+        self.flush_scheduler.flushing()
+        sketch_writes = self._take_sketch_writes() if self.runtime_sketches else {}
+        # Cleared before taking the snapshot so events handled during the write mark it dirty again
+        self._metrics_dirty = False
+        try:
+            pipe = self.async_redis.pipeline(transaction=True)
+            commit = self._queue_metrics(pipe, sketch_writes)
+            if commit is not None:
+                await pipe.execute()
+                commit()
+        except Exception as e:
+            self._store_failed(e, sketch_writes, started)
+            return
+        except BaseException:
+            # Cancelled mid-write: retry with the next flush
+            self._metrics_dirty = True
+            self.redis.breaker.abandon()
+            raise
+        self._store_succeeded(started)
+
+    async def _flush(self):
+        """Flush timer callback."""
+        now = time.time()
+        if self._metrics_dirty or self._heartbeat_due(now) or self._freshness_due(now) or len(self.workers):
+            await self._store_metrics_async()
+
+    async def _every(self, interval, callback):
+        """Await ``callback()`` every ``interval()`` seconds until the exporter stops."""
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), interval())
+            except asyncio.TimeoutError:
+                await callback()
+
+    async def run(self):
+        """Run the exporter until ``stop`` is called."""
+        print("Starting asyncio Celery event monitoring...", file=sys.stderr)
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._running.set()
+
+        aggregator = asyncio.create_task(self._aggregate_events_async())
+        # The flush timer follows the interval chosen by the flush scheduler
+        timers = [asyncio.create_task(self._every(lambda: self.flush_scheduler.interval, self._flush))]
+
+        # Broker consumption is blocking I/O, keep it off the loop
+        self._monitor_thread = threading.Thread(target=self._monitor_events, daemon=True)
+        self._monitor_thread.start()
+        scheduler = self.flush_scheduler
+        print(f"Event loop running (flush interval: {scheduler.min_interval}-{scheduler.max_interval}s)",
+              file=sys.stderr)
+
+        await self._stopping.wait()
+        print("Stopping exporter...", file=sys.stderr)
+
+        # Let the receiver finish handing over events before the recorder closes,
+        # waiting as long as the threaded stop() does
+        await asyncio.to_thread(self._monitor_thread.join, 1.0)
+        if self.recorder is not None:
+            self.recorder.close()
+
+        # Let the aggregator process what is already queued
+        self.event_buffer.close()
+        self._wakeup.set()
+        await aggregator
+        await asyncio.gather(*timers)
+
+        # Do a final update to Redis
+        if self._metrics_dirty:
+            print("Performing final Redis update before shutdown", file=sys.stderr)
+            await self._store_metrics_async()
+        await self.async_redis.aclose()
+        print("Exporter stopped", file=sys.stderr)
+
+    def start(self):
+        """Run the exporter on its own event loop in a background thread."""
+        self._loop_thread = threading.Thread(target=asyncio.run, args=(self.run(),), daemon=True)
+        self._loop_thread.start()
+        self._running.wait()
+
+    def stop(self):
+        """Ask ``run`` to finish. Safe to call from any thread; waits for it to finish after ``start``."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+        thread = self._loop_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
@@ -0,0 +1,195 @@
+"""
+Cardinality guard for task-name labels.
+
+A space-saving summary keeps approximate counts of the most frequent task
+names in bounded memory. Only the hottest ``max_series`` names get their own
+label value; everything else is folded into a single ``other`` label, so a
+buggy dynamic task name cannot create unbounded series.
+
+``fold_label`` moves the series of a demoted name into ``other``. Like the
+checkpoints it relies on prometheus_client internals (``_metrics``,
+``_value``, ``_buckets``, ``_sum``). The demoted name's whole history moves
+in one step: sums over all names stay continuous, but ``other`` itself jumps
+by that history, which ``rate()`` and ``increase()`` on ``other`` show as a
+spike. Rebalancing uses a margin so that names of similar frequency do not
+keep trading places.
+"""
+import heapq
+
+from prometheus_client import Counter, Histogram
+
+OTHER_LABEL = 'other'
+
+
+class SpaceSaving:
+    """
+    Space-saving heavy-hitter summary (Metwally et al.).
+
+    Tracks at most ``capacity`` keys. When a new key arrives and the summary
+    is full, the key with the smallest count is replaced and the newcomer
+    inherits that count as its error bound. Any key whose true frequency is
+    above N / capacity is guaranteed to be tracked.
+
+    Args:
+        capacity (int): Maximum number of tracked keys.
+    """
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        # key -> [count, error]
+        self._counters = {}
+        # Min-heap with one (count, key) entry per tracked key; counts in it may be stale (too low)
+        self._heap = []
+
+    def __len__(self):
+        return len(self._counters)
+
+    def __contains__(self, key):
+        return key in self._counters
+
+    def count(self, key):
+        """Estimated count of ``key`` (an upper bound), 0 if not tracked."""
+        counter = self._counters.get(key)
+        return counter[0] if counter else 0
+
+    def guaranteed(self, key):
+        """Lower bound on the count of ``key``."""
+        counter = self._counters.get(key)
+        return counter[0] - counter[1] if counter else 0
+
+    def offer(self, key, weight: int = 1):
+        """Count an occurrence of ``key``."""
+        counters = self._counters
+        counter = counters.get(key)
+        if counter is not None:
+            # The heap entry is refreshed lazily when it reaches the top
+            counter[0] += weight
+            return
+        if len(counters) < self.capacity:
+            counters[key] = [weight, 0]
+            heapq.heappush(self._heap, (weight, key))
+            return
+        floor = counters.pop(self._pop_min())[0]
+        counters[key] = [floor + weight, floor]
+        heapq.heappush(self._heap, (floor + weight, key))
+
+    def _pop_min(self):
+        """Remove and return the tracked key with the smallest count from the heap."""
+        heap, counters = self._heap, self._counters
+        while True:
+            count, key = heap[0]
+            current = counters[key][0]
+            if current == count:
+                heapq.heappop(heap)
+                return key
+            # Count grew since the entry was pushed, move it down to its place
+            heapq.heapreplace(heap, (current, key))
+
+    def top(self, k: int):
+        """Return up to ``k`` (key, count, error) tuples, most frequent first."""
+        ranked = heapq.nlargest(k, self._counters.items(), key=lambda item: item[1][0])
+        return [(key, counter[0], counter[1]) for key, counter in ranked]
+
+
+class TopKLabeler:
+    """
+    Maps task names to label values, keeping at most ``max_series`` exact names.
+
+    Names are admitted while there is room. Once full, new names are labeled
+    ``other``. Every ``rebalance_every`` observations the admitted set is
+    compared with the summary's top names: an admitted name is demoted when a
+    name outside the set is guaranteed to be more frequent by more than
+    ``hysteresis`` (a fraction of the admitted name's count), and that name is
+    promoted. Without the margin two names of about the same rate would swap
+    on every rebalance. ``on_demote(name)`` lets the caller fold the demoted
+    series into ``other`` so sums over all names stay continuous.
+
+    Args:
+        max_series (int): Maximum number of distinct names with their own label.
+        capacity (int, optional): Size of the space-saving summary, defaults to 4 * max_series.
+        rebalance_every (int): Observations between rebalances.
+        on_demote (callable, optional): Called with each demoted name.
+        other_label (str): Label value for folded names.
+        hysteresis (float): How much more frequent a name must be to replace an admitted one.
+    """
+    def __init__(self, max_series: int = 100, capacity: int = None, rebalance_every: int = 1000,
+                 on_demote=None, other_label: str = OTHER_LABEL, hysteresis: float = 0.2):
+        self.max_series = max_series
+        self.other_label = other_label
+        self.rebalance_every = rebalance_every
+        self.hysteresis = hysteresis
+        self.on_demote = on_demote
+        self.summary = SpaceSaving(capacity or 4 * max_series)
+        self._admitted = set()
+        self._since_rebalance = 0
+
+    @property
+    def admitted(self):
+        """Names that currently have their own label value."""
+        return frozenset(self._admitted)
+
+    def admit(self, name) -> bool:
+        """Give ``name`` its own label if there is room. Returns True if admitted."""
+        if name in self._admitted:
+            return True
+        if len(self._admitted) >= self.max_series or name == self.other_label:
+            return False
+        self._admitted.add(name)
+        return True
+
+    def label(self, name) -> str:
+        """Count an observation of ``name`` and return the label value to use."""
+        self.summary.offer(name)
+        self._since_rebalance += 1
+        if self._since_rebalance >= self.rebalance_every:
+            self.rebalance()
+        if name in self._admitted or self.admit(name):
+            return name
+        return self.other_label
+
+    def rebalance(self):
+        """Swap admitted names that fell out of the top for hotter ones."""
+        self._since_rebalance = 0
+        top = self.summary.top(self.max_series)
+        candidates = [key for key, _, _ in top if key not in self._admitted and key != self.other_label]
+        if not candidates:
+            return
+        # Coldest admitted names first
+        admitted = sorted(self._admitted, key=self.summary.count)
+        for candidate in candidates:
+            if not admitted:
+                break
+            coldest = admitted[0]
+            if self.summary.guaranteed(candidate) <= self.summary.count(coldest) * (1 + self.hysteresis):
+                # Not certainly and clearly hotter, keep the existing series
+                break
+            admitted.pop(0)
+            self._admitted.discard(coldest)
+            self._admitted.add(candidate)
+            if self.on_demote:
+                self.on_demote(coldest)
+
+
+def fold_label(metric, label_name: str, value: str, into: str) -> int:
+    """
+    Move every child of ``metric`` whose ``label_name`` is ``value`` into the
+    child labeled ``into``, then remove it. Returns the number of folded children.
+
+    Counter values and histogram buckets and sums are added to the target, so
+    sums across all label values stay the same.
+    """
+    index = metric._labelnames.index(label_name)
+    with metric._lock:
+        matches = [(labels, child) for labels, child in metric._metrics.items() if labels[index] == value]
+    for labels, child in matches:
+        target_labels = labels[:index] + (into,) + labels[index + 1:]
+        target = metric.labels(*target_labels)
+        if isinstance(metric, Histogram):
+            for source_bucket, target_bucket in zip(child._buckets, target._buckets):
+                target_bucket.inc(source_bucket.get())
+            target._sum.inc(child._sum.get())
+        elif isinstance(metric, Counter):
+            target._value.inc(child._value.get())
+        metric.remove(*labels)
+    return len(matches)
@@ -0,0 +1,163 @@
+"""
+Compact binary checkpoints of counter and histogram state.
+
+The exporter periodically serializes the raw values of its counters and
+histograms so a restarted exporter continues from where it left off instead
+of resetting every counter to zero.
+
+Format (little endian), zlib compressed after the header:
+
+    header:  magic b'CXCK', format version (u8), created_at (f64), string count (u32), record count (u32)
+    strings: length (u32) + UTF-8 bytes, for every metric name and label value
+    records: metric name index (u32), label count (u8), label value indexes (u32 each),
+             value count (u32), values (f64 each)
+
+Format version 1 packed the string lengths and value counts as u16, which
+cannot hold label values over 64 KiB (e.g. a long task name). Version 1
+checkpoints can still be read.
+
+Counters carry one value. Histograms carry their raw (non-cumulative) bucket
+counts followed by the sum. This relies on prometheus_client internals
+(``_metrics``, ``_value``, ``_buckets``, ``_sum``), which are stable across
+the supported prometheus_client versions.
+"""
+import struct
+import zlib
+
+from prometheus_client import Counter, Histogram
+
+MAGIC = b'CXCK'
+FORMAT_VERSION = 2
+
+_HEADER = struct.Struct('<4sBdII')
+_U8 = struct.Struct('<B')
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+# Struct of string lengths and value counts per format version
+_LENGTHS = {1: _U16, 2: _U32}
+
+
+class CheckpointError(ValueError):
+    """Raised when a checkpoint cannot be decoded."""
+
+
+def checkpoint_key(metrics_key: str) -> str:
+    """Redis key holding the checkpoint of an exporter."""
+    return f'{metrics_key}:checkpoint'
+
+
+def _children(metric):
+    """Yield (label values, child) pairs of a metric."""
+    if metric._labelnames:
+        with metric._lock:
+            children = list(metric._metrics.items())
+        return children
+    return [((), metric)]
+
+
+def _child_values(metric, child):
+    if isinstance(metric, Histogram):
+        return [bucket.get() for bucket in child._buckets] + [child._sum.get()]
+    return [child._value.get()]
+
+
+def encode_checkpoint(metrics, created_at: float) -> bytes:
+    """Serialize the state of ``metrics`` (Counters and Histograms)."""
+    strings = {}
+    records = []
+
+    def intern(value):
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    for metric in metrics:
+        name_index = intern(metric._name)
+        for label_values, child in _children(metric):
+            values = _child_values(metric, child)
+            records.append(b''.join((
+                _U32.pack(name_index),
+                _U8.pack(len(label_values)),
+                b''.join(_U32.pack(intern(value)) for value in label_values),
+                _U32.pack(len(values)),
+                struct.pack(f'<{len(values)}d', *values),
+            )))
+
+    string_table = b''.join(
+        _U32.pack(len(encoded)) + encoded
+        for encoded in (value.encode('utf-8') for value in strings)
+    )
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, created_at, len(strings), len(records))
+    return header + zlib.compress(string_table + b''.join(records), 1)
+
+
+def decode_checkpoint(data: bytes):
+    """
+    Decode a checkpoint.
+
+    Returns:
+        tuple: (created_at, list of (metric name, label values tuple, values list))
+    """
+    if len(data) < _HEADER.size:
+        raise CheckpointError("Checkpoint is truncated")
+    magic, version, created_at, string_count, record_count = _HEADER.unpack_from(data)
+    length_struct = _LENGTHS.get(version)
+    if magic != MAGIC or length_struct is None:
+        raise CheckpointError(f"Unsupported checkpoint format {magic!r} v{version}")
+    try:
+        body = zlib.decompress(data[_HEADER.size:])
+    except zlib.error as e:
+        raise CheckpointError(f"Checkpoint is corrupt: {e}")
+
+    try:
+        offset = 0
+        strings = []
+        for _ in range(string_count):
+            (length,) = length_struct.unpack_from(body, offset)
+            offset += length_struct.size
+            strings.append(body[offset:offset + length].decode('utf-8'))
+            offset += length
+
+        records = []
+        for _ in range(record_count):
+            name_index, label_count = struct.unpack_from('<IB', body, offset)
+            offset += 5
+            label_indexes = struct.unpack_from(f'<{label_count}I', body, offset)
+            offset += 4 * label_count
+            (value_count,) = length_struct.unpack_from(body, offset)
+            offset += length_struct.size
+            values = struct.unpack_from(f'<{value_count}d', body, offset)
+            offset += 8 * value_count
+            records.append((strings[name_index], tuple(strings[i] for i in label_indexes), values))
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise CheckpointError(f"Checkpoint is corrupt: {e}")
+    return created_at, records
+
+
+def restore_checkpoint(metrics, records) -> int:
+    """
+    Load decoded checkpoint records into ``metrics``.
+
+    Records for unknown metrics, or histograms whose buckets changed since the
+    checkpoint was written, are skipped. Returns the number of restored children.
+    """
+    by_name = {metric._name: metric for metric in metrics}
+    restored = 0
+    for name, label_values, values in records:
+        metric = by_name.get(name)
+        if metric is None or len(label_values) != len(metric._labelnames):
+            continue
+        child = metric.labels(*label_values) if label_values else metric
+        if isinstance(metric, Histogram):
+            if len(values) != len(child._buckets) + 1:
+                continue
+            for bucket, value in zip(child._buckets, values):
+                bucket.set(value)
+            child._sum.set(values[-1])
+        elif isinstance(metric, Counter):
+            child._value.set(values[0])
+        else:
+            continue
+        restored += 1
+    return restored
@@ -0,0 +1,139 @@
+"""
+Content encodings and exposition formats for stored metrics payloads.
+"""
+import gzip
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional
+    zstandard = None
+
+IDENTITY = 'identity'
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+# Preferred first when a scraper accepts several encodings equally
+ENCODING_PREFERENCE = (ZSTD, GZIP, IDENTITY)
+
+# Exposition formats
+FORMAT_TEXT = 'text'
+FORMAT_OPENMETRICS = 'openmetrics'
+
+OPENMETRICS_MEDIA_TYPE = 'application/openmetrics-text'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+def available_encodings():
+    """Compressed encodings supported by this Python environment."""
+    if zstandard is not None:
+        return (ZSTD, GZIP)
+    return (GZIP,)
+
+
+def parse_encodings(value: str):
+    """Parse a comma separated list of compressed encodings, dropping unsupported ones."""
+    requested = [item.strip().lower() for item in (value or '').split(',') if item.strip()]
+    supported = available_encodings()
+    return tuple(encoding for encoding in requested if encoding in supported)
+
+
+def encoded_key(metrics_key: str, encoding: str) -> str:
+    """Redis key holding the payload in ``encoding``."""
+    if encoding == IDENTITY:
+        return metrics_key
+    return f'{metrics_key}:{encoding}'
+
+
+def compress(payload: bytes, encoding: str) -> bytes:
+    """Compress ``payload`` with ``encoding``."""
+    if encoding == GZIP:
+        # mtime=0 keeps the output deterministic for identical payloads
+        return gzip.compress(payload, compresslevel=6, mtime=0)
+    if encoding == ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd encoding requires the zstandard package")
+        return zstandard.ZstdCompressor(level=3).compress(payload)
+    if encoding == IDENTITY:
+        return payload
+    raise ValueError(f"Unsupported encoding {encoding!r}")
+
+
+def decompress(payload: bytes, encoding: str) -> bytes:
+    """Reverse ``compress``."""
+    if encoding == GZIP:
+        return gzip.decompress(payload)
+    if encoding == ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd encoding requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    if encoding == IDENTITY:
+        return payload
+    raise ValueError(f"Unsupported encoding {encoding!r}")
+
+
+def choose_encoding(accept_encoding: str, offered) -> str:
+    """
+    Pick the best of ``offered`` encodings for an Accept-Encoding header.
+
+    Follows the q-value rules of RFC 9110: ``q=0`` refuses an encoding,
+    ``*`` matches anything not listed and identity is acceptable unless
+    refused. Returns None if nothing offered is acceptable.
+    """
+    weights = {}
+    for item in (accept_encoding or '').split(','):
+        parts = [part.strip() for part in item.split(';')]
+        name = parts[0].lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+
+    def weight(encoding):
+        if encoding in weights:
+            return weights[encoding]
+        if '*' in weights:
+            return weights['*']
+        return 1.0 if encoding == IDENTITY else 0.0
+
+    best, best_weight = None, 0.0
+    for encoding in ENCODING_PREFERENCE:
+        if encoding not in offered:
+            continue
+        w = weight(encoding)
+        if w > best_weight:
+            best, best_weight = encoding, w
+    return best
+
+
+def choose_format(accept: str) -> str:
+    """
+    Pick the exposition format for an Accept header.
+
+    OpenMetrics is chosen when the scraper accepts it at least as much as the
+    classic text format (Prometheus asks for ``application/openmetrics-text``
+    with q=1 and ``text/plain`` with q=0.5), otherwise the text format.
+    """
+    openmetrics_q, text_q = 0.0, 0.0
+    for item in (accept or '').split(','):
+        parts = [part.strip() for part in item.split(';')]
+        media_type = parts[0].lower()
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type == OPENMETRICS_MEDIA_TYPE:
+            openmetrics_q = max(openmetrics_q, q)
+        elif media_type in ('text/plain', 'text/*', '*/*'):
+            text_q = max(text_q, q)
+    if openmetrics_q > 0 and openmetrics_q >= text_q:
+        return FORMAT_OPENMETRICS
+    return FORMAT_TEXT
@@ -1,36 +1,123 @@
 """
 A minimal Celery exporter that tracks celery_task_succeeded_total metric using Redis.
 """
+import math
 import sys
 import threading
 import time
 
 from celery import Celery
-from prometheus_client import Counter, Histogram, CollectorRegistry, generate_latest
-import redis
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, generate_latest
+from prometheus_client.openmetrics.exposition import generate_latest as generate_openmetrics
+
+from app.monitor.cardinality import TopKLabeler, fold_label
+from app.monitor.checkpoint import (
+    CheckpointError, checkpoint_key, decode_checkpoint, encode_checkpoint, restore_checkpoint
+)
+from app.monitor.encoding import IDENTITY, compress, encoded_key
+from app.monitor.flush_scheduler import FlushScheduler
+from app.monitor.instrumentation import EventStats
+from app.monitor.pipeline import EventBuffer, OVERFLOW_BLOCK
+from app.monitor.receiver import LeanEventReceiver
+from app.monitor.redis_pool import CLOSED, OPEN, RedisAccess, describe_redis_client, get_redis
+from app.monitor.sharding import add_heartbeat, instance_metrics_key
+from app.monitor.sketch import DDSketch, sketch_window_key
+from app.monitor.storage import (
+    HashMetricsWriter, OPENMETRICS_EOF, STORAGE_HASH, STORAGE_MODES, STORAGE_TEXT, flushed_at_key, openmetrics_key,
+    version_key
+)
+from app.monitor.task_table import TaskTable
+from app.monitor.workers import WorkerRegistry
+
+# Histogram buckets for queue wait, start latency and event lag, from milliseconds up to an hour
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0,
+                   1800.0, 3600.0)
+
+# Histogram buckets for the exporter's own handler execution time, from 10us to 25ms
+HANDLER_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025)
+
+# Histogram buckets for flush duration, from 1ms to 5s
+FLUSH_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
 
 class CelerySuccessExporter:
     """
     A minimal Celery exporter that tracks Celery task metrics using Redis.
     Metrics are periodically written to Redis rather than on every event.
     """
-    def __init__(self, broker_url: str, redis_url: str = 'redis://localhost:6379/0', update_interval: float = 0.5):
-        print(f"Initializing exporter with broker={broker_url}, redis={redis_url}", file=sys.stderr)
+    def __init__(self, broker_url: str, redis_url: str = 'redis://localhost:6379/0', update_interval: float = 0.5,
+                 task_table_max_entries: int = 100000, task_table_ttl: float = 300.0,
+                 lean: bool = False, lean_name_map_size: int = 10000, redis_client=None,
+                 pipeline: bool = False, queue_size: int = 10000, batch_size: int = 500,
+                 overflow: str = OVERFLOW_BLOCK, storage_mode: str = STORAGE_TEXT,
+                 compression=(), instance_id: str = None, instance_ttl: float = 30.0,
+                 event_queue: str = None, checkpoint: bool = True, max_task_names: int = 100,
+                 runtime_sketches: bool = False, sketch_accuracy: float = 0.01, sketch_interval: float = 60.0,
+                 sketch_retention: float = 3600.0, worker_expiry: float = 300.0, recorder=None, event_source=None,
+                 flush_interval_min: float = None, flush_interval_max: float = None, openmetrics: bool = True,
+                 freshness_interval: float = 10.0, exemplars: bool = None, event_stats: bool = None):
+        redis_description = describe_redis_client(redis_client) if redis_client is not None else redis_url
+        print(f"Initializing exporter with broker={broker_url}, redis={redis_description}", file=sys.stderr)
         self.broker_url = broker_url
-        self.redis_client = redis.Redis.from_url(redis_url)
+        # Pooled client shared by the process, guarded by a circuit breaker. An existing
+        # client can be passed in instead (e.g. an in-memory stand-in for benchmarks)
+        self.redis = RedisAccess(redis_client) if redis_client is not None else get_redis(redis_url)
+        self.redis_client = self.redis.client
         self.metrics_key = 'celery_metrics'
+        
+        # Sharded mode: each instance writes under its own key and heartbeats so
+        # the metrics view can merge all live instances at scrape time
+        self.base_metrics_key = self.metrics_key
+        self.instance_id = instance_id
+        self.instance_ttl = instance_ttl
+        self._last_heartbeat = 0.0
+        if instance_id:
+            self.metrics_key = instance_metrics_key(self.base_metrics_key, instance_id)
+        
+        # Shared event queue name; instances using the same name split the event stream
+        self.event_queue = event_queue
         self.update_interval = update_interval  # Update interval in seconds
         
+        # The Redis updater sleeps until metrics change and adapts the flush interval
+        # between these bounds (both default to update_interval, a fixed interval)
+        self.flush_scheduler = FlushScheduler(
+            flush_interval_min if flush_interval_min is not None else update_interval,
+            flush_interval_max if flush_interval_max is not None else update_interval
+        )
+        self._last_update_time = time.time()
+        # Flush at least this often even without changes, so that readers can tell an
+        # idle exporter from a dead one by the age of the stored payload (0 disables)
+        self.freshness_interval = freshness_interval
+        
+        # Storage layout in Redis, see app.monitor.storage
+        if storage_mode not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode {storage_mode!r}, expected one of {STORAGE_MODES}")
+        self.storage_mode = storage_mode
+        self._hash_writer = HashMetricsWriter(self.metrics_key) if storage_mode == STORAGE_HASH else None
+        
+        # Compressed encodings stored next to the plain text payload (text mode only)
+        self.compression = tuple(compression)
+        
+        # Text mode also stores the OpenMetrics rendering, whose runtime histogram
+        # buckets carry the uuid of a task observed in them as exemplar
+        self.openmetrics = openmetrics
+        # Building an exemplar costs a dict per observation, so lean mode skips them unless asked
+        self.exemplars = openmetrics and (exemplars if exemplars is not None else not lean)
+        
         self.app = Celery(broker=broker_url)
-        self.state = self.app.events.State()
         
         # Initialize registry and metrics
         self.registry = CollectorRegistry()
         
+        # Task name label values: the hottest names keep their own series,
+        # the long tail is folded into 'other'
+        self.task_names = TopKLabeler(max_series=max_task_names, on_demote=self._fold_task_name)
+        
         # Task success counter
         self.tasks_succeeded = Counter(
             'celery_task_succeeded_total',
             'Number of succeeded Celery tasks',
+            ['name'],
             registry=self.registry
         )
         
@@ -38,6 +125,7 @@ class CelerySuccessExporter:
         self.tasks_received = Counter(
             'celery_task_received_total',
             'Number of received Celery tasks',
+            ['name'],
             registry=self.registry
         )
         
@@ -45,6 +133,7 @@ class CelerySuccessExporter:
         self.tasks_failed = Counter(
             'celery_task_failed_total',
             'Number of failed Celery tasks',
+            ['name'],
             registry=self.registry
         )
         
@@ -57,117 +146,739 @@ class CelerySuccessExporter:
             buckets=Histogram.DEFAULT_BUCKETS
         )
         
+        # Time tasks wait in the broker queue (task-sent -> task-received)
+        self.queue_wait = Histogram(
+            'celery_task_queue_wait_seconds',
+            'Seconds between a task being sent and a worker receiving it',
+            ['task_name'],
+            registry=self.registry,
+            buckets=LATENCY_BUCKETS
+        )
+        
+        # Time tasks wait on the worker before running (task-received -> task-started)
+        self.start_latency = Histogram(
+            'celery_task_start_latency_seconds',
+            'Seconds between a worker receiving a task and starting it',
+            ['task_name'],
+            registry=self.registry,
+            buckets=LATENCY_BUCKETS
+        )
+        
+        # Task table evictions counter
+        self.task_table_evictions = Counter(
+            'celery_exporter_task_table_evictions_total',
+            'Number of tasks evicted from the exporter task table',
+            ['reason'],  # 'ttl' for expired terminal tasks, 'capacity' when the table is full
+            registry=self.registry
+        )
+        
+        # Bounded table of in-flight tasks, replaces celery.events.State
+        self.task_table = TaskTable(
+            max_entries=task_table_max_entries,
+            ttl=task_table_ttl,
+            on_evict=self._on_task_table_evict
+        )
+        
+        # Task table size gauge, evaluated at collection time
+        self.task_table_size = Gauge(
+            'celery_exporter_task_table_size',
+            'Number of tasks currently held in the exporter task table',
+            registry=self.registry
+        )
+        self.task_table_size.set_function(lambda: len(self._lean_names) if self.lean else len(self.task_table))
+        
+        # Workers seen through heartbeats, exposed as per-worker gauges at collection time
+        self.workers = WorkerRegistry(expire_after=worker_expiry)
+        self.registry.register(self.workers)
+        
+        # Lean mode state: uuid -> task name for in-flight tasks, uuid -> last
+        # sent/received timestamp for latencies and cached counter and runtime
+        # histogram children per task name label
+        self.lean = lean
+        self._lean_names = {}
+        self._lean_timestamps = {}
+        self._lean_name_map_size = lean_name_map_size
+        self._lean_children = {}
+        
+        # Pipeline mode: the receive thread only enqueues events and a separate
+        # aggregation thread drains them in batches
+        self.pipeline = pipeline
+        self.batch_size = batch_size
+        self.event_buffer = None
+        if pipeline:
+            self.events_dropped = Counter(
+                'celery_exporter_events_dropped_total',
+                'Number of events dropped or reduced to counts because the event queue was full',
+                ['policy'],
+                registry=self.registry
+            )
+            self.event_buffer = EventBuffer(
+                maxsize=queue_size,
+                overflow=overflow,
+                on_drop=self.events_dropped.labels(policy=overflow).inc
+            )
+            
+            # Event queue depth gauge, evaluated at collection time
+            self.event_queue_depth = Gauge(
+                'celery_exporter_event_queue_depth',
+                'Number of events waiting in the exporter event queue',
+                registry=self.registry
+            )
+            self.event_queue_depth.set_function(lambda: len(self.event_buffer))
+            
+            # Number of events processed per aggregation batch
+            self.event_batch_size = Histogram(
+                'celery_exporter_event_batch_size',
+                'Number of events processed per aggregation batch',
+                registry=self.registry,
+                buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+            )
+        
+        # Optional runtime quantile sketches per task name, one set per time window.
+        # They are written to Redis with the metrics and merged by the metrics view.
+        self.runtime_sketches = runtime_sketches
+        self.sketch_accuracy = sketch_accuracy
+        self.sketch_interval = sketch_interval
+        self.sketch_retention = sketch_retention
+        self._sketches = {}
+        self._sketch_window = self._sketch_window_start(time.time())
+        self._dirty_sketches = set()
+        self._deleted_sketches = set()
+        self._pending_sketch_writes = {}
+        
+        # Counter and histogram state carried across restarts. It is written in the same
+        # transaction as every payload, so a restarted exporter never continues from behind
+        # values that were already scraped. Hash storage keeps counting in Redis itself,
+        # so checkpoints are only used with text storage and ``checkpoint`` is ignored otherwise.
+        self._checkpoint_metrics = [
+            self.tasks_succeeded, self.tasks_received, self.tasks_failed, self.task_runtime,
+            self.queue_wait, self.start_latency
+        ]
+        self.checkpoint = checkpoint and self.storage_mode == STORAGE_TEXT
+        
+        # Self-instrumentation, tells whether the exporter keeps up with the event stream.
+        # Per event stats are kept lock-free and exposed at collection time. Lean mode only
+        # counts events unless asked, timing every handler costs a third of its throughput.
+        # The first event after each flush wakes the Redis updater.
+        self.event_stats = EventStats(
+            HANDLER_BUCKETS, LATENCY_BUCKETS, detailed=event_stats if event_stats is not None else not lean,
+            on_first=self.flush_scheduler.notify
+        )
+        self.registry.register(self.event_stats)
+        self.flush_duration = Histogram(
+            'celery_exporter_flush_duration_seconds',
+            'Seconds spent rendering and writing metrics to Redis per flush',
+            registry=self.registry,
+            buckets=FLUSH_BUCKETS
+        )
+        self.flush_payload_bytes = Gauge(
+            'celery_exporter_flush_payload_bytes',
+            'Bytes of metrics written to Redis by the last successful flush',
+            registry=self.registry
+        )
+        self.redis_errors = Counter(
+            'celery_exporter_redis_errors_total',
+            'Number of failed Redis writes',
+            ['operation'],  # 'flush'
+            registry=self.registry
+        )
+        self.last_flush = Gauge(
+            'celery_exporter_last_flush_timestamp_seconds',
+            'Unix time of the last successful flush to Redis',
+            registry=self.registry
+        )
+        self.visible_delay = Gauge(
+            'celery_exporter_event_visible_delay_seconds',
+            'Seconds from the oldest event of the last flush being emitted until the flush was stored',
+            registry=self.registry
+        )
+        # Timestamp of the first (i.e. about the oldest) event in the flush being written
+        self._flush_oldest_event = None
+        self._flush_payload_size = 0
+        self._flushed_events = 0
+        
+        # Flush interval chosen by the scheduler, evaluated at collection time
+        self.flush_interval = Gauge(
+            'celery_exporter_flush_interval_seconds',
+            'Current interval between flushes to Redis',
+            registry=self.registry
+        )
+        self.flush_interval.set_function(lambda: self.flush_scheduler.interval)
+        
         # Set initial value if metrics exist in Redis
-        stored_metrics = self.redis_client.get(self.metrics_key)
-        if stored_metrics:
-            print("Found existing metrics in Redis", file=sys.stderr)
+        if self._hash_writer is not None:
+            stored_metrics = self._hash_writer.load(self.redis_client)
         else:
-            # Store initial metrics
+            stored_metrics = self.redis_client.get(self.metrics_key)
+        restored = self.checkpoint and self._restore_checkpoint()
+        if stored_metrics and not restored:
+            print("Found existing metrics in Redis", file=sys.stderr)
+        if not stored_metrics or restored or self._hash_writer is not None:
+            # Store initial (or restored) metrics. Hash storage only sends deltas, and its
+            # first flush deletes the gauges a previous process left behind.
             self._store_metrics()
         
         # Event handlers mapping
+        if lean:
+            handlers = {
+                'task-sent': self._lean_task_sent,
+                'task-succeeded': self._lean_task_succeeded,
+                'task-received': self._lean_task_received,
+                'task-started': self._lean_task_started,
+                'task-failed': self._lean_task_failed,
+                'worker-heartbeat': self._handle_worker_heartbeat,
+                'worker-online': self._handle_worker_heartbeat,
+                'worker-offline': self._handle_worker_offline
+            }
+        else:
+            handlers = {
+                'task-sent': self._handle_task_sent,
+                'task-succeeded': self._handle_task_succeeded,
+                'task-received': self._handle_task_received,
+                'task-started': self._handle_task_started,
+                'task-failed': self._handle_task_failed,
+                'worker-heartbeat': self._handle_worker_heartbeat,
+                'worker-online': self._handle_worker_heartbeat,
+                'worker-offline': self._handle_worker_offline
+            }
         self.handlers = {
-            'task-succeeded': self._handle_task_succeeded,
-            'task-received': self._handle_task_received,
-            'task-failed': self._handle_task_failed
+            event_type: self.event_stats.instrument(event_type, handler) for event_type, handler in handlers.items()
         }
         
+        # Optional EventRecorder appending every received event to a log, and
+        # optional callable feeding events to the handlers instead of the broker
+        # (e.g. EventReplayer.replay)
+        self.recorder = recorder
+        self.event_source = event_source
+        
         # Flag for thread control
         self._stop_event = threading.Event()
         
         # Threads
         self._monitor_thread = None
         self._redis_thread = None
+        self._aggregator_thread = None
         
         # Metrics update tracking
         self._metrics_dirty = False
         self._last_update_time = time.time()
 
+    def _on_task_table_evict(self, reason, count):
+        """Count tasks evicted from the task table."""
+        self.task_table_evictions.labels(reason=reason).inc(count)
+
+    def _fold_task_name(self, name):
+        """Fold the series of a task name that dropped out of the top names into 'other'."""
+        other = self.task_names.other_label
+        for counter in (self.tasks_received, self.tasks_succeeded, self.tasks_failed):
+            fold_label(counter, 'name', name, other)
+        for histogram in (self.task_runtime, self.queue_wait, self.start_latency):
+            fold_label(histogram, 'task_name', name, other)
+        self._lean_children.pop(name, None)
+        
+        # Move the current window's sketch as well; earlier windows keep theirs
+        sketch = self._sketches.pop(name, None)
+        if sketch is not None:
+            other_sketch = self._sketches.get(other)
+            if other_sketch is None:
+                self._sketches[other] = sketch
+            else:
+                other_sketch.merge(sketch)
+            self._dirty_sketches.discard(name)
+            self._dirty_sketches.add(other)
+            self._deleted_sketches.add(name)
+        self._metrics_dirty = True
+
     def _handle_task_succeeded(self, event):
         """Handle task-succeeded events by incrementing the counter and recording runtime."""
         task_uuid = event.get('uuid')
-        self.tasks_succeeded.inc()
-        
-        # Update the state with this event
-        self.state.event(event)
         
-        # Get the task from the state
-        task = self.state.tasks.get(task_uuid)
+        # Mark the task as finished and look up its name
+        task = self.task_table.finished(task_uuid)
+        task_name = self.task_names.label((task.name if task else None) or 'unknown')
+        self.tasks_succeeded.labels(name=task_name).inc()
         
-        if task:
-            task_name = task.name or 'unknown'
-            
-            # Get the runtime from the event directly
-            runtime = event.get('runtime')
-            if runtime is not None:
-                # Record runtime in histogram
-                self.task_runtime.labels(task_name=task_name, state='success').observe(runtime)
+        # Get the runtime from the event directly
+        runtime = event.get('runtime')
+        if runtime is not None:
+            # Record runtime in histogram, with the task as exemplar of its bucket
+            exemplar = {'task_uuid': task_uuid} if self.exemplars and task_uuid else None
+            self.task_runtime.labels(task_name=task_name, state='success').observe(runtime, exemplar)
+            if self.runtime_sketches:
+                self._observe_sketch(task_name, runtime)
             
         # Mark metrics as needing update
         self._metrics_dirty = True
 
+    def _handle_task_sent(self, event):
+        """Handle task-sent events by recording the send time."""
+        self.task_table.sent(event.get('uuid'), name=event.get('name'), timestamp=event.get('timestamp'))
+
     def _handle_task_received(self, event):
-        """Handle task-received events by incrementing the counter."""
-        self.tasks_received.inc()
+        """Handle task-received events by incrementing the counter and recording the queue wait."""
+        task_name = event.get('name')
+        label = self.task_names.label(task_name or 'unknown')
+        self.tasks_received.labels(name=label).inc()
         
-        # Update the state with this event
-        self.state.event(event)
+        # Remember the task name for the terminal event
+        timestamp = event.get('timestamp')
+        task = self.task_table.received(event.get('uuid'), name=task_name, timestamp=timestamp)
+        if task.sent is not None and timestamp is not None:
+            # Clocks of the sender and the worker may disagree slightly
+            self.queue_wait.labels(task_name=label).observe(max(0.0, timestamp - task.sent))
         
         # Mark metrics as needing update
         self._metrics_dirty = True
 
+    def _handle_task_started(self, event):
+        """Handle task-started events by recording the start time and start latency."""
+        timestamp = event.get('timestamp')
+        task = self.task_table.started(event.get('uuid'), timestamp=timestamp)
+        if task.received is not None and timestamp is not None:
+            label = self.task_names.label(task.name or 'unknown')
+            self.start_latency.labels(task_name=label).observe(max(0.0, timestamp - task.received))
+            self._metrics_dirty = True
+
     def _handle_task_failed(self, event):
         """Handle task-failed events by incrementing the counter."""
         task_uuid = event.get('uuid')
-        self.tasks_failed.inc()
         
-        # Update the state with this event
-        self.state.event(event)
+        # Mark the task as finished and look up its name
+        task = self.task_table.finished(task_uuid)
+        task_name = self.task_names.label((task.name if task else None) or 'unknown')
+        self.tasks_failed.labels(name=task_name).inc()
         
         # Mark metrics as needing update
         self._metrics_dirty = True
 
+    def _lean_children_for(self, label):
+        """
+        Return the cached children for a task name label: received, succeeded and
+        failed counters, runtime histogram, queue wait and start latency histograms.
+        """
+        children = self._lean_children.get(label)
+        if children is None:
+            children = self._lean_children[label] = (
+                self.tasks_received.labels(name=label),
+                self.tasks_succeeded.labels(name=label),
+                self.tasks_failed.labels(name=label),
+                self.task_runtime.labels(task_name=label, state='success'),
+                self.queue_wait.labels(task_name=label),
+                self.start_latency.labels(task_name=label),
+            )
+        return children
+
+    def _lean_remember_timestamp(self, uuid, timestamp):
+        """Keep the latest sent/received timestamp of a task in a bounded map."""
+        timestamps = self._lean_timestamps
+        timestamps[uuid] = timestamp
+        if len(timestamps) > self._lean_name_map_size:
+            # Drop the oldest entry, the task's next event most likely never arrived
+            del timestamps[next(iter(timestamps))]
+
+    def _lean_task_sent(self, event):
+        """Lean task-sent handler: remember when the task was sent."""
+        timestamp = event.get('timestamp')
+        uuid = event['uuid']
+        # A late task-sent must not replace the received time the start latency is measured from
+        if timestamp is not None and uuid not in self._lean_timestamps:
+            self._lean_remember_timestamp(uuid, timestamp)
+
+    def _lean_task_received(self, event):
+        """Lean task-received handler: remember the task name in a bounded map."""
+        task_name = event.get('name')
+        children = self._lean_children_for(self.task_names.label(task_name or 'unknown'))
+        children[0].inc()
+        
+        uuid = event['uuid']
+        names = self._lean_names
+        names[uuid] = task_name
+        if len(names) > self._lean_name_map_size:
+            # Drop the oldest entry, its terminal event most likely never arrived
+            del names[next(iter(names))]
+        
+        timestamp = event.get('timestamp')
+        if timestamp is not None:
+            sent = self._lean_timestamps.pop(uuid, None)
+            if sent is not None:
+                children[4].observe(max(0.0, timestamp - sent))
+            self._lean_remember_timestamp(uuid, timestamp)
+        
+        self._metrics_dirty = True
+
+    def _lean_task_started(self, event):
+        """Lean task-started handler: observe the start latency."""
+        uuid = event.get('uuid')
+        received = self._lean_timestamps.pop(uuid, None)
+        timestamp = event.get('timestamp')
+        if received is not None and timestamp is not None:
+            label = self.task_names.label(self._lean_names.get(uuid) or 'unknown')
+            self._lean_children_for(label)[5].observe(max(0.0, timestamp - received))
+            self._metrics_dirty = True
+
+    def _lean_task_succeeded(self, event):
+        """Lean task-succeeded handler: count and observe runtime through cached children."""
+        uuid = event.get('uuid')
+        self._lean_timestamps.pop(uuid, None)
+        task_name = self.task_names.label(self._lean_names.pop(uuid, None) or 'unknown')
+        children = self._lean_children_for(task_name)
+        children[1].inc()
+        
+        runtime = event.get('runtime')
+        if runtime is not None:
+            if self.exemplars and uuid:
+                children[3].observe(runtime, {'task_uuid': uuid})
+            else:
+                children[3].observe(runtime)
+            if self.runtime_sketches:
+                self._observe_sketch(task_name, runtime)
+        
+        self._metrics_dirty = True
+
+    def _lean_task_failed(self, event):
+        """Lean task-failed handler: count and forget the task."""
+        uuid = event.get('uuid')
+        self._lean_timestamps.pop(uuid, None)
+        task_name = self.task_names.label(self._lean_names.pop(uuid, None) or 'unknown')
+        self._lean_children_for(task_name)[2].inc()
+        self._metrics_dirty = True
+
+    def _handle_worker_heartbeat(self, event):
+        """Handle worker-heartbeat and worker-online events."""
+        self.workers.heartbeat(event)
+        self._metrics_dirty = True
+
+    def _handle_worker_offline(self, event):
+        """Handle worker-offline events."""
+        self.workers.offline(event)
+        self._metrics_dirty = True
+
+    def _observe_sketch(self, task_name, runtime):
+        """Add a runtime to the task's sketch for the current window."""
+        sketch = self._sketches.get(task_name)
+        if sketch is None:
+            sketch = self._sketches[task_name] = DDSketch(self.sketch_accuracy)
+        sketch.add(runtime)
+        self._dirty_sketches.add(task_name)
+
+    def _sketch_window_start(self, now):
+        return math.floor(now / self.sketch_interval) * self.sketch_interval
+
+    def _take_sketch_writes(self):
+        """
+        Serialize the sketches that changed since the last flush, starting a new
+        window when the current one is over.
+
+        Returns:
+            dict: Redis key -> (task name -> serialized sketch, task names to delete)
+        """
+        writes = self._pending_sketch_writes
+        self._pending_sketch_writes = {}
+        key = sketch_window_key(self.metrics_key, self._sketch_window)
+        sketches = self._sketches
+        window = self._sketch_window_start(time.time())
+        if window != self._sketch_window:
+            # The finished window is written one last time. Events racing with the
+            # swap may land in the old sketches after they were serialized.
+            self._sketches = {}
+            self._sketch_window = window
+        dirty, self._dirty_sketches = self._dirty_sketches, set()
+        deleted, self._deleted_sketches = self._deleted_sketches, set()
+        if dirty or deleted:
+            fields, removed = writes.setdefault(key, ({}, set()))
+            for task_name in dirty:
+                sketch = sketches.get(task_name)
+                if sketch is not None:
+                    fields[task_name] = sketch.to_bytes()
+            for task_name in deleted:
+                fields.pop(task_name, None)
+                removed.add(task_name)
+        return writes
+
+    def _queue_sketch_writes(self, pipe, writes) -> int:
+        """Queue serialized sketches on a Redis pipeline. Returns the bytes queued."""
+        size = 0
+        for key, (fields, removed) in writes.items():
+            if fields:
+                pipe.hset(key, mapping=fields)
+                size += sum(len(task_name) + len(data) for task_name, data in fields.items())
+            if removed:
+                pipe.hdel(key, *removed)
+            pipe.expire(key, int(self.sketch_retention))
+        return size
+
+    def _enqueue_event(self, event):
+        """Receiver callback in pipeline mode: queue the event for the aggregator."""
+        self.event_buffer.put(event)
+
+    def _process_batch(self, batch):
+        """Run the handlers for a batch of queued events."""
+        handlers = self.handlers
+        for event in batch:
+            handler = handlers.get(event.get('type'))
+            if handler is not None:
+                handler(event)
+        
+        # Events that did not fit in the queue are still counted
+        overflow = self.event_buffer.take_overflow()
+        if overflow:
+            self._count_overflow(overflow)
+        
+        if batch:
+            self.event_batch_size.observe(len(batch))
+
+    def _count_overflow(self, counts):
+        """
+        Increment the task counters for events that were reduced to counts.
+
+        Only the event type is kept for these, so they are counted as task name 'unknown'.
+        """
+        counters = {
+            'task-received': self.tasks_received,
+            'task-succeeded': self.tasks_succeeded,
+            'task-failed': self.tasks_failed,
+        }
+        for event_type, count in counts.items():
+            counter = counters.get(event_type)
+            if counter is not None:
+                counter.labels(name=self.task_names.label('unknown')).inc(count)
+        self._metrics_dirty = True
+
+    def _aggregate_events(self):
+        """Thread function that drains the event queue in batches."""
+        print(f"Starting event aggregator thread (batch size: {self.batch_size})", file=sys.stderr)
+        buffer = self.event_buffer
+        while not buffer.closed or len(buffer):
+            batch = buffer.drain(self.batch_size, timeout=0.1)
+            self._process_batch(batch)
+
     def _store_metrics(self):
         """Store current metrics in Redis."""
+        if not self.redis.breaker.allow():
+            # Redis is down and we are backing off, metrics stay dirty for later
+            return
+        
+        started = time.perf_counter()
+        self.flush_scheduler.flushing()
+        sketch_writes = self._take_sketch_writes() if self.runtime_sketches else {}
+        # Cleared before taking the snapshot so events arriving meanwhile mark it dirty again
+        self._metrics_dirty = False
         try:
-            metrics = generate_latest(self.registry)
-            self.redis_client.set(self.metrics_key, metrics)
-            
-            # Reset the dirty flag and update time
-            self._metrics_dirty = False
-            self._last_update_time = time.time()
+            pipe = self.redis_client.pipeline(transaction=True)
+            commit = self._queue_metrics(pipe, sketch_writes)
+            if commit is not None:
+                pipe.execute()
+                commit()
         except Exception as e:
-            print(f"Error storing metrics: {e}", file=sys.stderr)
+            self._store_failed(e, sketch_writes, started)
+            return
+        self._store_succeeded(started)
+
+    def _queue_metrics(self, pipe, sketch_writes):
+        """
+        Queue the writes of one flush on a (sync or asyncio) Redis pipeline.
+        
+        Returns a callable to run once the pipeline executed, or None if there
+        is nothing to write.
+        """
+        now = time.time()
+        # Everything handled so far is part of the snapshot rendered below
+        self._flush_oldest_event = self.event_stats.take_oldest()
+        if self._hash_writer is not None:
+            # Write only changed samples as deltas in one round-trip
+            changes = self._hash_writer.prepare(self.registry)
+            if changes is None and not (sketch_writes or self.instance_id or self._freshness_due(now)):
+                self._flush_payload_size = 0
+                return None
+            if changes is not None:
+                size = self._hash_writer.queue(pipe, changes)
+            else:
+                # Readers refetch the flush time along with the payload when the version moves
+                size = 0
+                pipe.incr(self._hash_writer.version_key)
+            commit = lambda: self._hash_writer.commit(changes)
+        else:
+            payloads = [(self.metrics_key, generate_latest(self.registry))]
+            if self.openmetrics:
+                # The view appends the terminator after its own freshness metrics
+                payloads.append((
+                    openmetrics_key(self.metrics_key),
+                    generate_openmetrics(self.registry)[:-len(OPENMETRICS_EOF)]
+                ))
+            # Store the payloads and bump their version atomically
+            size = 0
+            for key, metrics in payloads:
+                pipe.set(key, metrics)
+                size += len(metrics)
+                for encoding in self.compression:
+                    # Compress once per flush instead of once per scrape
+                    compressed = compress(metrics, encoding)
+                    pipe.set(encoded_key(key, encoding), compressed)
+                    size += len(compressed)
+            if self.checkpoint:
+                # Taken after the payloads, so it is never behind them
+                checkpoint = encode_checkpoint(self._checkpoint_metrics, now)
+                pipe.set(checkpoint_key(self.metrics_key), checkpoint)
+                size += len(checkpoint)
+            pipe.incr(version_key(self.metrics_key))
+            commit = lambda: None
+        pipe.set(flushed_at_key(self.metrics_key), repr(now))
+        if self.instance_id:
+            self._add_heartbeat(pipe)
+        if sketch_writes:
+            size += self._queue_sketch_writes(pipe, sketch_writes)
+        self._flush_payload_size = size
+        return commit
+
+    def _store_failed(self, error, sketch_writes, started):
+        """Report a failed flush and keep what it could not write for the next one."""
+        self.flush_duration.observe(time.perf_counter() - started)
+        self.redis_errors.labels(operation='flush').inc()
+        # Retry the metrics and sketches with the next flush
+        self._metrics_dirty = True
+        self._pending_sketch_writes = sketch_writes
+        self.event_stats.keep_oldest(self._flush_oldest_event)
+        if self.redis.breaker.record_failure(error) == OPEN:
+            print(f"Redis unavailable, pausing metric writes: {error}", file=sys.stderr)
+        else:
+            print(f"Error storing metrics: {error}", file=sys.stderr)
+
+    def _store_succeeded(self, started):
+        """Bookkeeping after a successful flush."""
+        if self.redis.breaker.record_success() != CLOSED:
+            print("Redis reachable again, resuming metric writes", file=sys.stderr)
+        
+        # Seen in the payload of the next flush
+        duration = time.perf_counter() - started
+        self.flush_duration.observe(duration)
+        self.flush_payload_bytes.set(self._flush_payload_size)
+        
+        # Adapt the flush interval to the flush cost and event rate
+        now = time.time()
+        processed = self.event_stats.processed()
+        self.flush_scheduler.record_flush(duration, processed - self._flushed_events, now - self._last_update_time)
+        self._flushed_events = processed
+        self._last_update_time = now
+        self.last_flush.set(now)
+        if self._flush_oldest_event is not None:
+            # Clocks of the worker and the exporter may disagree slightly
+            self.visible_delay.set(max(0.0, now - self._flush_oldest_event))
+        if self.instance_id:
+            self._last_heartbeat = self._last_update_time
+
+    def _restore_checkpoint(self):
+        """Load counter and histogram state from the checkpoint in Redis. Returns True if restored."""
+        start = time.perf_counter()
+        data = self.redis_client.get(checkpoint_key(self.metrics_key))
+        if not data:
+            return False
+        try:
+            created_at, records = decode_checkpoint(data)
+        except CheckpointError as e:
+            print(f"Ignoring unreadable metrics checkpoint: {e}", file=sys.stderr)
+            return False
+        restored = restore_checkpoint(self._checkpoint_metrics, records)
+        # Keep the restored task names as their own series
+        for metric in (self.tasks_received, self.tasks_succeeded, self.tasks_failed):
+            for (task_name,) in list(metric._metrics):
+                self.task_names.admit(task_name)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(
+            f"Restored {restored} series from checkpoint taken {time.time() - created_at:.1f}s ago "
+            f"in {elapsed_ms:.1f}ms",
+            file=sys.stderr
+        )
+        return True
+
+    def _storage_keys(self):
+        """Redis keys this exporter writes its metrics to."""
+        if self._hash_writer is not None:
+            return (self._hash_writer.samples_key, self._hash_writer.families_key, self._hash_writer.version_key,
+                    flushed_at_key(self.metrics_key))
+        payload_keys = (self.metrics_key, openmetrics_key(self.metrics_key)) if self.openmetrics else (self.metrics_key,)
+        metadata_keys = (
+            version_key(self.metrics_key), checkpoint_key(self.metrics_key), flushed_at_key(self.metrics_key)
+        )
+        return metadata_keys + tuple(
+            encoded_key(key, encoding) for key in payload_keys for encoding in (IDENTITY,) + self.compression
+        )
+
+    def _add_heartbeat(self, pipe):
+        """Queue this instance's heartbeat on a Redis pipeline."""
+        add_heartbeat(pipe, self.base_metrics_key, self.instance_id, self._storage_keys(), time.time(), self.instance_ttl)
+
+    def _freshness_due(self, now):
+        """Whether an idle exporter must flush to show that its stored payload is still current."""
+        return bool(self.freshness_interval) and now - self._last_update_time >= self.freshness_interval
+
+    def _heartbeat_due(self, now):
+        """Whether a sharded instance must write to Redis to stay alive even if idle."""
+        return bool(self.instance_id) and now - self._last_heartbeat >= self.instance_ttl / 3
 
     def _redis_updater(self):
-        """Thread function that periodically updates Redis with the latest metrics."""
-        print(f"Starting Redis updater thread (interval: {self.update_interval}s)", file=sys.stderr)
+        """Thread function that flushes metrics to Redis when they changed, as scheduled by flush_scheduler."""
+        scheduler = self.flush_scheduler
+        print(
+            f"Starting Redis updater thread (interval: {scheduler.min_interval}-{scheduler.max_interval}s)",
+            file=sys.stderr
+        )
         self._last_update_time = time.time()
+        # Failed flushes do not move _last_update_time, retries are paced from the last attempt
+        last_attempt = self._last_update_time
         
         while not self._stop_event.is_set():
-            # Calculate time since last update
             current_time = time.time()
-            time_since_last_update = current_time - self._last_update_time
+            deadlines = []
+            
+            # Worker liveness and heartbeat ages change without events
+            if self._metrics_dirty or len(self.workers):
+                deadlines.append(scheduler.next_flush(max(self._last_update_time, last_attempt)))
+            if self.instance_id:
+                deadlines.append(max(self._last_heartbeat + self.instance_ttl / 3, last_attempt + scheduler.interval))
+            if self.freshness_interval:
+                freshness_at = self._last_update_time + self.freshness_interval
+                deadlines.append(max(freshness_at, last_attempt + scheduler.interval))
+            if deadlines and current_time >= min(deadlines):
+                last_attempt = current_time
+                self._store_metrics()
+                continue
             
-            # Only update if the update interval has elapsed, regardless of whether metrics are dirty
-            if time_since_last_update >= self.update_interval:
-                if self._metrics_dirty:
-                    self._store_metrics()
-                else:
-                    # Still update the last update time even if we don't store metrics
-                    self._last_update_time = current_time
-                
-            # Sleep for a short time to check frequently but not consume too much CPU
-            self._stop_event.wait(min(0.1, self.update_interval / 2))
+            # Sleep until metrics change, something is due or the exporter stops
+            timeout = min(deadlines) - current_time if deadlines else None
+            if not self._metrics_dirty and scheduler.changed_at is not None:
+                # Events arrived but left metrics clean so far (e.g. only task-sent), later
+                # events of the same flush do not notify again
+                timeout = scheduler.min_interval if timeout is None else min(timeout, scheduler.min_interval)
+            scheduler.wait(timeout)
     
+    def _receiver_handlers(self):
+        """Handlers the event receiver calls on the receive thread."""
+        if self.pipeline:
+            # Only decode and enqueue on the receive thread
+            handlers = {event_type: self._enqueue_event for event_type in self.handlers}
+        else:
+            handlers = self.handlers
+        if self.recorder is not None:
+            handlers = self.recorder.wrap_handlers(handlers)
+        return handlers
+
     def _monitor_events(self):
         """Thread function that monitors Celery events."""
+        handlers = self._receiver_handlers()
+        if self.event_source is not None:
+            self.event_source(handlers)
+            return
+        
         with self.app.connection() as connection:
             print("Connected to broker, starting event capture...", file=sys.stderr)
-            recv = self.app.events.Receiver(
-                connection, 
-                handlers=self.handlers
-            )
+            if self.lean:
+                recv = LeanEventReceiver(connection, handlers=handlers, app=self.app, node_id=self.event_queue)
+            else:
+                recv = self.app.events.Receiver(
+                    connection, 
+                    handlers=handlers,
+                    node_id=self.event_queue
+                )
             recv.capture(limit=None, timeout=None, wakeup=True)
 
     def start(self):
@@ -178,6 +889,11 @@ class CelerySuccessExporter:
         self._redis_thread = threading.Thread(target=self._redis_updater, daemon=True)
         self._redis_thread.start()
         
+        # Start the event aggregator thread
+        if self.pipeline:
+            self._aggregator_thread = threading.Thread(target=self._aggregate_events, daemon=True)
+            self._aggregator_thread.start()
+        
         # Start the event monitor thread
         self._monitor_thread = threading.Thread(target=self._monitor_events, daemon=True)
         self._monitor_thread.start()
@@ -190,10 +906,19 @@ class CelerySuccessExporter:
         
         # Signal threads to stop
         self._stop_event.set()
+        self.flush_scheduler.notify()
         
         # Wait for threads to finish
         if self._monitor_thread:
             self._monitor_thread.join(timeout=1.0)
+        if self.recorder is not None:
+            self.recorder.close()
+        
+        # Let the aggregator process what is already queued
+        if self.event_buffer is not None:
+            self.event_buffer.close()
+        if self._aggregator_thread:
+            self._aggregator_thread.join(timeout=1.0)
         
         if self._redis_thread:
             self._redis_thread.join(timeout=1.0)
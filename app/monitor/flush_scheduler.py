@@ -0,0 +1,103 @@
+"""
+Event-driven, rate-adaptive scheduling of the exporter's Redis flushes.
+"""
+import threading
+import time
+
+
+class FlushScheduler:
+    """
+    Decides when the Redis updater flushes and lets it sleep until then.
+
+    The updater blocks in ``wait`` until ``notify`` reports that events
+    arrived, instead of polling a dirty flag. The exporter notifies once per
+    flush, on the first event handled after it, so handlers stay cheap.
+    Changes arriving within ``min_interval`` of the first one, or before the
+    current interval since the previous flush elapsed, are coalesced into one
+    flush.
+
+    After every flush the interval is recomputed from the smoothed flush cost
+    and event rate: flushes may take up to ``max_flush_share`` of the time
+    while the event stream is quiet, and a smaller share as it gets busier,
+    since a flush holds the GIL while events wait::
+
+        share = max_flush_share / (1 + event_rate / rate_scale)
+        interval = clamp(flush_cost / share, min_interval, max_interval)
+
+    With ``min_interval == max_interval`` the interval is fixed.
+
+    Args:
+        min_interval (float): Floor of the flush interval in seconds.
+        max_interval (float): Ceiling of the flush interval in seconds.
+        max_flush_share (float): Share of time flushes may take on a quiet event stream.
+        rate_scale (float): Event rate (events/sec) at which the share is halved.
+        smoothing (float): Weight of the newest flush in the moving averages.
+        clock (callable, optional): Time source, defaults to time.time.
+    """
+    def __init__(self, min_interval: float, max_interval: float, max_flush_share: float = 0.1,
+                 rate_scale: float = 1000.0, smoothing: float = 0.3, clock=time.time):
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError("Flush intervals must satisfy 0 < min_interval <= max_interval")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_flush_share = max_flush_share
+        self.rate_scale = rate_scale
+        self.smoothing = smoothing
+        self.clock = clock
+
+        self.interval = min_interval
+        self.flush_cost = None
+        self.event_rate = None
+        # Time of the first change since the last flush started
+        self.changed_at = None
+
+        self._notified = False
+        self._condition = threading.Condition()
+
+    def notify(self):
+        """Report that metrics changed (or that the updater must re-check). Safe from any thread."""
+        with self._condition:
+            if self.changed_at is None:
+                self.changed_at = self.clock()
+            self._notified = True
+            self._condition.notify()
+
+    def wait(self, timeout=None):
+        """Block until ``notify`` is called or ``timeout`` seconds passed. Returns True if notified."""
+        with self._condition:
+            if not self._notified:
+                self._condition.wait(timeout)
+            notified, self._notified = self._notified, False
+            return notified
+
+    def next_flush(self, last_flush: float) -> float:
+        """Time at which dirty metrics should be flushed, given the previous flush time."""
+        due = last_flush + self.interval
+        if self.changed_at is not None:
+            # Let a burst that starts after a quiet period build up before flushing it
+            due = max(due, self.changed_at + self.min_interval)
+        return due
+
+    def flushing(self):
+        """Mark the start of a flush: changes from now on belong to the next one."""
+        with self._condition:
+            self.changed_at = None
+
+    def record_flush(self, duration: float, events: int, elapsed: float):
+        """
+        Adapt the interval after a flush.
+
+        Args:
+            duration (float): Seconds the flush took.
+            events (int): Events handled since the previous flush.
+            elapsed (float): Seconds since the previous flush.
+        """
+        rate = events / elapsed if elapsed > 0 else 0.0
+        weight = self.smoothing
+        if self.flush_cost is None:
+            self.flush_cost, self.event_rate = duration, rate
+        else:
+            self.flush_cost += weight * (duration - self.flush_cost)
+            self.event_rate += weight * (rate - self.event_rate)
+        share = self.max_flush_share / (1.0 + self.event_rate / self.rate_scale)
+        self.interval = min(self.max_interval, max(self.min_interval, self.flush_cost / share))
@@ -0,0 +1,122 @@
+"""
+Serve /metrics straight from the exporter process.
+
+Scrapes read the exporter's live registry instead of the payload it last
+wrote to Redis, so they are as fresh as the events handled so far and skip
+the web app and Redis. The Redis path keeps working alongside, for
+deployments where Prometheus can only reach the web app.
+"""
+import base64
+import binascii
+import hmac
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.openmetrics.exposition import generate_latest as generate_openmetrics
+
+from app.monitor.encoding import (
+    FORMAT_OPENMETRICS, IDENTITY, OPENMETRICS_CONTENT_TYPE, available_encodings, choose_encoding, choose_format,
+    compress
+)
+
+METRICS_PATH = '/metrics'
+
+
+def check_basic_auth(header: str, auth_user: str, auth_pass: str) -> bool:
+    """Whether an Authorization header carries the configured credentials. No credentials means no auth."""
+    if not auth_user or not auth_pass:
+        return True
+    if not header or not header.startswith('Basic '):
+        return False
+    try:
+        username, password = base64.b64decode(header[6:]).decode('utf-8').split(':', 1)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return False
+    # Compare both in constant time so the response time does not reveal which one was wrong
+    user_ok = hmac.compare_digest(username.encode(), auth_user.encode())
+    pass_ok = hmac.compare_digest(password.encode(), auth_pass.encode())
+    return user_ok and pass_ok
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    server_version = 'CeleryExporter'
+
+    def do_GET(self):
+        server = self.server
+        if self.path.split('?', 1)[0] != METRICS_PATH:
+            self._respond(404, b'Not found\n')
+            return
+        if not check_basic_auth(self.headers.get('Authorization'), server.auth_user, server.auth_pass):
+            self._respond(401, b'Unauthorized: Basic authentication required\n',
+                          {'WWW-Authenticate': 'Basic realm="Metrics Authentication"'})
+            return
+
+        if choose_format(self.headers.get('Accept', '')) == FORMAT_OPENMETRICS:
+            body, content_type = generate_openmetrics(server.registry), OPENMETRICS_CONTENT_TYPE
+        else:
+            body, content_type = generate_latest(server.registry), CONTENT_TYPE_LATEST
+        offered = set(available_encodings()) | {IDENTITY}
+        encoding = choose_encoding(self.headers.get('Accept-Encoding', ''), offered) or IDENTITY
+        headers = {'Content-Type': content_type, 'Vary': 'Accept, Accept-Encoding'}
+        if encoding != IDENTITY:
+            body = compress(body, encoding)
+            headers['Content-Encoding'] = encoding
+        self._respond(200, body, headers)
+
+    def _respond(self, status, body, headers=None):
+        self.send_response(status)
+        headers = headers or {'Content-Type': 'text/plain; charset=utf-8'}
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the exporter's log
+        pass
+
+
+class MetricsServer:
+    """
+    Embedded HTTP server exposing a registry on /metrics.
+
+    Requests are handled on their own threads; rendering takes the
+    registry's per-metric locks only, so it does not block event handling.
+
+    Args:
+        registry (CollectorRegistry): Registry to render, usually the exporter's.
+        host (str): Address to listen on.
+        port (int): Port to listen on, 0 picks a free one.
+        auth_user (str, optional): Basic auth username, auth is off unless both are set.
+        auth_pass (str, optional): Basic auth password.
+    """
+    def __init__(self, registry, host: str = '0.0.0.0', port: int = 9808, auth_user: str = '', auth_pass: str = ''):
+        self._server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self._server.daemon_threads = True
+        self._server.registry = registry
+        self._server.auth_user = auth_user
+        self._server.auth_pass = auth_pass
+        self._thread = None
+
+    @property
+    def server_address(self):
+        """(host, port) the server is bound to."""
+        return self._server.server_address[:2]
+
+    def start(self):
+        """Serve requests on a background thread."""
+        host, port = self.server_address
+        print(f"Serving metrics on http://{host}:{port}{METRICS_PATH}", file=sys.stderr)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving and release the port."""
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        self._server.server_close()
@@ -0,0 +1,161 @@
+"""
+Per-event self-instrumentation of the exporter: events processed, handler
+execution time, event lag and the first event not flushed yet.
+"""
+import time
+from bisect import bisect_left
+
+from prometheus_client.core import CounterMetricFamily, HistogramMetricFamily
+from prometheus_client.utils import floatToGoString
+
+# No event handled since the last take_oldest()
+_EMPTY = object()
+
+
+class EventStats:
+    """
+    Counts handled events per type and histograms their handler time and lag.
+
+    prometheus_client metrics take a lock per sample update, which on the
+    lean path costs more than the handlers themselves. The stats here are
+    plain lists updated by the single thread running the handlers and turned
+    into metric families at collection time. A collection racing with an
+    update may see that event in one family but not the other; every count is
+    derived from the bucket counts, so each histogram stays consistent.
+
+    Timing handlers and event lag still costs about a third of the lean
+    throughput. Without ``detailed`` handlers are only counted, and the
+    handler duration and event lag histograms are not exposed.
+
+    ``on_first`` is called after the first event handled since the last
+    ``take_oldest``, i.e. once per flush, so that the Redis updater can sleep
+    until events arrive without the handlers notifying it every time.
+
+    Args:
+        handler_buckets (tuple): Upper bounds of the handler time histogram.
+        lag_buckets (tuple): Upper bounds of the event lag histogram.
+        clock (callable, optional): Wall clock compared to event timestamps, defaults to time.time.
+        detailed (bool, optional): Time handlers and event lag, defaults to True.
+        on_first (callable, optional): Called without arguments after the first event since the last flush.
+    """
+    def __init__(self, handler_buckets, lag_buckets, clock=time.time, detailed: bool = True, on_first=None):
+        self.handler_buckets = tuple(handler_buckets)
+        self.lag_buckets = tuple(lag_buckets)
+        self.clock = clock
+        self.detailed = detailed
+        self.on_first = on_first if on_first is not None else lambda: None
+        # event type -> [duration sum, bucket counts (last one is +Inf)]
+        self._handlers = {}
+        # event type -> [count], for handlers that are only counted
+        self._counts = {}
+        # [lag sum, bucket counts]
+        self._lag = [0.0, [0] * (len(self.lag_buckets) + 1)]
+        # [timestamp (or None) of the first event handled since the last take_oldest(), _EMPTY if none was]
+        self._oldest = [_EMPTY]
+
+    def instrument(self, event_type, handler):
+        """Wrap ``handler`` to record its execution time and the event lag, or only to count it."""
+        if not self.detailed:
+            return self._count(event_type, handler)
+        stats = self._handlers.setdefault(event_type, [0.0, [0] * (len(self.handler_buckets) + 1)])
+        handler_counts = stats[1]
+        handler_bounds = self.handler_buckets
+        lag = self._lag
+        lag_counts = lag[1]
+        lag_bounds = self.lag_buckets
+        perf_counter = time.perf_counter
+        clock = self.clock
+        oldest = self._oldest
+        on_first = self.on_first
+
+        def instrumented(event):
+            start = perf_counter()
+            handler(event)
+            elapsed = perf_counter() - start
+            stats[0] += elapsed
+            handler_counts[bisect_left(handler_bounds, elapsed)] += 1
+            timestamp = event.get('timestamp')
+            if timestamp is not None:
+                # Clocks of the worker and the exporter may disagree slightly
+                delay = max(0.0, clock() - timestamp)
+                lag[0] += delay
+                lag_counts[bisect_left(lag_bounds, delay)] += 1
+            if oldest[0] is _EMPTY:
+                oldest[0] = timestamp
+                on_first()
+
+        return instrumented
+
+    def _count(self, event_type, handler):
+        """Wrap ``handler`` to count its events and remember the first timestamp."""
+        count = self._counts.setdefault(event_type, [0])
+        oldest = self._oldest
+        on_first = self.on_first
+
+        def counted(event):
+            handler(event)
+            count[0] += 1
+            if oldest[0] is _EMPTY:
+                oldest[0] = event.get('timestamp')
+                on_first()
+
+        return counted
+
+    def take_oldest(self):
+        """
+        Return the timestamp of the oldest event handled since the last call, None if there was none.
+        
+        Events arrive about in the order they were emitted, so the first one
+        handled stands in for the oldest, which saves a comparison per event.
+        If that event had no timestamp, None is returned as well. An event
+        handled while this runs may be missed, the lag of the next flush is
+        then computed from a slightly newer event.
+        """
+        timestamp = self._oldest[0]
+        self._oldest[0] = _EMPTY
+        return timestamp if timestamp is not _EMPTY else None
+
+    def keep_oldest(self, timestamp):
+        """Put back a timestamp from ``take_oldest`` whose events did not get flushed."""
+        if timestamp is not None:
+            # Handled before anything recorded since
+            self._oldest[0] = timestamp
+
+    def processed(self) -> int:
+        """Total number of events handled so far."""
+        return (sum(sum(counts) for _, counts in list(self._handlers.values()))
+                + sum(count for count, in list(self._counts.values())))
+
+    @staticmethod
+    def _cumulative_buckets(bounds, counts):
+        buckets = []
+        total = 0
+        for bound, count in zip(bounds + (float('inf'),), counts):
+            total += count
+            buckets.append((floatToGoString(bound), total))
+        return buckets, total
+
+    def collect(self):
+        """Yield the event metrics (prometheus_client custom collector interface)."""
+        processed = CounterMetricFamily(
+            'celery_exporter_events_processed', 'Number of events processed by the exporter', labels=['type']
+        )
+        duration = HistogramMetricFamily(
+            'celery_exporter_handler_duration_seconds', 'Seconds spent in the exporter event handlers',
+            labels=['type']
+        )
+        for event_type, (count,) in list(self._counts.items()):
+            processed.add_metric([event_type], count)
+        if not self.detailed:
+            return [processed]
+        for event_type, (total, counts) in list(self._handlers.items()):
+            buckets, count = self._cumulative_buckets(self.handler_buckets, list(counts))
+            processed.add_metric([event_type], count)
+            duration.add_metric([event_type], buckets, total)
+
+        lag = HistogramMetricFamily(
+            'celery_exporter_event_lag_seconds', 'Seconds between an event being emitted and the exporter handling it'
+        )
+        buckets, _ = self._cumulative_buckets(self.lag_buckets, list(self._lag[1]))
+        lag.add_metric([], buckets, self._lag[0])
+        return [processed, duration, lag]
@@ -0,0 +1,140 @@
+"""
+In-memory stand-in for the subset of the Redis client the exporter uses.
+
+Used by the tests and the benchmarks; not meant for production use.
+"""
+
+
+def _encode(value):
+    """Store values as bytes, like Redis returns them."""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, float):
+        return repr(value).encode()
+    return str(value).encode()
+
+
+class MemoryPipeline:
+    """Queues commands and runs them against the owning MemoryRedis on execute()."""
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        self._client.round_trips += 1
+        results = [method(*args, **kwargs) for method, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+
+class MemoryRedis:
+    """Dict-backed replacement for redis.Redis, good enough for tests and benchmarks."""
+    def __init__(self):
+        self.data = {}
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = _encode(value)
+        return True
+
+    def delete(self, *keys):
+        return sum(1 for key in keys if self.data.pop(key, None) is not None)
+
+    def exists(self, *keys):
+        return sum(1 for key in keys if key in self.data)
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        hash_ = self.data.setdefault(key, {})
+        added = 0
+        for field, value in items.items():
+            field = _encode(field)
+            added += field not in hash_
+            hash_[field] = _encode(value)
+        return added
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def hdel(self, key, *fields):
+        hash_ = self.data.get(key, {})
+        return sum(hash_.pop(_encode(field), None) is not None for field in fields)
+
+    def hincrbyfloat(self, key, field, amount=1.0):
+        hash_ = self.data.setdefault(key, {})
+        field = _encode(field)
+        value = float(hash_.get(field, b'0')) + amount
+        hash_[field] = _encode(value)
+        return value
+
+    def incr(self, key, amount=1):
+        value = int(self.data.get(key, b'0')) + amount
+        self.data[key] = _encode(value)
+        return value
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+    def zadd(self, key, mapping):
+        zset = self.data.setdefault(key, {})
+        added = 0
+        for member, score in mapping.items():
+            member = _encode(member)
+            added += member not in zset
+            zset[member] = float(score)
+        return added
+
+    def zrangebyscore(self, key, min, max):
+        low, high = float(min), float(max)
+        zset = self.data.get(key, {})
+        return [member for member, score in sorted(zset.items(), key=lambda item: item[1]) if low <= score <= high]
+
+    def zremrangebyscore(self, key, min, max):
+        low, high = float(min), float(max)
+        zset = self.data.get(key, {})
+        removed = [member for member, score in zset.items() if low <= score <= high]
+        for member in removed:
+            del zset[member]
+        return len(removed)
+
+
+class AsyncMemoryPipeline(MemoryPipeline):
+    """MemoryPipeline whose execute() is awaited, like redis.asyncio pipelines."""
+    async def execute(self):
+        return MemoryPipeline.execute(self)
+
+
+class AsyncMemoryRedis:
+    """redis.asyncio flavoured view of a MemoryRedis; commands are coroutines."""
+    def __init__(self, client=None):
+        self.client = client if client is not None else MemoryRedis()
+        self.closed = False
+
+    def pipeline(self, transaction=True):
+        return AsyncMemoryPipeline(self.client)
+
+    async def aclose(self):
+        self.closed = True
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        async def command(*args, **kwargs):
+            return method(*args, **kwargs)
+        return command
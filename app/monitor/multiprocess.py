@@ -0,0 +1,411 @@
+"""
+Multi-process event aggregation for the Celery exporter.
+
+The exporter process receives and decodes events as in pipeline mode. Its
+aggregator thread no longer runs the task handlers itself: it resolves the
+task name label, reduces each task event to a small tuple and fans the tuples
+out to worker processes, partitioned by task uuid so every event of a task
+reaches the same worker. Each worker aggregates into its own shared memory
+array of counters and histogram buckets; with a single writer per array the
+hot path takes no locks. The aggregator thread periodically reads the arrays
+and adds what changed to the exporter's prometheus metrics, which the Redis
+updater renders and stores as usual (checkpoints, storage modes, sharding and
+the cardinality guard all work unchanged).
+
+Array layout (float64 values), per worker:
+
+    header:    tasks tracked, tasks evicted for capacity
+    per slot:  received, succeeded, failed counters, then the runtime, queue
+               wait and start latency histograms as raw bucket counts + sum
+
+A slot is a task name label. Slots are assigned by the exporter process; a
+slot whose name is folded into ``other`` by the cardinality guard is
+relabeled ``other`` for good and the name gets a fresh slot if it comes back.
+
+This mode is experimental. Labelling and dispatch stay on the exporter
+process, which serializes the work, and it has only been measured on a
+single core, where it is slower than one process.
+"""
+import multiprocessing
+import signal
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from functools import partial
+from multiprocessing import shared_memory
+
+from prometheus_client import Histogram
+
+from app.monitor.exporter import LATENCY_BUCKETS, CelerySuccessExporter
+
+# Event codes sent to the workers
+SENT, RECEIVED, STARTED, SUCCEEDED, FAILED = range(5)
+
+TASK_EVENT_CODES = {
+    'task-sent': SENT,
+    'task-received': RECEIVED,
+    'task-started': STARTED,
+    'task-succeeded': SUCCEEDED,
+    'task-failed': FAILED,
+}
+
+# Fixed slots
+OTHER_SLOT = 0
+UNKNOWN_SLOT = 1
+UNKNOWN_LABEL = 'unknown'
+
+# Header fields
+TRACKED = 0
+EVICTED = 1
+HEADER_SIZE = 2
+
+# Seconds a worker gets to finish its queued batches on shutdown before it is terminated
+WORKER_STOP_TIMEOUT = 5.0
+
+
+def _add_histogram_counts(child, bucket_deltas, sum_delta):
+    """
+    Add raw (non-cumulative) bucket counts and a sum to a histogram child.
+
+    prometheus_client can only observe single values, so this relies on the
+    same internals (``_buckets``, ``_sum``) as app.monitor.checkpoint.
+    """
+    for bucket, delta in zip(child._buckets, bucket_deltas):
+        if delta:
+            bucket.inc(delta)
+    if sum_delta:
+        child._sum.inc(sum_delta)
+
+
+class SlotLayout:
+    """
+    Offsets of the values in a worker's shared array.
+
+    Args:
+        runtime_bounds (tuple): Upper bounds of the runtime histogram, +Inf included.
+        latency_bounds (tuple): Upper bounds of the latency histograms, +Inf included.
+        slots (int): Number of task name slots.
+    """
+    def __init__(self, runtime_bounds, latency_bounds, slots: int):
+        self.runtime_bounds = tuple(runtime_bounds)
+        self.latency_bounds = tuple(latency_bounds)
+        self.slots = slots
+        self.runtime = 3
+        self.queue_wait = self.runtime + len(self.runtime_bounds) + 1
+        self.start_latency = self.queue_wait + len(self.latency_bounds) + 1
+        self.slot_size = self.start_latency + len(self.latency_bounds) + 1
+        self.length = HEADER_SIZE + slots * self.slot_size
+        self.size = self.length * 8
+
+    def base(self, slot: int) -> int:
+        """Index of the first value of ``slot``."""
+        return HEADER_SIZE + slot * self.slot_size
+
+
+def _observe(values, offset, bounds, value):
+    values[offset + bisect_left(bounds, value)] += 1
+    values[offset + len(bounds)] += value
+
+
+def apply_batch(values, tasks, batch, layout: SlotLayout, max_tasks: int):
+    """
+    Aggregate a batch of event tuples into ``values`` (a worker's shared array).
+
+    Args:
+        values: Writable sequence of floats laid out as ``layout``.
+        tasks (dict): The worker's in-flight tasks, uuid -> [slot, sent, received].
+        batch (list): (code, uuid, slot, timestamp, runtime) tuples.
+        layout (SlotLayout): Array layout.
+        max_tasks (int): Maximum number of in-flight tasks kept.
+    """
+    runtime_bounds, latency_bounds = layout.runtime_bounds, layout.latency_bounds
+    base = layout.base
+    for code, uuid, slot, timestamp, runtime in batch:
+        if code == RECEIVED:
+            offset = base(slot)
+            values[offset] += 1
+            entry = tasks.get(uuid)
+            if entry is None:
+                entry = tasks[uuid] = [slot, None, timestamp]
+            else:
+                entry[0] = slot
+                if entry[1] is not None and timestamp is not None:
+                    # Clocks of the sender and the worker may disagree slightly
+                    _observe(values, offset + layout.queue_wait, latency_bounds, max(0.0, timestamp - entry[1]))
+                entry[2] = timestamp
+        elif code == SENT:
+            if timestamp is None:
+                continue
+            entry = tasks.get(uuid)
+            if entry is None:
+                tasks[uuid] = [UNKNOWN_SLOT, timestamp, None]
+            else:
+                entry[1] = timestamp
+        elif code == STARTED:
+            entry = tasks.get(uuid)
+            if entry is not None and entry[2] is not None and timestamp is not None:
+                offset = base(entry[0]) + layout.start_latency
+                _observe(values, offset, latency_bounds, max(0.0, timestamp - entry[2]))
+            continue
+        else:
+            entry = tasks.pop(uuid, None)
+            offset = base(entry[0] if entry is not None else UNKNOWN_SLOT)
+            if code == SUCCEEDED:
+                values[offset + 1] += 1
+                if runtime is not None:
+                    _observe(values, offset + layout.runtime, runtime_bounds, runtime)
+            else:
+                values[offset + 2] += 1
+            continue
+        if len(tasks) > max_tasks:
+            # Drop the oldest task, its later events most likely never arrive
+            del tasks[next(iter(tasks))]
+            values[EVICTED] += 1
+    values[TRACKED] = len(tasks)
+
+
+def aggregate_partition(connection, shm_name: str, layout: SlotLayout, max_tasks: int):
+    """Worker process: aggregate event batches from ``connection`` until it sends None."""
+    # Shutdown is driven by the exporter process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    values = shm.buf.cast('d')
+    tasks = {}
+    try:
+        while True:
+            batch = connection.recv()
+            if batch is None:
+                break
+            apply_batch(values, tasks, batch, layout, max_tasks)
+    finally:
+        values.release()
+        shm.close()
+
+
+class MultiProcessExporter(CelerySuccessExporter):
+    """
+    The Celery exporter with task events aggregated by several processes.
+
+    Worker, heartbeat and overflow handling stays in the exporter process.
+    Runtime sketches are not supported. Task events only count toward the
+    cardinality guard on task-received, the terminal events are attributed
+    through the worker's in-flight task map.
+
+    Args:
+        processes (int): Number of worker processes.
+        sync_interval (float): Seconds between reads of the shared arrays.
+        Other arguments are those of CelerySuccessExporter; pipeline mode is
+        always on since the aggregator thread feeds the workers.
+    """
+    def __init__(self, broker_url: str, processes: int = 2, sync_interval: float = 0.05, **kwargs):
+        if processes < 1:
+            raise ValueError("processes must be at least 1")
+        if kwargs.get('runtime_sketches'):
+            raise ValueError("Runtime sketches are not supported with multi-process aggregation")
+        kwargs['pipeline'] = True
+        super().__init__(broker_url, **kwargs)
+        self.processes = processes
+        self.sync_interval = sync_interval
+
+        # Demoted names leave their slot behind, leave room for a few rebalances
+        self.layout = SlotLayout(
+            Histogram.DEFAULT_BUCKETS, LATENCY_BUCKETS + (float('inf'),), 4 * self.task_names.max_series + 2
+        )
+        self._max_tasks = max(1, self.task_table.max_entries // processes)
+        self._slot_labels = [self.task_names.other_label, UNKNOWN_LABEL]
+        self._label_slots = {self.task_names.other_label: OTHER_SLOT, UNKNOWN_LABEL: UNKNOWN_SLOT}
+        self._slots_exhausted = False
+
+        self._workers = []
+        self._partitions = [[] for _ in range(processes)]
+        self._last_sync = 0.0
+
+        # Task events are dispatched to the workers instead of being handled here
+        for event_type, code in TASK_EVENT_CODES.items():
+            self.handlers[event_type] = self.event_stats.instrument(event_type, partial(self._dispatch, code))
+        self.task_table_size.set_function(self._tracked_tasks)
+
+    def _slot_for(self, label):
+        """Slot aggregating ``label``, assigned on first use."""
+        slot = self._label_slots.get(label)
+        if slot is None:
+            if len(self._slot_labels) < self.layout.slots:
+                slot = len(self._slot_labels)
+                self._slot_labels.append(label)
+            else:
+                slot = OTHER_SLOT
+                if not self._slots_exhausted:
+                    self._slots_exhausted = True
+                    print("All task name slots are in use, new task names are counted as 'other'", file=sys.stderr)
+            self._label_slots[label] = slot
+        return slot
+
+    def _fold_task_name(self, name):
+        """Fold the name's series into 'other' and retire its slot."""
+        super()._fold_task_name(name)
+        slot = self._label_slots.pop(name, None)
+        if slot is not None and slot != OTHER_SLOT:
+            self._slot_labels[slot] = self.task_names.other_label
+
+    def _dispatch(self, code, event):
+        """Reduce a task event to a tuple and queue it for the worker owning its uuid."""
+        uuid = event.get('uuid')
+        if uuid is None:
+            return
+        slot = UNKNOWN_SLOT
+        if code == RECEIVED:
+            slot = self._slot_for(self.task_names.label(event.get('name') or UNKNOWN_LABEL))
+        self._partitions[hash(uuid) % self.processes].append(
+            (code, uuid, slot, event.get('timestamp'), event.get('runtime'))
+        )
+
+    def _process_batch(self, batch):
+        """Dispatch a batch of queued events and pick up what the workers aggregated."""
+        super()._process_batch(batch)
+        self._send_partitions()
+        now = time.monotonic()
+        if now - self._last_sync >= self.sync_interval:
+            self._last_sync = now
+            self._sync_shared()
+
+    def _send_partitions(self):
+        for index, partition in enumerate(self._partitions):
+            if not partition:
+                continue
+            try:
+                self._workers[index][1].send(partition)
+            except (BrokenPipeError, ConnectionResetError, OSError) as e:
+                # Counts already in shared memory survive, the worker's in-flight tasks do not
+                print(f"Aggregation process {index} died ({e}), restarting it", file=sys.stderr)
+                self._restart_worker(index)
+                self._workers[index][1].send(partition)
+            self._partitions[index] = []
+
+    def _spawn_worker(self, shm):
+        context = multiprocessing.get_context('spawn')
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(
+            target=aggregate_partition, args=(receiver, shm.name, self.layout, self._max_tasks), daemon=True
+        )
+        process.start()
+        receiver.close()
+        return process, sender
+
+    def _start_workers(self):
+        """Create the shared arrays and start the worker processes."""
+        print(f"Starting {self.processes} aggregation processes", file=sys.stderr)
+        for _ in range(self.processes):
+            # New segments are zero-filled
+            shm = shared_memory.SharedMemory(create=True, size=self.layout.size)
+            process, sender = self._spawn_worker(shm)
+            previous = array('d', bytes(self.layout.size))
+            self._workers.append([process, sender, shm, previous])
+
+    def _restart_worker(self, index):
+        worker = self._workers[index]
+        worker[1].close()
+        worker[0].join(timeout=1.0)
+        worker[0], worker[1] = self._spawn_worker(worker[2])
+
+    def _stop_workers(self):
+        """Let the workers finish their queued batches, then read and release the shared arrays."""
+        if not self._workers:
+            return
+        self._send_partitions()
+        for process, sender, _, _ in self._workers:
+            try:
+                sender.send(None)
+            except OSError:
+                pass
+            sender.close()
+        for index, (process, _, _, _) in enumerate(self._workers):
+            process.join(timeout=WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                # Its last batches are lost, what it already wrote to shared memory is read below
+                print(f"Aggregation process {index} did not stop, terminating it", file=sys.stderr)
+                process.terminate()
+                process.join(timeout=1.0)
+        self._sync_shared()
+        for _, _, shm, _ in self._workers:
+            shm.close()
+            shm.unlink()
+        self._workers = []
+
+    def _sync_shared(self):
+        """Add what the workers aggregated since the last sync to the prometheus metrics."""
+        layout = self.layout
+        slot_size = layout.slot_size
+        # Slots past the assigned ones are never written
+        length = layout.base(len(self._slot_labels))
+        changed = False
+        for worker in self._workers:
+            shm, previous = worker[2], worker[3]
+            current = array('d')
+            current.frombytes(shm.buf[:length * 8])
+            if current == previous[:length]:
+                continue
+            changed = True
+            evicted = current[EVICTED] - previous[EVICTED]
+            if evicted:
+                self._on_task_table_evict('capacity', int(evicted))
+            for slot, label in enumerate(self._slot_labels):
+                start = layout.base(slot)
+                end = start + slot_size
+                if current[start:end] != previous[start:end]:
+                    self._apply_slot(label, current, previous, start)
+            previous[:length] = current
+        if changed:
+            self._metrics_dirty = True
+            # Once per sync, the dispatch notification usually came before the counts
+            self.flush_scheduler.notify()
+
+    def _apply_slot(self, label, current, previous, start):
+        layout = self.layout
+        children = self._lean_children_for(label)
+        for index in range(3):
+            delta = current[start + index] - previous[start + index]
+            if delta:
+                children[index].inc(delta)
+        for child, offset, bounds in (
+            (children[3], layout.runtime, layout.runtime_bounds),
+            (children[4], layout.queue_wait, layout.latency_bounds),
+            (children[5], layout.start_latency, layout.latency_bounds),
+        ):
+            offset += start
+            end = offset + len(bounds)
+            _add_histogram_counts(
+                child,
+                [after - before for after, before in zip(current[offset:end], previous[offset:end])],
+                current[end] - previous[end]
+            )
+
+    def _tracked_tasks(self):
+        """In-flight tasks held by all workers."""
+        total = 0
+        for worker in list(self._workers):
+            try:
+                total += worker[2].buf.cast('d')[TRACKED]
+            except (TypeError, ValueError):
+                # Released during shutdown
+                pass
+        return total
+
+    def _aggregate_events(self):
+        """Aggregator thread: dispatch until the event buffer is closed and drained, then stop the workers."""
+        super()._aggregate_events()
+        self._stop_workers()
+
+    def start(self):
+        """Start the worker processes, then the exporter threads."""
+        self._start_workers()
+        super().start()
+
+    def stop(self):
+        """Stop the exporter, waiting for the workers to hand over their last counts."""
+        super().stop()
+        if self._aggregator_thread and self._aggregator_thread.is_alive():
+            # The workers took longer than the regular shutdown waits
+            self._aggregator_thread.join()
+            if self._metrics_dirty:
+                self._store_metrics()
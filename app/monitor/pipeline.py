@@ -0,0 +1,117 @@
+"""
+Bounded event buffer decoupling broker consumption from metric aggregation.
+"""
+import threading
+from collections import deque
+
+# Overflow policies
+OVERFLOW_BLOCK = 'block'                          # Receiver waits for space (backpressure to the broker)
+OVERFLOW_DROP_OLDEST = 'drop-oldest'              # Oldest queued event is discarded
+OVERFLOW_DROP_OBSERVATIONS = 'drop-observations'  # New event is only counted, its details are discarded
+
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_OBSERVATIONS)
+
+
+class EventBuffer:
+    """
+    Bounded FIFO ring buffer of decoded events.
+
+    The receive thread calls ``put`` and an aggregation thread calls ``drain``
+    to take events in batches. What happens when the buffer is full depends on
+    the overflow policy:
+
+    - ``block``: ``put`` waits until the aggregator makes room.
+    - ``drop-oldest``: the oldest queued event is discarded.
+    - ``drop-observations``: the new event is not queued, only its type is
+      tallied so counters stay exact; fetch the tally with ``take_overflow``.
+
+    Args:
+        maxsize (int): Maximum number of queued events.
+        overflow (str): One of OVERFLOW_POLICIES.
+        on_drop (callable, optional): Called with the number of events
+            dropped whenever the buffer discards or strips events.
+    """
+    def __init__(self, maxsize: int = 10000, overflow: str = OVERFLOW_BLOCK, on_drop=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r}, expected one of {OVERFLOW_POLICIES}")
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.on_drop = on_drop
+
+        self._queue = deque()
+        self._overflow_counts = {}
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def put(self, event, timeout=None):
+        """
+        Queue an event. Returns True if the event was queued.
+
+        With the ``block`` policy this waits for space; it returns False if the
+        buffer is closed or the timeout expires.
+        """
+        dropped = False
+        queued = True
+        with self._lock:
+            if self._closed:
+                return False
+            if len(self._queue) >= self.maxsize:
+                if self.overflow == OVERFLOW_BLOCK:
+                    has_room = self._not_full.wait_for(
+                        lambda: self._closed or len(self._queue) < self.maxsize, timeout
+                    )
+                    if not has_room or self._closed:
+                        return False
+                elif self.overflow == OVERFLOW_DROP_OLDEST:
+                    self._queue.popleft()
+                    dropped = True
+                else:
+                    event_type = event.get('type')
+                    self._overflow_counts[event_type] = self._overflow_counts.get(event_type, 0) + 1
+                    dropped = True
+                    queued = False
+            if queued:
+                self._queue.append(event)
+                self._not_empty.notify()
+        if dropped and self.on_drop:
+            self.on_drop(1)
+        return queued
+
+    def drain(self, max_batch: int = 500, timeout=None):
+        """
+        Take up to ``max_batch`` events, waiting up to ``timeout`` seconds for
+        the first one. Returns an empty list on timeout or when closed and empty.
+        """
+        with self._lock:
+            if not self._queue and not self._closed:
+                self._not_empty.wait_for(lambda: self._queue or self._closed, timeout)
+            queue = self._queue
+            batch = [queue.popleft() for _ in range(min(max_batch, len(queue)))]
+            if batch:
+                self._not_full.notify_all()
+            return batch
+
+    def take_overflow(self):
+        """Return and reset the per-event-type tally of stripped events."""
+        with self._lock:
+            counts = self._overflow_counts
+            self._overflow_counts = {}
+            return counts
+
+    def close(self):
+        """Stop accepting events and wake up any waiting threads."""
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
@@ -0,0 +1,269 @@
+"""
+Record the Celery event stream to an append-only log and replay it.
+
+The recorder sits on the exporter's receive thread and appends every event it
+receives, so the load that made an exporter fall behind can be reproduced
+later. Logs are rotated into numbered segments (``<path>.00000``,
+``<path>.00001``, ...) and read back through ``mmap``, so multi-GB captures
+replay without being loaded into memory.
+
+Format (little endian):
+
+    file header: magic b'CXEV', format version (u8)
+    frames:      flags (u8, bit 0 = zlib compressed), payload length (u32), payload
+    payload:     records of received_at (f64), body length (u32), JSON event body
+
+Records are buffered into frames of about ``block_size`` bytes, so
+compression works on whole blocks and a crash loses at most one unwritten
+frame. A frame cut short by a crash ends the segment when reading.
+"""
+import glob
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+
+MAGIC = b'CXEV'
+FORMAT_VERSION = 1
+
+FLAG_COMPRESSED = 0x01
+
+_FILE_HEADER = struct.Struct('<4sB')
+_FRAME_HEADER = struct.Struct('<BI')
+_RECORD_HEADER = struct.Struct('<dI')
+
+_SEGMENT_SUFFIX = re.compile(r'\.(\d{5,})$')
+
+
+class RecordingError(ValueError):
+    """Raised when an event log cannot be read."""
+
+
+def segment_path(path: str, index: int) -> str:
+    """Path of the ``index``-th segment of the log at ``path``."""
+    return f'{path}.{index:05d}'
+
+
+def _numbered_segments(path):
+    """Sorted (index, segment path) pairs of the log at ``path``."""
+    segments = []
+    for candidate in glob.glob(glob.escape(path) + '.*'):
+        match = _SEGMENT_SUFFIX.search(candidate)
+        if match and candidate[:match.start()] == path:
+            segments.append((int(match.group(1)), candidate))
+    return sorted(segments)
+
+
+def segment_paths(path: str):
+    """Segments of the log at ``path`` in recording order, or ``[path]`` if it is a single file."""
+    if os.path.isfile(path):
+        return [path]
+    return [segment for _, segment in _numbered_segments(path)]
+
+
+class EventRecorder:
+    """
+    Appends events to a rotated, length-prefixed binary log.
+
+    ``record`` is called on the receive thread; ``close`` may be called from
+    another thread while the receiver is still running, so both take a lock.
+
+    Args:
+        path (str): Log path prefix, segments are written next to it.
+        max_bytes (int): Segment size after which a new segment is started.
+        compress (bool): Compress frames with zlib.
+        block_size (int): Bytes of records buffered before a frame is written.
+        flush_interval (float): Seconds after which a partial frame is written anyway.
+        clock (callable, optional): Time source for received_at, defaults to time.time.
+    """
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, compress: bool = False,
+                 block_size: int = 64 * 1024, flush_interval: float = 1.0, clock=time.time):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.records = 0
+
+        self._buffer = bytearray()
+        self._buffer_started = None
+        self._lock = threading.Lock()
+        # Continue after existing segments instead of overwriting an earlier capture
+        existing = _numbered_segments(path)
+        self._index = existing[-1][0] + 1 if existing else 0
+        self._file = None
+        self._open_segment()
+
+    def _open_segment(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(segment_path(self.path, self._index), 'xb')
+        self._file.write(_FILE_HEADER.pack(MAGIC, FORMAT_VERSION))
+        self._index += 1
+
+    def record(self, event):
+        """Append an event, stamped with the time it was received."""
+        now = self.clock()
+        body = json.dumps(event, separators=(',', ':'), default=str).encode('utf-8')
+        with self._lock:
+            if self._file is None:
+                return
+            if self._buffer_started is None:
+                self._buffer_started = now
+            self._buffer += _RECORD_HEADER.pack(now, len(body))
+            self._buffer += body
+            self.records += 1
+            if len(self._buffer) >= self.block_size or now - self._buffer_started >= self.flush_interval:
+                self._write_frame()
+
+    def _write_frame(self):
+        if not self._buffer:
+            return
+        payload, flags = bytes(self._buffer), 0
+        if self.compress:
+            # Fast level, this runs on the receive thread
+            payload, flags = zlib.compress(payload, 1), FLAG_COMPRESSED
+        self._file.write(_FRAME_HEADER.pack(flags, len(payload)))
+        self._file.write(payload)
+        self._file.flush()
+        self._buffer.clear()
+        self._buffer_started = None
+        if self._file.tell() >= self.max_bytes:
+            self._file.close()
+            self._open_segment()
+
+    def wrap_handlers(self, handlers):
+        """
+        Return receiver handlers that record every event before handling it.
+
+        A ``'*'`` handler is added so events without a handler are recorded too.
+        """
+        record = self.record
+
+        def recording(handler):
+            def handle(event):
+                record(event)
+                handler(event)
+            return handle
+
+        wrapped = {event_type: recording(handler) for event_type, handler in handlers.items()}
+        if '*' not in wrapped:
+            wrapped['*'] = record
+        return wrapped
+
+    def close(self):
+        """Write buffered records and close the log. Later events are not recorded."""
+        with self._lock:
+            if self._file is None:
+                return
+            self._write_frame()
+            self._file.close()
+            self._file = None
+
+
+def _read_segment(path):
+    """Yield (received_at, event) pairs from one segment through a read-only memory map."""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _FILE_HEADER.size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version = _FILE_HEADER.unpack_from(data, 0)
+            if magic != MAGIC:
+                raise RecordingError(f"{path} is not an event log")
+            if version != FORMAT_VERSION:
+                raise RecordingError(f"{path} has unsupported format version {version}")
+            offset = _FILE_HEADER.size
+            while offset + _FRAME_HEADER.size <= size:
+                flags, length = _FRAME_HEADER.unpack_from(data, offset)
+                offset += _FRAME_HEADER.size
+                if offset + length > size:
+                    print(f"Ignoring truncated frame at the end of {path}", file=sys.stderr)
+                    return
+                if flags & FLAG_COMPRESSED:
+                    payload = zlib.decompress(data[offset:offset + length])
+                    yield from _read_records(payload, 0, len(payload))
+                else:
+                    yield from _read_records(data, offset, offset + length)
+                offset += length
+
+
+def _read_records(data, offset, end):
+    while offset < end:
+        received_at, length = _RECORD_HEADER.unpack_from(data, offset)
+        offset += _RECORD_HEADER.size
+        yield received_at, json.loads(data[offset:offset + length])
+        offset += length
+
+
+def read_events(path: str):
+    """Yield (received_at, event) pairs from every segment of the log at ``path``."""
+    segments = segment_paths(path)
+    if not segments:
+        raise RecordingError(f"No event log found at {path}")
+    for segment in segments:
+        yield from _read_segment(segment)
+
+
+class EventReplayer:
+    """
+    Streams a recorded event log into exporter handlers.
+
+    Events are paced by the time they were originally received. Their
+    ``timestamp`` is shifted by the same offset, so lags and ages computed
+    against the current time look as they did during the capture at 1x.
+
+    Args:
+        path (str): Log path prefix (or a single segment file).
+        speed (float): 1 replays at the original pace, N at N times the
+            original pace, 0 as fast as possible.
+        sleep (callable, optional): Waits the given seconds; returns True to
+            abort the replay. Defaults to waiting on the replayer's stop flag.
+    """
+    def __init__(self, path: str, speed: float = 1.0, sleep=None):
+        if speed < 0:
+            raise ValueError("speed must be 0 (as fast as possible) or positive")
+        self.path = path
+        self.speed = speed
+        self._stop_event = threading.Event()
+        self._sleep = sleep or self._stop_event.wait
+        self.replayed = 0
+
+    def stop(self):
+        """Abort a running replay."""
+        self._stop_event.set()
+
+    def replay(self, handlers):
+        """Feed every recorded event to ``handlers`` (event type -> handler). Returns the number replayed."""
+        fallback = handlers.get('*')
+        first = None
+        start = time.monotonic()
+        wall_start = time.time()
+        for received_at, event in read_events(self.path):
+            if self._stop_event.is_set():
+                break
+            if first is None:
+                first = received_at
+            if self.speed:
+                delay = (received_at - first) / self.speed - (time.monotonic() - start)
+                # Sleeping for less than a millisecond costs more than it paces
+                if delay > 0.001 and self._sleep(delay):
+                    break
+            timestamp = event.get('timestamp')
+            if timestamp is not None:
+                event['timestamp'] = timestamp + wall_start - first
+            handler = handlers.get(event.get('type'), fallback)
+            if handler is not None:
+                handler(event)
+            self.replayed += 1
+
+        elapsed = time.monotonic() - start
+        print(f"Replayed {self.replayed} events from {self.path} in {elapsed:.1f}s", file=sys.stderr)
+        return self.replayed
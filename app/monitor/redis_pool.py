@@ -0,0 +1,241 @@
+"""
+Shared Redis access for the exporter and the Django metrics view.
+
+Each process keeps one pooled client per Redis URL, so connections (and TLS
+handshakes) are reused across flushes and scrapes. Calls go through a circuit
+breaker that backs off while Redis is unreachable instead of hammering it.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import weakref
+
+import redis
+import redis.asyncio
+
+# Pool tuning, shared by every process using this module
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '10'))
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', '5'))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', '30'))
+
+# Circuit breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Redis while the circuit is open."""
+
+
+def redis_url_with_tls(redis_url: str) -> str:
+    """
+    Add the TLS options managed Redis providers (e.g. Heroku) need.
+
+    Their certificates are self-signed, so certificate verification is
+    disabled for ``rediss://`` URLs that do not configure it themselves.
+    """
+    if not redis_url.startswith('rediss://') or 'ssl_cert_reqs=' in redis_url:
+        return redis_url
+    separator = '&' if '?' in redis_url else '?'
+    return f'{redis_url}{separator}ssl_cert_reqs=none'
+
+
+def describe_redis_client(client) -> str:
+    """
+    Describe where an injected Redis client connects, for startup logging.
+
+    Clients without a connection pool (e.g. in-memory stand-ins) are
+    described by their class name.
+    """
+    pool = getattr(client, 'connection_pool', None)
+    kwargs = getattr(pool, 'connection_kwargs', None)
+    if not kwargs:
+        return type(client).__name__
+    location = kwargs.get('path') or f"{kwargs.get('host', 'localhost')}:{kwargs.get('port', 6379)}"
+    return f"{location}/{kwargs.get('db', 0)}"
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for an exponentially growing backoff.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    ``allow`` returns False for ``base_backoff`` seconds, doubling on every
+    failed retry up to ``max_backoff``. Once the backoff has elapsed a single
+    trial call is let through (half-open); its outcome closes or re-opens the
+    circuit.
+
+    Args:
+        failure_threshold (int): Consecutive failures before opening.
+        base_backoff (float): Seconds the circuit stays open the first time.
+        max_backoff (float): Upper bound for the backoff.
+        clock (callable, optional): Monotonic time source.
+    """
+    def __init__(self, failure_threshold: int = 3, base_backoff: float = 1.0, max_backoff: float = 30.0,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+
+        self.state = CLOSED
+        self.last_error = None
+        self._failures = 0
+        self._backoff = base_backoff
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Return True if a call may be made now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.clock() >= self._open_until:
+                # Let a single trial call through
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        """Record a successful call. Returns the previous state."""
+        with self._lock:
+            previous = self.state
+            self.state = CLOSED
+            self.last_error = None
+            self._failures = 0
+            self._backoff = self.base_backoff
+            return previous
+
+    def record_failure(self, error=None):
+        """Record a failed call. Returns the new state."""
+        with self._lock:
+            self.last_error = error
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state == HALF_OPEN:
+                    self._backoff = min(self._backoff * 2, self.max_backoff)
+                self.state = OPEN
+                self._open_until = self.clock() + self._backoff
+            return self.state
+
+    def abandon(self):
+        """
+        Record a call that ended without an outcome, e.g. cancelled.
+
+        It says nothing about the dependency, but a half-open trial must not
+        stay pending forever: the next call becomes the trial instead.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+                self._open_until = self.clock()
+
+    def call(self, func, *args, **kwargs):
+        """Call ``func`` through the breaker, raising CircuitOpenError while open."""
+        if not self.allow():
+            raise CircuitOpenError(f"Redis unavailable, retrying later: {self.last_error}")
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        except BaseException:
+            self.abandon()
+            raise
+        self.record_success()
+        return result
+
+    async def call_async(self, func, *args, **kwargs):
+        """Await ``func`` through the breaker, raising CircuitOpenError while open."""
+        if not self.allow():
+            raise CircuitOpenError(f"Redis unavailable, retrying later: {self.last_error}")
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        except BaseException:
+            self.abandon()
+            raise
+        self.record_success()
+        return result
+
+
+class RedisAccess:
+    """A Redis client paired with the circuit breaker guarding it."""
+    def __init__(self, client, breaker=None):
+        self.client = client
+        self.breaker = breaker or CircuitBreaker()
+
+    def call(self, func, *args, **kwargs):
+        """Run ``func(client, *args, **kwargs)`` through the circuit breaker."""
+        return self.breaker.call(func, self.client, *args, **kwargs)
+
+    async def call_async(self, func, *args, **kwargs):
+        """Await ``func(client, *args, **kwargs)`` through the circuit breaker (asyncio clients)."""
+        return await self.breaker.call_async(func, self.client, *args, **kwargs)
+
+
+_instances = {}
+_instances_lock = threading.Lock()
+# Event loop -> {redis_url: RedisAccess}, dropped together with the loop
+_async_instances = weakref.WeakKeyDictionary()
+
+
+def get_redis(redis_url: str) -> RedisAccess:
+    """Return the process-wide RedisAccess for ``redis_url``, creating it on first use."""
+    access = _instances.get(redis_url)
+    if access is not None:
+        return access
+    with _instances_lock:
+        access = _instances.get(redis_url)
+        if access is None:
+            pool = redis.BlockingConnectionPool.from_url(
+                redis_url_with_tls(redis_url),
+                max_connections=REDIS_MAX_CONNECTIONS,
+                timeout=REDIS_SOCKET_TIMEOUT,  # Seconds to wait for a free connection
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_keepalive=True,
+                health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            )
+            access = _instances[redis_url] = RedisAccess(redis.Redis(connection_pool=pool))
+            print(f"Created Redis connection pool (max {REDIS_MAX_CONNECTIONS} connections)", file=sys.stderr)
+        return access
+
+
+def create_async_redis(redis_url: str):
+    """
+    Create a pooled ``redis.asyncio`` client with the same settings as ``get_redis``.
+
+    Asyncio clients are bound to the event loop they are used from, so each
+    loop creates its own instead of sharing a process-wide one.
+    """
+    pool = redis.asyncio.BlockingConnectionPool.from_url(
+        redis_url_with_tls(redis_url),
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_SOCKET_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+    )
+    return redis.asyncio.Redis(connection_pool=pool)
+
+
+def get_async_redis(redis_url: str) -> RedisAccess:
+    """
+    Return the RedisAccess wrapping a pooled asyncio client for ``redis_url``.
+
+    One per running event loop (an ASGI worker runs a single loop), sharing
+    the circuit breaker of the sync client so both back off together.
+    """
+    loop = asyncio.get_running_loop()
+    accesses = _async_instances.setdefault(loop, {})
+    access = accesses.get(redis_url)
+    if access is None:
+        access = accesses[redis_url] = RedisAccess(create_async_redis(redis_url), get_redis(redis_url).breaker)
+    return access
@@ -2,12 +2,21 @@
 """
 Script to run the Celery Success Exporter.
 """
+import asyncio
 import os
 import sys
 import time
 import signal
-import ssl
+from app.monitor.async_exporter import AsyncCeleryExporter
+from app.monitor.encoding import parse_encodings
 from app.monitor.exporter import CelerySuccessExporter
+from app.monitor.http_server import MetricsServer
+from app.monitor.multiprocess import MultiProcessExporter
+from app.monitor.recording import EventRecorder, EventReplayer
+
+# Exporter runtimes selectable with EXPORTER_RUNTIME
+RUNTIME_THREADED = 'threaded'
+RUNTIME_ASYNCIO = 'asyncio'
 
 def main():
     """Run the Celery Success Exporter."""
@@ -15,6 +24,48 @@ def main():
     broker_url = os.environ.get('CELERY_BROKER_URL')
     redis_url = os.environ.get('REDIS_URL')
     update_interval = float(os.environ.get('EXPORTER_UPDATE_INTERVAL', '0.5'))
+    flush_interval_min = float(os.environ.get('EXPORTER_FLUSH_INTERVAL_MIN', update_interval))
+    flush_interval_max = float(os.environ.get('EXPORTER_FLUSH_INTERVAL_MAX', update_interval))
+    task_table_max_entries = int(os.environ.get('EXPORTER_TASK_TABLE_MAX_ENTRIES', '100000'))
+    task_table_ttl = float(os.environ.get('EXPORTER_TASK_TABLE_TTL', '300'))
+    lean = os.environ.get('EXPORTER_LEAN_MODE', 'false').lower() == 'true'
+    pipeline = os.environ.get('EXPORTER_PIPELINE', 'false').lower() == 'true'
+    queue_size = int(os.environ.get('EXPORTER_QUEUE_SIZE', '10000'))
+    batch_size = int(os.environ.get('EXPORTER_BATCH_SIZE', '500'))
+    overflow = os.environ.get('EXPORTER_OVERFLOW_POLICY', 'block')
+    storage_mode = os.environ.get('METRICS_STORAGE_MODE', 'text')
+    compression = parse_encodings(os.environ.get('EXPORTER_COMPRESSION', 'gzip'))
+    instance_id = os.environ.get('EXPORTER_INSTANCE_ID') or None
+    instance_ttl = float(os.environ.get('METRICS_INSTANCE_TTL', '30'))
+    event_queue = os.environ.get('EXPORTER_EVENT_QUEUE') or None
+    checkpoint = os.environ.get('EXPORTER_CHECKPOINT', 'true').lower() == 'true'
+    max_task_names = int(os.environ.get('EXPORTER_MAX_TASK_NAMES', '100'))
+    runtime_sketches = os.environ.get('METRICS_RUNTIME_SKETCHES', 'false').lower() == 'true'
+    sketch_accuracy = float(os.environ.get('EXPORTER_SKETCH_ACCURACY', '0.01'))
+    sketch_interval = float(os.environ.get('METRICS_SKETCH_INTERVAL', '60'))
+    sketch_retention = float(os.environ.get('EXPORTER_SKETCH_RETENTION', '3600'))
+    worker_expiry = float(os.environ.get('EXPORTER_WORKER_EXPIRY', '300'))
+    runtime = os.environ.get('EXPORTER_RUNTIME', RUNTIME_THREADED).lower()
+    record_path = os.environ.get('EXPORTER_RECORD_PATH') or None
+    record_max_bytes = int(os.environ.get('EXPORTER_RECORD_MAX_BYTES', str(256 * 1024 * 1024)))
+    record_compress = os.environ.get('EXPORTER_RECORD_COMPRESS', 'false').lower() == 'true'
+    replay_path = os.environ.get('EXPORTER_REPLAY_PATH') or None
+    replay_speed = float(os.environ.get('EXPORTER_REPLAY_SPEED', '1'))
+    processes = int(os.environ.get('EXPORTER_PROCESSES', '1'))
+    http_port = os.environ.get('EXPORTER_HTTP_PORT') or None
+    http_host = os.environ.get('EXPORTER_HTTP_HOST', '0.0.0.0')
+    openmetrics = os.environ.get('EXPORTER_OPENMETRICS', 'true').lower() == 'true'
+    freshness_interval = float(os.environ.get('EXPORTER_FRESHNESS_INTERVAL', '10'))
+    # Unset: exemplars in full mode only
+    exemplars = os.environ.get('EXPORTER_EXEMPLARS')
+    exemplars = exemplars.lower() == 'true' if exemplars else None
+    # Unset: handler and lag histograms in full mode only
+    event_stats = os.environ.get('EXPORTER_EVENT_STATS')
+    event_stats = event_stats.lower() == 'true' if event_stats else None
+    
+    if replay_path:
+        # Events come from the log, the broker is never contacted
+        broker_url = broker_url or 'memory://'
     
     if not broker_url:
         print("Error: CELERY_BROKER_URL environment variable is required", file=sys.stderr)
@@ -24,25 +75,101 @@ def main():
         print("Error: REDIS_URL environment variable is required", file=sys.stderr)
         sys.exit(1)
     
-    # Handle SSL certificate verification for Redis
+    if runtime not in (RUNTIME_THREADED, RUNTIME_ASYNCIO):
+        print(f"Error: EXPORTER_RUNTIME must be '{RUNTIME_THREADED}' or '{RUNTIME_ASYNCIO}'", file=sys.stderr)
+        sys.exit(1)
+    
+    if processes > 1 and runtime == RUNTIME_ASYNCIO:
+        print("Error: EXPORTER_PROCESSES cannot be combined with EXPORTER_RUNTIME=asyncio", file=sys.stderr)
+        sys.exit(1)
+    
+    if record_path and replay_path:
+        print("Error: EXPORTER_RECORD_PATH and EXPORTER_REPLAY_PATH cannot be combined", file=sys.stderr)
+        sys.exit(1)
+    
+    # SSL certificate handling for rediss:// URLs is done by app.monitor.redis_pool
     if redis_url.startswith('rediss://'):
         print("Using Redis with SSL, disabling certificate verification", file=sys.stderr)
-        # Modify the URL to include SSL parameters
-        redis_url = redis_url + '?ssl_cert_reqs=none'
     
     print(f"Starting Celery Success Exporter with broker={broker_url}, redis={redis_url}", file=sys.stderr)
     
+    recorder = None
+    if record_path:
+        print(f"Recording events to {record_path}", file=sys.stderr)
+        recorder = EventRecorder(record_path, max_bytes=record_max_bytes, compress=record_compress)
+    event_source = None
+    if replay_path:
+        speed_text = f"{replay_speed:g}x speed" if replay_speed else "full speed"
+        print(f"Replaying events from {replay_path} at {speed_text}", file=sys.stderr)
+        event_source = EventReplayer(replay_path, speed=replay_speed).replay
+    
     # Create and start the exporter
-    exporter = CelerySuccessExporter(
+    exporter_class = AsyncCeleryExporter if runtime == RUNTIME_ASYNCIO else CelerySuccessExporter
+    extra = {}
+    if processes > 1:
+        print("Multi-process aggregation is experimental, see the README", file=sys.stderr)
+        exporter_class = MultiProcessExporter
+        extra['processes'] = processes
+    exporter = exporter_class(
         broker_url=broker_url,
         redis_url=redis_url,
-        update_interval=update_interval
+        update_interval=update_interval,
+        flush_interval_min=flush_interval_min,
+        flush_interval_max=flush_interval_max,
+        task_table_max_entries=task_table_max_entries,
+        task_table_ttl=task_table_ttl,
+        lean=lean,
+        pipeline=pipeline,
+        queue_size=queue_size,
+        batch_size=batch_size,
+        overflow=overflow,
+        storage_mode=storage_mode,
+        compression=compression,
+        instance_id=instance_id,
+        instance_ttl=instance_ttl,
+        event_queue=event_queue,
+        checkpoint=checkpoint,
+        max_task_names=max_task_names,
+        runtime_sketches=runtime_sketches,
+        sketch_accuracy=sketch_accuracy,
+        sketch_interval=sketch_interval,
+        sketch_retention=sketch_retention,
+        worker_expiry=worker_expiry,
+        recorder=recorder,
+        event_source=event_source,
+        openmetrics=openmetrics,
+        freshness_interval=freshness_interval,
+        exemplars=exemplars,
+        event_stats=event_stats,
+        **extra
     )
     
+    # Serve scrapes from the live registry, next to the Redis payload
+    metrics_server = None
+    if http_port:
+        metrics_server = MetricsServer(
+            exporter.registry,
+            host=http_host,
+            port=int(http_port),
+            auth_user=os.getenv('PROMETHEUS_METRICS_ENDPOINT_AUTH_USERNAME', ''),
+            auth_pass=os.getenv('PROMETHEUS_METRICS_ENDPOINT_AUTH_PASSWORD', '')
+        )
+        metrics_server.start()
+    
+    if runtime == RUNTIME_ASYNCIO:
+        try:
+            asyncio.run(run_async(exporter))
+        finally:
+            if metrics_server is not None:
+                metrics_server.stop()
+        return
+    
     # Set up signal handlers for graceful shutdown
     def signal_handler(sig, frame):
         print("Received shutdown signal, stopping exporter...", file=sys.stderr)
         exporter.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
         sys.exit(0)
     
     signal.signal(signal.SIGINT, signal_handler)
@@ -58,6 +185,15 @@ def main():
     except KeyboardInterrupt:
         print("Keyboard interrupt received, stopping exporter...", file=sys.stderr)
         exporter.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+
+async def run_async(exporter):
+    """Run the asyncio exporter until SIGINT or SIGTERM."""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, exporter.stop)
+    await exporter.run()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
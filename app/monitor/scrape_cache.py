@@ -0,0 +1,160 @@
+"""
+Per-process cache of the metrics payload shared by concurrent scrapes.
+"""
+import asyncio
+import threading
+import time
+import weakref
+import zlib
+
+from .encoding import GZIP, IDENTITY, ZSTD, decompress
+
+
+class CachedPayload:
+    """
+    A metrics payload together with the version it was stored under.
+
+    ``bodies`` maps content encodings to the payload bytes in that encoding.
+    The identity body is derived from a compressed one on first use if it was
+    not fetched. ``flushed_at`` is the Unix time the exporter stored the
+    payload at, None if it does not publish it.
+    """
+    __slots__ = ('version', 'bodies', 'flushed_at', '_tag')
+
+    def __init__(self, version, bodies, flushed_at=None):
+        self.version = version
+        self.bodies = dict(bodies or {})
+        self.flushed_at = flushed_at
+        if not self.bodies:
+            self._tag = None
+        elif version is not None:
+            self._tag = f'v{version}'
+        else:
+            # No version published (older exporter), fall back to a content checksum
+            encoding = min(self.bodies)
+            self._tag = f'c{zlib.crc32(self.bodies[encoding]):08x}'
+
+    def __bool__(self):
+        return bool(self.bodies)
+
+    def etag(self, encoding=IDENTITY):
+        """Strong ETag of the payload in ``encoding``."""
+        if self._tag is None:
+            return None
+        if encoding == IDENTITY:
+            return f'"{self._tag}"'
+        return f'"{self._tag}-{encoding}"'
+
+    def body(self, encoding=IDENTITY):
+        """Return the payload in ``encoding``, or None if it is not available."""
+        body = self.bodies.get(encoding)
+        if body is None and encoding == IDENTITY:
+            for compressed_encoding in (GZIP, ZSTD):
+                compressed = self.bodies.get(compressed_encoding)
+                if compressed is not None:
+                    body = self.bodies[IDENTITY] = decompress(compressed, compressed_encoding)
+                    break
+        return body
+
+
+def _cached_payload(version, payload):
+    if isinstance(payload, tuple):
+        return CachedPayload(version, *payload)
+    return CachedPayload(version, payload)
+
+
+class ScrapeCache:
+    """
+    Caches the last metrics payload keyed on the version the exporter publishes.
+
+    A cached payload younger than ``max_staleness`` seconds is served without
+    touching Redis. After that the version is re-checked and the payload is
+    only fetched again if the version changed. Refreshes are single-flight:
+    when several threads scrape at once one of them talks to Redis and the
+    others wait for and share its result.
+
+    Args:
+        max_staleness (float): Seconds a payload is served without re-checking
+            the version. 0 re-checks on every scrape.
+        clock (callable, optional): Monotonic time source.
+    """
+    def __init__(self, max_staleness: float = 0.5, clock=time.monotonic):
+        self.max_staleness = max_staleness
+        self.clock = clock
+        self._entry = None
+        self._checked_at = None
+        self._refresh_lock = threading.Lock()
+        # asyncio locks are bound to a loop, async views get one per loop
+        self._async_locks = weakref.WeakKeyDictionary()
+
+    def _is_fresh(self, now):
+        return (
+            self._entry is not None
+            and self.max_staleness > 0
+            and now - self._checked_at < self.max_staleness
+        )
+
+    def get(self, fetch_version, fetch_payload) -> CachedPayload:
+        """
+        Return the current payload, refreshing it if needed.
+
+        Args:
+            fetch_version (callable): Returns the stored payload version, or
+                None if the exporter does not publish one.
+            fetch_payload (callable): Returns a dict mapping content encodings
+                to the stored payload bytes, empty or None if nothing is stored,
+                or a (dict, flush time) tuple.
+        """
+        if self._is_fresh(self.clock()):
+            return self._entry
+
+        with self._refresh_lock:
+            # Another thread may have refreshed while we waited for the lock
+            started = self.clock()
+            if self._is_fresh(started):
+                return self._entry
+
+            version = fetch_version()
+            entry = self._entry
+            if entry is None or version is None or version != entry.version:
+                entry = _cached_payload(version, fetch_payload())
+            self._entry = entry
+            self._checked_at = started
+            return entry
+
+    async def get_async(self, fetch_version, fetch_payload) -> CachedPayload:
+        """
+        ``get`` for async views: the fetch callables return awaitables.
+
+        Refreshes are single-flight among the coroutines of one event loop and
+        never block the loop while Redis is being read.
+        """
+        if self._is_fresh(self.clock()):
+            return self._entry
+
+        loop = asyncio.get_running_loop()
+        lock = self._async_locks.get(loop)
+        if lock is None:
+            lock = self._async_locks[loop] = asyncio.Lock()
+        async with lock:
+            started = self.clock()
+            if self._is_fresh(started):
+                return self._entry
+
+            version = await fetch_version()
+            entry = self._entry
+            if entry is None or version is None or version != entry.version:
+                entry = _cached_payload(version, await fetch_payload())
+            self._entry = entry
+            self._checked_at = started
+            return entry
+
+    def last(self):
+        """Return the last payload fetched, however old, or None."""
+        return self._entry
+
+    def clear(self):
+        """Forget the cached payload."""
+        with self._refresh_lock:
+            self._entry = None
+            self._checked_at = None
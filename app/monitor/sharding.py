@@ -0,0 +1,175 @@
+"""
+Support for running several exporter instances side by side.
+
+Every instance writes its metrics under its own key prefix and heartbeats
+into a sorted set. At scrape time the payloads of all live instances are
+merged: cumulative samples (counters, histogram buckets, sums and counts)
+are summed per label set, other samples (gauges) get an ``instance`` label.
+"""
+import json
+import zlib
+
+from prometheus_client.parser import text_string_to_metric_families
+
+from .storage import (
+    CUMULATIVE_TYPES, FIELD_SEPARATOR, exposition_family, families_key, sample_field, samples_key, version_key
+)
+
+# Label added to non-cumulative samples when merging instances
+INSTANCE_LABEL = 'instance'
+
+# Instance keys outlive their last heartbeat by this many seconds before Redis drops them
+INSTANCE_KEY_EXPIRY = 24 * 60 * 60
+
+
+def instances_key(metrics_key: str) -> str:
+    """Sorted set of instance ids scored by their last heartbeat time."""
+    return f'{metrics_key}:instances'
+
+
+def instance_metrics_key(metrics_key: str, instance_id: str) -> str:
+    """Key prefix an instance stores its metrics under."""
+    return f'{metrics_key}:instance:{instance_id}'
+
+
+def add_heartbeat(pipe, metrics_key: str, instance_id: str, instance_keys, now: float, instance_ttl: float):
+    """
+    Queue heartbeat commands for an instance on a Redis pipeline.
+
+    Registers the instance as alive, forgets instances whose heartbeat expired
+    and pushes back the expiry of this instance's keys.
+    """
+    registry_key = instances_key(metrics_key)
+    pipe.zadd(registry_key, {instance_id: now})
+    pipe.zremrangebyscore(registry_key, '-inf', now - instance_ttl)
+    for key in instance_keys:
+        pipe.expire(key, INSTANCE_KEY_EXPIRY)
+
+
+def queue_live_instances(pipe, metrics_key: str, now: float, instance_ttl: float):
+    """Queue the read of the instances that heartbeated within ``instance_ttl`` seconds."""
+    pipe.zrangebyscore(instances_key(metrics_key), now - instance_ttl, '+inf')
+
+
+def parse_live_instances(members):
+    """Sorted instance ids from the result queued by ``queue_live_instances``."""
+    return sorted(m.decode('utf-8') if isinstance(m, bytes) else m for m in members)
+
+
+def live_instances(redis_client, metrics_key: str, now: float, instance_ttl: float):
+    """Return the sorted ids of instances that heartbeated within ``instance_ttl`` seconds."""
+    return parse_live_instances(redis_client.zrangebyscore(instances_key(metrics_key), now - instance_ttl, '+inf'))
+
+
+def combined_version(instance_versions) -> int:
+    """Fold (instance id, version) pairs into a single version number."""
+    text = ','.join(f'{instance_id}:{version}' for instance_id, version in instance_versions)
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def parse_exposition(text):
+    """
+    Parse exposition text into the (families, samples) dicts of the hash layout.
+
+    Returns:
+        tuple: (family -> JSON ``[type, help]``, field -> value)
+    """
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    families, samples = {}, {}
+    for metric in text_string_to_metric_families(text):
+        family, metric_type = exposition_family(metric)
+        if family.endswith('_created'):
+            continue
+        families[family] = json.dumps([metric_type, metric.documentation])
+        for sample in metric.samples:
+            samples[sample_field(family, sample.name, sample.labels)] = sample.value
+    return families, samples
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def merge_instances(instances):
+    """
+    Merge the metrics of several instances.
+
+    Args:
+        instances (list): (instance id, families, samples) tuples in the hash
+            layout, as returned by ``parse_exposition`` or HGETALL.
+
+    Returns:
+        tuple: merged (families, samples) ready for ``render_hash_metrics``.
+    """
+    merged_families, merged_samples = {}, {}
+    for instance_id, families, samples in instances:
+        cumulative = {}
+        for family, meta in families.items():
+            family, meta = _decode(family), _decode(meta)
+            merged_families.setdefault(family, meta)
+            cumulative[family] = json.loads(meta)[0] in CUMULATIVE_TYPES
+
+        for field, value in samples.items():
+            field = _decode(field)
+            family, sample_name, labels = field.split(FIELD_SEPARATOR, 2)
+            value = float(value)
+            if cumulative.get(family, False):
+                merged_samples[field] = merged_samples.get(field, 0.0) + value
+            else:
+                labels = dict(json.loads(labels))
+                labels[INSTANCE_LABEL] = instance_id
+                merged_samples[sample_field(family, sample_name, labels)] = value
+    return merged_families, merged_samples
+
+
+def queue_instance_versions(pipe, metrics_key: str, instance_ids):
+    """Queue the reads of the payload versions of ``instance_ids``."""
+    for instance_id in instance_ids:
+        pipe.get(version_key(instance_metrics_key(metrics_key, instance_id)))
+
+
+def parse_instance_versions(instance_ids, results):
+    """(instance id, version) pairs from the results queued by ``queue_instance_versions``."""
+    return [(instance_id, _decode(version)) for instance_id, version in zip(instance_ids, results)]
+
+
+def fetch_instance_versions(redis_client, metrics_key: str, instance_ids):
+    """Return (instance id, version) pairs for ``instance_ids`` in one round-trip."""
+    pipe = redis_client.pipeline(transaction=False)
+    queue_instance_versions(pipe, metrics_key, instance_ids)
+    return parse_instance_versions(instance_ids, pipe.execute())
+
+
+def queue_instance_metrics(pipe, metrics_key: str, instance_ids, hash_layout: bool):
+    """Queue the reads of every instance's metrics."""
+    for instance_id in instance_ids:
+        key = instance_metrics_key(metrics_key, instance_id)
+        if hash_layout:
+            pipe.hgetall(families_key(key))
+            pipe.hgetall(samples_key(key))
+        else:
+            pipe.get(key)
+
+
+def parse_instance_metrics(instance_ids, results, hash_layout: bool):
+    """(id, families, samples) tuples from the results queued by ``queue_instance_metrics``."""
+    instances = []
+    if hash_layout:
+        for index, instance_id in enumerate(instance_ids):
+            families, samples = results[2 * index], results[2 * index + 1]
+            if samples:
+                instances.append((instance_id, families, samples))
+    else:
+        for instance_id, text in zip(instance_ids, results):
+            if text:
+                families, samples = parse_exposition(text)
+                instances.append((instance_id, families, samples))
+    return instances
+
+
+def fetch_instance_metrics(redis_client, metrics_key: str, instance_ids, hash_layout: bool):
+    """Read every instance's metrics in one round-trip, as (id, families, samples) tuples."""
+    pipe = redis_client.pipeline(transaction=False)
+    queue_instance_metrics(pipe, metrics_key, instance_ids, hash_layout)
+    return parse_instance_metrics(instance_ids, pipe.execute(), hash_layout)
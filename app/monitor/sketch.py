@@ -0,0 +1,211 @@
+"""
+Mergeable relative-error quantile sketches for task runtimes.
+
+The fixed histogram buckets are far too coarse for tasks that run for minutes.
+A DDSketch (Masson et al., 2019) maps every value to a logarithmic bucket so
+any quantile it reports is within ``relative_accuracy`` of the true value,
+whatever the range. Sketches of the same accuracy merge by adding bucket
+counts, so the view can combine exporter instances and time windows.
+
+The exporter keeps one sketch per task name and time window and stores them
+in one Redis hash per window:
+
+    <metrics_key>:sketches:<window start>   task name -> serialized sketch
+
+Serialized format (little endian), zlib compressed after the header:
+
+    header:  magic b'DDSK', format version (u8), relative accuracy (f64),
+             zero count (f64), sum (f64), bin count (u32)
+    body:    bin indexes (i32 each, ascending), bin counts (f64 each)
+"""
+import math
+import struct
+import zlib
+
+from prometheus_client.utils import floatToGoString
+
+from app.monitor.storage import escape_label_value
+
+MAGIC = b'DDSK'
+FORMAT_VERSION = 1
+
+# Quantiles exposed as gauges
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+# Values at or below this are counted as zero, log() of them is meaningless
+MIN_INDEXABLE_VALUE = 1e-9
+
+_HEADER = struct.Struct('<4sBdddI')
+
+
+class SketchError(ValueError):
+    """Raised when a sketch cannot be decoded or merged."""
+
+
+def sketch_window_key(metrics_key: str, window_start) -> str:
+    """Redis hash holding the sketches of the window starting at ``window_start``."""
+    return f'{metrics_key}:sketches:{int(window_start)}'
+
+
+def window_starts(now: float, interval: float, span: float):
+    """Start times of the windows overlapping the last ``span`` seconds, newest first."""
+    current = math.floor(now / interval) * interval
+    count = max(1, math.ceil(span / interval))
+    return [current - i * interval for i in range(count)]
+
+
+class DDSketch:
+    """
+    Quantile sketch with relative error guarantees.
+
+    Args:
+        relative_accuracy (float): Maximum relative error of reported quantiles.
+        max_bins (int): Bins kept before the lowest ones are collapsed, which
+            only affects the accuracy of the smallest values.
+    """
+    __slots__ = ('relative_accuracy', 'max_bins', 'gamma', '_log_gamma', 'bins', 'zero_count', 'count', 'sum')
+
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0.0
+        self.count = 0.0
+        self.sum = 0.0
+
+    def __len__(self):
+        return len(self.bins)
+
+    def add(self, value: float, weight: float = 1.0):
+        """Add ``value`` to the sketch."""
+        if value > MIN_INDEXABLE_VALUE:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            bins = self.bins
+            bins[index] = bins.get(index, 0.0) + weight
+            if len(bins) > self.max_bins:
+                self._collapse()
+        else:
+            self.zero_count += weight
+        self.count += weight
+        self.sum += value * weight
+
+    def _collapse(self):
+        """Fold the lowest bins together until at most ``max_bins`` remain."""
+        indexes = sorted(self.bins)
+        excess = len(indexes) - self.max_bins
+        folded = sum(self.bins.pop(index) for index in indexes[:excess])
+        self.bins[indexes[excess]] += folded
+
+    def merge(self, other: 'DDSketch'):
+        """Add the contents of ``other`` to this sketch."""
+        if not math.isclose(other.gamma, self.gamma):
+            raise SketchError("Cannot merge sketches with different relative accuracy")
+        bins = self.bins
+        for index, count in other.bins.items():
+            bins[index] = bins.get(index, 0.0) + count
+        if len(bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> float:
+        """Estimate the ``q`` quantile (0 <= q <= 1), NaN if the sketch is empty."""
+        if self.count <= 0:
+            return float('nan')
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        cumulative = self.zero_count
+        index = None
+        for index in sorted(self.bins):
+            cumulative += self.bins[index]
+            if cumulative > rank:
+                break
+        # Midpoint (in relative terms) of the bin (gamma^(index-1), gamma^index]
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialize the sketch.
+
+        The updater thread serializes sketches while handler threads keep adding
+        to them, so the bins are copied first: dict() copies in one step under
+        the GIL, whereas iterating the live dict fails once a collapse pops bins.
+        """
+        bins = dict(self.bins)
+        indexes = sorted(bins)
+        counts = [bins[index] for index in indexes]
+        header = _HEADER.pack(MAGIC, FORMAT_VERSION, self.relative_accuracy, self.zero_count, self.sum, len(indexes))
+        body = struct.pack(f'<{len(indexes)}i', *indexes) + struct.pack(f'<{len(counts)}d', *counts)
+        return header + zlib.compress(body, 1)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, max_bins: int = 2048) -> 'DDSketch':
+        """Deserialize a sketch written by ``to_bytes``."""
+        if len(data) < _HEADER.size:
+            raise SketchError("Sketch is truncated")
+        magic, version, relative_accuracy, zero_count, total, bin_count = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise SketchError(f"Unsupported sketch format {magic!r} v{version}")
+        try:
+            body = zlib.decompress(data[_HEADER.size:])
+            indexes = struct.unpack_from(f'<{bin_count}i', body)
+            counts = struct.unpack_from(f'<{bin_count}d', body, 4 * bin_count)
+        except (zlib.error, struct.error) as e:
+            raise SketchError(f"Sketch is corrupt: {e}")
+        sketch = cls(relative_accuracy, max_bins=max(max_bins, bin_count))
+        sketch.bins = dict(zip(indexes, counts))
+        sketch.zero_count = zero_count
+        sketch.count = zero_count + math.fsum(counts)
+        sketch.sum = total
+        return sketch
+
+
+def merge_sketches(serialized_maps):
+    """
+    Merge serialized sketches by task name.
+
+    Args:
+        serialized_maps (iterable): Dicts mapping task name to serialized
+            sketch, as returned by HGETALL (bytes or str keys).
+
+    Returns:
+        dict: task name -> merged DDSketch. Unreadable sketches are skipped.
+    """
+    merged = {}
+    for serialized in serialized_maps:
+        for task_name, data in (serialized or {}).items():
+            if isinstance(task_name, bytes):
+                task_name = task_name.decode('utf-8')
+            try:
+                sketch = DDSketch.from_bytes(data)
+                if task_name in merged:
+                    merged[task_name].merge(sketch)
+                else:
+                    merged[task_name] = sketch
+            except SketchError:
+                continue
+    return merged
+
+
+def render_quantiles(sketches, quantiles=DEFAULT_QUANTILES, metric_name='celery_task_runtime_quantile_seconds') -> bytes:
+    """Render the quantiles of every sketch as a gauge family in the text exposition format."""
+    if not sketches:
+        return b''
+    lines = [
+        f'# HELP {metric_name} Task runtime quantiles estimated from mergeable sketches\n',
+        f'# TYPE {metric_name} gauge\n',
+    ]
+    for task_name in sorted(sketches):
+        sketch = sketches[task_name]
+        if sketch.count <= 0:
+            continue
+        label = escape_label_value(task_name)
+        for q in quantiles:
+            lines.append(f'{metric_name}{{task_name="{label}",quantile="{q}"}} {floatToGoString(sketch.quantile(q))}\n')
+    return ''.join(lines).encode('utf-8')
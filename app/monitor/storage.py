@@ -0,0 +1,309 @@
+"""
+Redis storage layouts for exporter metrics.
+
+Two layouts are supported:
+
+- ``text``: the full exposition text is written with SET under the metrics
+  key on every flush (the original layout), and its OpenMetrics rendering
+  under ``openmetrics_key``.
+- ``hash``: every sample is a field in a Redis hash. The exporter only writes
+  the samples that changed since the previous flush, cumulative samples
+  (counters, histogram buckets) as HINCRBYFLOAT deltas and gauges as HSET, in
+  one pipelined round-trip. The exposition text is rendered at scrape time.
+
+In both layouts every flush also bumps ``version_key`` (the flush sequence
+number) and stores its time under ``flushed_at_key``, so readers can tell how
+old the payload is.
+"""
+import json
+
+from prometheus_client.utils import floatToGoString
+
+STORAGE_TEXT = 'text'
+STORAGE_HASH = 'hash'
+STORAGE_MODES = (STORAGE_TEXT, STORAGE_HASH)
+
+# Metric types whose samples only ever grow and can be written as deltas
+CUMULATIVE_TYPES = ('counter', 'histogram', 'summary')
+
+# Separator between the parts of a sample field name
+FIELD_SEPARATOR = '\x1f'
+
+# Order of sample suffixes within a histogram/summary child
+_SUFFIX_ORDER = {'_bucket': 0, '_count': 1, '_sum': 2}
+
+# Last line of an OpenMetrics exposition
+OPENMETRICS_EOF = b'# EOF\n'
+
+
+def version_key(metrics_key: str) -> str:
+    """Counter incremented on every flush, identifies the stored payload version."""
+    return f'{metrics_key}:version'
+
+
+def openmetrics_key(metrics_key: str) -> str:
+    """
+    OpenMetrics rendering of the text layout payload, including exemplars.
+    
+    Stored without its ``# EOF`` terminator, readers append it after metrics
+    of their own.
+    """
+    return f'{metrics_key}:openmetrics'
+
+
+def flushed_at_key(metrics_key: str) -> str:
+    """Unix time of the last flush, written in the same transaction as the payload."""
+    return f'{metrics_key}:flushed_at'
+
+
+def samples_key(metrics_key: str) -> str:
+    """Hash holding one field per sample."""
+    return f'{metrics_key}:samples'
+
+
+def families_key(metrics_key: str) -> str:
+    """Hash holding the type and help text per metric family."""
+    return f'{metrics_key}:families'
+
+
+def exposition_family(metric):
+    """Return the (name, type) a metric family has in the text exposition format."""
+    name, metric_type = metric.name, metric.type
+    if metric_type == 'counter':
+        name = name + '_total'
+    elif metric_type == 'info':
+        name, metric_type = name + '_info', 'gauge'
+    elif metric_type == 'stateset':
+        metric_type = 'gauge'
+    elif metric_type == 'gaugehistogram':
+        metric_type = 'histogram'
+    elif metric_type == 'unknown':
+        metric_type = 'untyped'
+    return name, metric_type
+
+
+def sample_field(family: str, sample_name: str, labels: dict) -> str:
+    """Build the hash field name for a sample."""
+    return FIELD_SEPARATOR.join((family, sample_name, json.dumps(sorted(labels.items()), separators=(',', ':'))))
+
+
+def escape_label_value(value: str) -> str:
+    """Escape a label value for the text exposition format."""
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_sample(sample_name, labels, value):
+    if labels:
+        label_str = '{' + ','.join(f'{k}="{escape_label_value(v)}"' for k, v in labels) + '}'
+    else:
+        label_str = ''
+    return f'{sample_name}{label_str} {floatToGoString(value)}\n'
+
+
+def _sample_sort_key(family, sample_name, labels):
+    le = float('inf')
+    other_labels = []
+    for key, value in labels:
+        if key == 'le':
+            le = float(value)
+        else:
+            other_labels.append((key, value))
+    suffix = sample_name[len(family):] if sample_name.startswith(family) else sample_name
+    return other_labels, _SUFFIX_ORDER.get(suffix, -1), le, sample_name
+
+
+class HashMetricsWriter:
+    """
+    Writes registry samples into Redis hashes, sending only what changed.
+
+    The writer remembers the last value it successfully wrote for every sample
+    so each flush only carries deltas. A failed flush leaves that memory
+    untouched, so the next flush retries the full delta. Samples that were
+    removed from the registry take back what this writer added for them
+    (cumulative samples) or are deleted (gauges).
+
+    A new writer knows nothing about the hash a previous exporter process
+    left behind. ``load`` reads it once: stored gauges then count as written,
+    so the next flush deletes those missing from the registry (e.g. workers
+    that vanished while the exporter was down). Stored cumulative samples are
+    left alone and keep accumulating the new process's deltas, which is how
+    counters survive restarts in this layout.
+
+    Args:
+        metrics_key (str): Prefix of the Redis keys to write.
+    """
+    def __init__(self, metrics_key: str):
+        self.samples_key = samples_key(metrics_key)
+        self.families_key = families_key(metrics_key)
+        self.version_key = version_key(metrics_key)
+        self._written = {}
+        self._families = set()
+        self._cumulative = set()
+
+    def load(self, redis_client) -> bool:
+        """
+        Adopt the gauge samples already stored in Redis, before the first write.
+
+        Returns:
+            bool: Whether the hash held any samples.
+        """
+        stored_families = redis_client.hgetall(self.families_key)
+        stored = redis_client.hgetall(self.samples_key)
+        cumulative = set()
+        for family, meta in stored_families.items():
+            if json.loads(meta)[0] in CUMULATIVE_TYPES:
+                cumulative.add(family.decode('utf-8') if isinstance(family, bytes) else family)
+        for field, value in stored.items():
+            if isinstance(field, bytes):
+                field = field.decode('utf-8')
+            if field.split(FIELD_SEPARATOR, 1)[0] not in cumulative:
+                self._written.setdefault(field, float(value))
+        return bool(stored)
+
+    def write(self, redis_client, registry, extra=None) -> int:
+        """
+        Flush changed samples of ``registry`` in one pipelined round-trip.
+
+        Args:
+            redis_client: Redis client to write to.
+            registry: CollectorRegistry to read samples from.
+            extra (callable, optional): Called with the pipeline to queue
+                additional commands; forces a round-trip even if no sample changed.
+
+        Returns:
+            int: The number of sample fields written.
+        """
+        changes = self.prepare(registry)
+        if changes is None and extra is None:
+            return 0
+
+        pipe = redis_client.pipeline(transaction=True)
+        if changes is not None:
+            self.queue(pipe, changes)
+        if extra is not None:
+            extra(pipe)
+        pipe.execute()
+        return self.commit(changes)
+
+    def prepare(self, registry):
+        """
+        Compute what changed in ``registry`` since the last committed write.
+
+        Returns:
+            tuple: (increments, values, families, removed) to pass to ``queue``
+            and ``commit``, or None if nothing changed.
+        """
+        increments = {}
+        values = {}
+        families = {}
+        removed = []
+        written = self._written
+        seen = set()
+
+        for metric in registry.collect():
+            family, metric_type = exposition_family(metric)
+            if family not in self._families:
+                families[family] = json.dumps([metric_type, metric.documentation])
+            cumulative = metric_type in CUMULATIVE_TYPES
+            for sample in metric.samples:
+                if sample.name.endswith('_created'):
+                    # Creation timestamps are meaningless once samples are merged
+                    continue
+                field = sample_field(family, sample.name, sample.labels)
+                seen.add(field)
+                previous = written.get(field)
+                value = sample.value
+                # NaN never equals itself, e.g. the checkpoint age before any checkpoint
+                if previous == value or (previous != previous and value != value):
+                    continue
+                if cumulative:
+                    increments[field] = (value - (previous or 0.0), value)
+                else:
+                    values[field] = value
+            if cumulative:
+                self._cumulative.add(family)
+
+        # Fields adopted by load() are not necessarily a subset of the registry's
+        for field in written.keys() - seen:
+            if field.split(FIELD_SEPARATOR, 1)[0] in self._cumulative:
+                # e.g. a series folded into another label value: its count moved there
+                increments[field] = (-written[field], None)
+            else:
+                removed.append(field)
+
+        if not (increments or values or families or removed):
+            return None
+        return increments, values, families, removed
+
+    def queue(self, pipe, changes) -> int:
+        """
+        Queue the commands writing ``changes`` on a (sync or asyncio) Redis pipeline.
+
+        Returns:
+            int: Approximate payload size in bytes (field names and values).
+        """
+        increments, values, families, removed = changes
+        size = 0
+        if families:
+            pipe.hset(self.families_key, mapping=families)
+            size += sum(len(family) + len(meta) for family, meta in families.items())
+        for field, (delta, _) in increments.items():
+            pipe.hincrbyfloat(self.samples_key, field, delta)
+            size += len(field) + len(repr(delta))
+        if values:
+            mapping = {field: floatToGoString(v) for field, v in values.items()}
+            pipe.hset(self.samples_key, mapping=mapping)
+            size += sum(len(field) + len(value) for field, value in mapping.items())
+        if removed:
+            pipe.hdel(self.samples_key, *removed)
+            size += sum(len(field) for field in removed)
+        pipe.incr(self.version_key)
+        return size
+
+    def commit(self, changes) -> int:
+        """Remember ``changes`` as written once Redis accepted them. Returns the number of fields."""
+        if changes is None:
+            return 0
+        increments, values, families, removed = changes
+        written = self._written
+        for field, (_, value) in increments.items():
+            if value is None:
+                del written[field]
+            else:
+                written[field] = value
+        written.update(values)
+        for field in removed:
+            del written[field]
+        self._families.update(families)
+        return len(increments) + len(values) + len(removed)
+
+
+def render_hash_metrics(families: dict, samples: dict) -> bytes:
+    """
+    Render the text exposition format from the families and samples hashes.
+
+    Args:
+        families (dict): Family name -> JSON ``[type, help]`` (bytes or str).
+        samples (dict): Field name -> value (bytes or str), as returned by HGETALL.
+    """
+    grouped = {}
+    for field, value in samples.items():
+        if isinstance(field, bytes):
+            field = field.decode('utf-8')
+        family, sample_name, labels = field.split(FIELD_SEPARATOR, 2)
+        labels = [tuple(pair) for pair in json.loads(labels)]
+        grouped.setdefault(family, []).append((sample_name, labels, float(value)))
+
+    output = []
+    for family in sorted(grouped):
+        meta = families.get(family.encode('utf-8'), families.get(family))
+        if meta is not None:
+            metric_type, documentation = json.loads(meta)
+            output.append('# HELP {} {}\n'.format(
+                family, documentation.replace('\\', r'\\').replace('\n', r'\n')))
+            output.append(f'# TYPE {family} {metric_type}\n')
+        rows = grouped[family]
+        rows.sort(key=lambda row: _sample_sort_key(family, row[0], row[1]))
+        for sample_name, labels, value in rows:
+            output.append(_format_sample(sample_name, labels, value))
+    return ''.join(output).encode('utf-8')
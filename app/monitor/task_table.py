@@ -0,0 +1,145 @@
+"""
+Bounded in-flight task table used by the exporter instead of celery.events.State.
+"""
+import time
+from collections import OrderedDict
+
+
+class TaskRecord:
+    """Compact per-task record holding only the fields the metrics need."""
+    __slots__ = ('name', 'sent', 'received', 'started')
+
+    def __init__(self, name=None, sent=None, received=None, started=None):
+        self.name = name
+        self.sent = sent
+        self.received = received
+        self.started = started
+
+
+class TaskTable:
+    """
+    Maps task uuids to TaskRecord objects with a hard size limit.
+
+    Tasks are kept while they are in flight (from task-sent or task-received).
+    Once a terminal event arrives the task is kept for ``ttl`` seconds (so late
+    or duplicate events still resolve the task name) and then evicted. If the
+    table grows beyond ``max_entries`` the oldest terminal tasks are evicted
+    first, then the oldest in-flight ones.
+
+    Args:
+        max_entries (int): Maximum number of tasks kept in the table.
+        ttl (float): Seconds a terminal task is kept before eviction.
+        on_evict (callable, optional): Called as ``on_evict(reason, count)``
+            whenever tasks are evicted; reason is ``'ttl'`` or ``'capacity'``.
+        clock (callable, optional): Time source, defaults to time.time.
+    """
+    def __init__(self, max_entries: int = 100000, ttl: float = 300.0, on_evict=None, clock=time.time):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.clock = clock
+
+        # uuid -> TaskRecord, insertion ordered so the oldest task comes first
+        self._records = {}
+        # uuid -> time the task reached a terminal state, oldest first
+        self._terminal = OrderedDict()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, uuid):
+        return uuid in self._records
+
+    def get(self, uuid):
+        """Return the record for ``uuid`` or None."""
+        return self._records.get(uuid)
+
+    def name(self, uuid, default='unknown'):
+        """Return the task name for ``uuid``, or ``default`` if it is not known."""
+        record = self._records.get(uuid)
+        if record is None or not record.name:
+            return default
+        return record.name
+
+    def get_or_create(self, uuid):
+        """Return the record for ``uuid``, creating it if needed."""
+        record = self._records.get(uuid)
+        if record is None:
+            record = self._records[uuid] = TaskRecord()
+            if len(self._records) > self.max_entries:
+                self._evict_capacity()
+        return record
+
+    def sent(self, uuid, name=None, timestamp=None):
+        """Record a task-sent event."""
+        record = self.get_or_create(uuid)
+        if name:
+            record.name = name
+        record.sent = timestamp
+        return record
+
+    def received(self, uuid, name=None, timestamp=None):
+        """Record a task-received event."""
+        record = self.get_or_create(uuid)
+        if name:
+            record.name = name
+        record.received = timestamp
+        # A retried task is received again after a terminal event
+        self._terminal.pop(uuid, None)
+        return record
+
+    def started(self, uuid, timestamp=None):
+        """Record a task-started event."""
+        record = self.get_or_create(uuid)
+        record.started = timestamp
+        return record
+
+    def finished(self, uuid):
+        """
+        Mark a task as terminal and return its record (or None if unknown).
+
+        The record stays in the table for ``ttl`` seconds. This also sweeps
+        expired terminal tasks, so eviction cost is amortized over events.
+        """
+        now = self.clock()
+        record = self._records.get(uuid)
+        if record is not None:
+            self._terminal[uuid] = now
+            self._terminal.move_to_end(uuid)
+        self.sweep(now)
+        return record
+
+    def sweep(self, now=None):
+        """Evict terminal tasks older than ``ttl``. Returns the number evicted."""
+        if now is None:
+            now = self.clock()
+        deadline = now - self.ttl
+        evicted = 0
+        terminal = self._terminal
+        while terminal:
+            uuid, finished_at = next(iter(terminal.items()))
+            if finished_at > deadline:
+                break
+            terminal.popitem(last=False)
+            self._records.pop(uuid, None)
+            evicted += 1
+        if evicted and self.on_evict:
+            self.on_evict('ttl', evicted)
+        return evicted
+
+    def _evict_capacity(self):
+        """Drop the oldest entries until the table fits in ``max_entries``."""
+        evicted = 0
+        while len(self._records) > self.max_entries:
+            if self._terminal:
+                uuid, _ = self._terminal.popitem(last=False)
+                self._records.pop(uuid, None)
+            else:
+                # No terminal tasks left, drop the oldest in-flight task
+                uuid = next(iter(self._records))
+                del self._records[uuid]
+            evicted += 1
+        if evicted and self.on_evict:
+            self.on_evict('capacity', evicted)
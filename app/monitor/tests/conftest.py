@@ -0,0 +1,32 @@
+"""
+Fixtures shared by the exporter tests.
+"""
+import pytest
+
+from app.monitor.exporter import CelerySuccessExporter
+from app.monitor.memory_redis import MemoryRedis
+
+
+class FakeClock:
+    """Manually advanced time source."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    """Fake clock fixture."""
+    return FakeClock()
+
+
+@pytest.fixture
+def exporter_factory():
+    """Builds exporters writing to an in-memory Redis, a fresh one unless ``redis_client`` is given."""
+    def make(redis_client=None, **kwargs):
+        if redis_client is None:
+            redis_client = MemoryRedis()
+        return CelerySuccessExporter('memory://', redis_client=redis_client, **kwargs)
+    return make
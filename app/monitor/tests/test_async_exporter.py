@@ -0,0 +1,142 @@
+"""
+Tests for the asyncio exporter runtime.
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.monitor.async_exporter import AsyncCeleryExporter
+from app.monitor.memory_redis import AsyncMemoryRedis, MemoryRedis
+from app.monitor.recording import EventRecorder
+
+
+def task_events(count, name='tasks.add'):
+    """received/succeeded event bodies for ``count`` tasks."""
+    events = []
+    for i in range(count):
+        events.append({'type': 'task-received', 'uuid': str(i), 'name': name, 'timestamp': 1.0})
+        events.append({'type': 'task-succeeded', 'uuid': str(i), 'runtime': 0.5, 'timestamp': 1.5})
+    return events
+
+
+def make_exporter(redis_client, events, **kwargs):
+    """Async exporter whose receive thread feeds ``events`` instead of reading the broker."""
+    exporter = AsyncCeleryExporter(
+        'memory://', redis_client=redis_client, async_redis_client=AsyncMemoryRedis(redis_client),
+        checkpoint=False, **kwargs
+    )
+
+    def monitor_events():
+        handlers = exporter._receiver_handlers()
+        for event in events:
+            handlers[event['type']](event)
+
+    exporter._monitor_events = monitor_events
+    return exporter
+
+
+def run_until(exporter, condition, timeout=5.0):
+    """Run the exporter until ``condition()`` holds, then stop it."""
+    async def main():
+        runner = asyncio.create_task(exporter.run())
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not condition() and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.01)
+        exporter.stop()
+        await runner
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('lean', [False, True], ids=['default', 'lean'])
+def test_events_are_handled_and_stored(lean):
+    """Test that events fed by the receive thread are counted and flushed through the asyncio client."""
+    redis_client = MemoryRedis()
+    exporter = make_exporter(redis_client, task_events(100), lean=lean, update_interval=0.05)
+
+    run_until(exporter, lambda: exporter.registry.get_sample_value(
+        'celery_task_succeeded_total', {'name': 'tasks.add'}) == 100)
+
+    assert exporter.registry.get_sample_value('celery_task_received_total', {'name': 'tasks.add'}) == 100
+    assert b'celery_task_succeeded_total{name="tasks.add"} 100.0' in redis_client.data['celery_metrics']
+    assert exporter.async_redis.closed
+
+
+def test_final_flush_on_stop():
+    """Test that events handled after the last timer flush are written on shutdown."""
+    redis_client = MemoryRedis()
+    # The flush timer never fires during the test
+    exporter = make_exporter(redis_client, task_events(3), update_interval=60)
+
+    run_until(exporter, lambda: exporter.registry.get_sample_value(
+        'celery_task_succeeded_total', {'name': 'tasks.add'}) == 3)
+
+    assert b'celery_task_succeeded_total{name="tasks.add"} 3.0' in redis_client.data['celery_metrics']
+
+
+def test_failed_flush_keeps_metrics_dirty():
+    """Test that a failed asyncio write is retried on the next flush."""
+    redis_client = MemoryRedis()
+    exporter = make_exporter(redis_client, [], update_interval=60)
+    exporter._handle_task_received({'uuid': '1', 'name': 'tasks.add'})
+    exporter._metrics_dirty = True
+
+    class BrokenPipeline:
+        def __getattr__(self, name):
+            raise ConnectionError('down')
+
+    async def flush_twice():
+        pipeline = exporter.async_redis.pipeline
+        exporter.async_redis.pipeline = lambda transaction=True: BrokenPipeline()
+        await exporter._store_metrics_async()
+        assert exporter._metrics_dirty
+        exporter.async_redis.pipeline = pipeline
+        await exporter._store_metrics_async()
+
+    asyncio.run(flush_twice())
+
+    assert not exporter._metrics_dirty
+    assert b'celery_task_received_total{name="tasks.add"} 1.0' in redis_client.data['celery_metrics']
+
+
+def test_threaded_start_and_stop():
+    """Test that start() and stop() run the exporter like the threaded one."""
+    redis_client = MemoryRedis()
+    exporter = make_exporter(redis_client, task_events(10), update_interval=60)
+
+    exporter.start()
+    deadline = time.monotonic() + 5.0
+    while exporter.registry.get_sample_value(
+            'celery_task_succeeded_total', {'name': 'tasks.add'}) != 10 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    exporter.stop()
+
+    assert not exporter._loop_thread.is_alive()
+    assert b'celery_task_succeeded_total{name="tasks.add"} 10.0' in redis_client.data['celery_metrics']
+    assert exporter.async_redis.closed
+
+
+def test_recorder_closes_after_the_receiver(tmp_path):
+    """Test that events the receiver hands over while stopping are still recorded."""
+    recorder = EventRecorder(str(tmp_path / 'events'))
+    exporter = make_exporter(MemoryRedis(), [], recorder=recorder)
+    events = task_events(2)
+    first_batch_done = threading.Event()
+
+    def monitor_events():
+        handlers = exporter._receiver_handlers()
+        for event in events[:2]:
+            handlers[event['type']](event)
+        first_batch_done.set()
+        time.sleep(0.2)
+        for event in events[2:]:
+            handlers[event['type']](event)
+
+    exporter._monitor_events = monitor_events
+    exporter.start()
+    first_batch_done.wait(5.0)
+    exporter.stop()
+
+    assert recorder.records == 4
+    assert exporter.registry.get_sample_value('celery_task_succeeded_total', {'name': 'tasks.add'}) == 2
@@ -1,6 +1,7 @@
 """
 Tests for the basic authentication wrapper in monitor views.
 """
+import asyncio
 import base64
 import pytest
 from django.test import RequestFactory
@@ -117,4 +118,19 @@ def test_incomplete_credentials_configured(factory, test_view):
     
     # Check that we got the expected response from the test view (auth skipped)
     assert response.status_code == 200
-    assert response.content.decode('utf-8') == "Test view response" 
\ No newline at end of file
+    assert response.content.decode('utf-8') == "Test view response" 
+
+def test_async_view(factory):
+    """Test that async views stay async and are protected the same way."""
+    async def async_view(request):
+        return HttpResponse("Async view response")
+    view = basic_auth_required(auth_user='testuser', auth_pass='testpass')(async_view)
+    assert asyncio.iscoroutinefunction(view)
+
+    assert asyncio.run(view(factory.get('/metrics/'))).status_code == 401
+
+    request = factory.get('/metrics/')
+    request.META['HTTP_AUTHORIZATION'] = 'Basic ' + base64.b64encode(b'testuser:testpass').decode('utf-8')
+    response = asyncio.run(view(request))
+    assert response.status_code == 200
+    assert response.content.decode('utf-8') == "Async view response"
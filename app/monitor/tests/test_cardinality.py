@@ -0,0 +1,94 @@
+"""
+Tests for the task name cardinality guard.
+"""
+from prometheus_client import CollectorRegistry, Counter, Histogram
+
+from app.monitor.cardinality import SpaceSaving, TopKLabeler, fold_label
+
+
+def test_space_saving_tracks_heavy_hitters():
+    """Test that frequent keys survive a long tail of unique keys."""
+    summary = SpaceSaving(capacity=10)
+    for i in range(5000):
+        summary.offer('hot' if i % 3 == 0 else f'tail-{i}')
+
+    assert len(summary) == 10
+    key, count, error = summary.top(1)[0]
+    assert key == 'hot'
+    assert count - error <= 1667 <= count
+
+
+def test_labeler_folds_the_long_tail():
+    """Test that names beyond max_series are labeled 'other'."""
+    labeler = TopKLabeler(max_series=2)
+
+    assert [labeler.label(name) for name in ('a', 'b', 'c', 'a')] == ['a', 'b', 'other', 'a']
+    assert labeler.admitted == {'a', 'b'}
+
+
+def test_labeler_promotes_hotter_names():
+    """Test that a name overtaking an admitted one takes its place."""
+    demoted = []
+    labeler = TopKLabeler(max_series=2, rebalance_every=10, on_demote=demoted.append)
+    labeler.label('a')
+    labeler.label('b')
+    for _ in range(20):
+        labeler.label('a')
+        labeler.label('c')
+
+    assert labeler.admitted == {'a', 'c'}
+    assert demoted == ['b']
+    assert labeler.label('b') == 'other'
+
+
+def test_labeler_does_not_flap_between_similar_names():
+    """Test that names of about the same rate do not swap places on every rebalance."""
+    demoted = []
+    labeler = TopKLabeler(max_series=1, rebalance_every=10, on_demote=demoted.append)
+    for i in range(1000):
+        # 'b' is slightly hotter than the admitted 'a'
+        labeler.label('a')
+        labeler.label('b')
+        if i % 10 == 0:
+            labeler.label('b')
+
+    assert labeler.admitted == {'a'}
+    assert demoted == []
+
+
+def test_fold_label_keeps_sums():
+    """Test that folding moves counter values and histogram buckets into the target label."""
+    registry = CollectorRegistry()
+    counter = Counter('jobs_total', 'Jobs', ['name'], registry=registry)
+    histogram = Histogram('runtime', 'Runtime', ['task_name', 'state'], registry=registry, buckets=(1.0,))
+    counter.labels(name='b').inc(2)
+    counter.labels(name='other').inc(1)
+    histogram.labels(task_name='b', state='success').observe(0.5)
+    histogram.labels(task_name='b', state='failure').observe(2.0)
+
+    assert fold_label(counter, 'name', 'b', 'other') == 1
+    assert fold_label(histogram, 'task_name', 'b', 'other') == 2
+
+    assert registry.get_sample_value('jobs_total', {'name': 'b'}) is None
+    assert registry.get_sample_value('jobs_total', {'name': 'other'}) == 3
+    assert registry.get_sample_value('runtime_bucket', {'task_name': 'other', 'state': 'success', 'le': '1.0'}) == 1
+    assert registry.get_sample_value('runtime_sum', {'task_name': 'other', 'state': 'failure'}) == 2.0
+
+
+def test_exporter_bounds_task_name_series(exporter_factory):
+    """Test that a flood of dynamic task names ends up in 'other'."""
+    exporter = exporter_factory(max_task_names=3, lean=True)
+    for i in range(100):
+        exporter._lean_task_received({'uuid': str(i), 'name': f'tasks.dynamic_{i}'})
+        exporter._lean_task_succeeded({'uuid': str(i), 'runtime': 0.1})
+
+    registry = exporter.registry
+    names = {
+        sample.labels['name']
+        for metric in registry.collect() if metric.name == 'celery_task_received'
+        for sample in metric.samples if sample.name == 'celery_task_received_total'
+    }
+    assert len(names) <= 4
+    assert 'other' in names
+    total = sum(registry.get_sample_value('celery_task_received_total', {'name': name}) for name in names)
+    assert total == 100
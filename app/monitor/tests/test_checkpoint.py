@@ -0,0 +1,144 @@
+"""
+Tests for binary metrics checkpoints and warm restarts.
+"""
+import struct
+import zlib
+
+import pytest
+from prometheus_client import CollectorRegistry, Counter, Histogram
+
+from app.monitor.checkpoint import CheckpointError, decode_checkpoint, encode_checkpoint, restore_checkpoint
+from app.monitor.memory_redis import MemoryRedis
+
+
+def build_metrics():
+    """A labeled histogram and an unlabeled counter in a fresh registry."""
+    registry = CollectorRegistry()
+    counter = Counter('jobs_total', 'Jobs', registry=registry)
+    histogram = Histogram('runtime_seconds', 'Runtime', ['task_name'], registry=registry, buckets=(1.0, 5.0))
+    return registry, [counter, histogram]
+
+
+def test_round_trip_restores_values():
+    """Test that a restored registry reports the same samples as the original."""
+    registry, metrics = build_metrics()
+    metrics[0].inc(42)
+    metrics[1].labels('tasks.add').observe(0.5)
+    metrics[1].labels('tasks.add').observe(3.0)
+    metrics[1].labels('tâches.ünïcode').observe(9.0)
+
+    created_at, records = decode_checkpoint(encode_checkpoint(metrics, 1234.5))
+    restored_registry, restored_metrics = build_metrics()
+
+    assert created_at == 1234.5
+    assert restore_checkpoint(restored_metrics, records) == 3
+    for name, labels in [
+        ('jobs_total', {}),
+        ('runtime_seconds_bucket', {'task_name': 'tasks.add', 'le': '1.0'}),
+        ('runtime_seconds_bucket', {'task_name': 'tasks.add', 'le': '+Inf'}),
+        ('runtime_seconds_sum', {'task_name': 'tasks.add'}),
+        ('runtime_seconds_count', {'task_name': 'tâches.ünïcode'}),
+    ]:
+        assert restored_registry.get_sample_value(name, labels) == registry.get_sample_value(name, labels)
+
+
+def test_label_values_over_64_kib():
+    """Test that label values too long for a u16 length round-trip."""
+    _, metrics = build_metrics()
+    long_name = 'tasks.' + 'x' * 70000
+    metrics[1].labels(long_name).observe(0.5)
+
+    _, records = decode_checkpoint(encode_checkpoint(metrics, 0))
+    restored_registry, restored_metrics = build_metrics()
+
+    assert restore_checkpoint(restored_metrics, records) == 2
+    assert restored_registry.get_sample_value('runtime_seconds_count', {'task_name': long_name}) == 1
+
+
+def test_version_1_checkpoint_is_read():
+    """Test that checkpoints written with u16 lengths still restore."""
+    strings = b''.join(struct.pack('<H', len(value)) + value for value in (b'jobs_total',))
+    record = struct.pack('<IBHd', 0, 0, 1, 7.0)
+    data = struct.pack('<4sBdII', b'CXCK', 1, 12.0, 1, 1) + zlib.compress(strings + record)
+
+    assert decode_checkpoint(data) == (12.0, [('jobs_total', (), (7.0,))])
+
+
+def test_changed_buckets_are_skipped():
+    """Test that histograms with a different bucket layout are not restored."""
+    _, metrics = build_metrics()
+    metrics[1].labels('tasks.add').observe(0.5)
+    _, records = decode_checkpoint(encode_checkpoint(metrics, 0))
+
+    registry = CollectorRegistry()
+    other = Histogram('runtime_seconds', 'Runtime', ['task_name'], registry=registry, buckets=(1.0,))
+
+    assert restore_checkpoint([other], records) == 0
+
+
+@pytest.mark.parametrize('data', [b'', b'XXXX' + b'\0' * 30, b'CXCK\x01' + b'\0' * 16 + b'not zlib'])
+def test_corrupt_checkpoint(data):
+    """Test that unreadable checkpoints raise CheckpointError."""
+    with pytest.raises(CheckpointError):
+        decode_checkpoint(data)
+
+
+def test_exporter_warm_restart(exporter_factory):
+    """Test that a restarted exporter continues its counters from the checkpoint."""
+    redis_client = MemoryRedis()
+    exporter = exporter_factory(redis_client)
+    for i in range(3):
+        exporter._handle_task_received({'uuid': str(i), 'name': 'tasks.add'})
+        exporter._handle_task_succeeded({'uuid': str(i), 'runtime': 0.2})
+    exporter._store_metrics()
+
+    restarted = exporter_factory(redis_client, max_task_names=1)
+
+    assert restarted.registry.get_sample_value('celery_task_succeeded_total', {'name': 'tasks.add'}) == 3
+    assert restarted.registry.get_sample_value(
+        'celery_task_runtime_seconds_count', {'task_name': 'tasks.add', 'state': 'success'}
+    ) == 3
+    assert b'celery_task_succeeded_total{name="tasks.add"} 3.0' in redis_client.get('celery_metrics')
+    # Restored names keep their own series
+    assert restarted.task_names.admitted == {'tasks.add'}
+
+
+def test_checkpoint_is_never_behind_the_payload(exporter_factory):
+    """Test that a killed exporter restarts from the counts it last stored, not from an older checkpoint."""
+    redis_client = MemoryRedis()
+    exporter = exporter_factory(redis_client)
+    for i in range(5):
+        exporter._handle_task_received({'uuid': str(i), 'name': 'tasks.add'})
+        exporter._handle_task_succeeded({'uuid': str(i), 'runtime': 0.2})
+        exporter._store_metrics()
+    # Handled but never flushed, so never scraped either
+    exporter._handle_task_received({'uuid': 'lost', 'name': 'tasks.add'})
+
+    restarted = exporter_factory(redis_client)
+
+    assert restarted.registry.get_sample_value('celery_task_succeeded_total', {'name': 'tasks.add'}) == 5
+    assert restarted.registry.get_sample_value('celery_task_received_total', {'name': 'tasks.add'}) == 5
+
+
+def test_long_task_name_does_not_break_flushes(exporter_factory):
+    """Test that a task name over 64 KiB is flushed and checkpointed."""
+    redis_client = MemoryRedis()
+    exporter = exporter_factory(redis_client)
+    long_name = 'tasks.' + 'x' * 70000
+    exporter.handlers['task-received']({'uuid': 'a', 'name': long_name, 'timestamp': 1.0})
+    exporter._store_metrics()
+
+    assert exporter.registry.get_sample_value('celery_exporter_redis_errors_total', {'operation': 'flush'}) is None
+    _, records = decode_checkpoint(redis_client.get('celery_metrics:checkpoint'))
+    assert ('celery_task_received', (long_name,), (1.0,)) in records
+
+
+def test_hash_storage_skips_checkpoints(exporter_factory):
+    """Test that hash storage, which keeps counting in Redis, writes no checkpoint."""
+    redis_client = MemoryRedis()
+    exporter = exporter_factory(redis_client, storage_mode='hash')
+    exporter._handle_task_received({'uuid': 'a', 'name': 'tasks.add'})
+    exporter._store_metrics()
+
+    assert not exporter.checkpoint
+    assert redis_client.get('celery_metrics:checkpoint') is None
@@ -0,0 +1,51 @@
+"""
+Tests for content encoding negotiation of metrics payloads.
+"""
+import pytest
+
+from app.monitor.encoding import choose_encoding, choose_format, compress, decompress, parse_encodings
+
+
+@pytest.mark.parametrize('accept_encoding,offered,expected', [
+    ('gzip', {'identity', 'gzip'}, 'gzip'),
+    ('gzip, zstd', {'identity', 'gzip', 'zstd'}, 'zstd'),  # zstd preferred on a tie
+    ('gzip;q=1.0, zstd;q=0.5', {'identity', 'gzip', 'zstd'}, 'gzip'),
+    ('', {'identity', 'gzip'}, 'identity'),
+    ('br', {'identity', 'gzip'}, 'identity'),
+    ('gzip;q=0', {'identity', 'gzip'}, 'identity'),
+    ('*', {'identity', 'gzip'}, 'gzip'),
+    ('identity;q=0, gzip', {'identity'}, None),
+    ('*;q=0', {'identity', 'gzip'}, None),
+])
+def test_choose_encoding(accept_encoding, offered, expected):
+    """Test Accept-Encoding negotiation."""
+    assert choose_encoding(accept_encoding, offered) == expected
+
+
+@pytest.mark.parametrize('accept,expected', [
+    ('application/openmetrics-text;version=1.0.0,text/plain;version=0.0.4;q=0.5,*/*;q=0.1', 'openmetrics'),
+    ('application/openmetrics-text; version=0.0.1', 'openmetrics'),
+    ('text/plain;version=0.0.4', 'text'),
+    ('', 'text'),
+    ('*/*', 'text'),
+    ('application/openmetrics-text;q=0.5, text/plain', 'text'),
+    ('application/openmetrics-text;q=0', 'text'),
+])
+def test_choose_format(accept, expected):
+    """Test exposition format negotiation from the Accept header."""
+    assert choose_format(accept) == expected
+
+
+def test_gzip_round_trip():
+    """Test that compressed payloads decompress to the original."""
+    payload = b'celery_task_succeeded_total 1.0\n' * 100
+    compressed = compress(payload, 'gzip')
+
+    assert len(compressed) < len(payload)
+    assert decompress(compressed, 'gzip') == payload
+
+
+def test_parse_encodings_drops_unsupported():
+    """Test that unknown encodings in the configuration are ignored."""
+    assert parse_encodings(' gzip , br') == ('gzip',)
+    assert parse_encodings('') == ()
@@ -90,17 +90,18 @@ class TestCelerySuccessExporter(TestCase):
         return ""
     
     def get_counter_value(self, metric_name: str) -> float:
-        """Extract a counter value from the stored metrics."""
+        """Extract a counter value, summed over all task names, from the stored metrics."""
         try:
             metrics = self.get_metrics()
             if not metrics:
                 return 0.0
                 
-            # Parse the metrics text to find the counter value
+            # Parse the metrics text and add up the counter's series
+            total = 0.0
             for line in metrics.splitlines():
-                if line.startswith(f'{metric_name} '):
-                    return float(line.split()[1])
-            return 0.0
+                if line.startswith(f'{metric_name} ') or line.startswith(f'{metric_name}{{'):
+                    total += float(line.rsplit(' ', 1)[1])
+            return total
         except (ValueError, AttributeError):
             return 0.0
     
@@ -212,8 +213,8 @@ class TestCelerySuccessExporter(TestCase):
         
         # Verify final metrics format
         final_metrics = self.get_metrics()
-        self.assertIn(f'celery_task_succeeded_total {final_value}', final_metrics,
-                     "Final metrics should contain the correct success counter value")
+        self.assertIn('celery_task_succeeded_total{name="app.monitor.tests.celery_test_app.test_task"}', final_metrics,
+                     "Final metrics should contain the success counter labeled by task name")
     
     def test_periodic_updates(self):
         """Test that metrics are updated periodically rather than on every event."""
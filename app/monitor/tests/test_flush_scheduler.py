@@ -0,0 +1,164 @@
+"""
+Tests for the event-driven, rate-adaptive flush scheduler.
+"""
+import threading
+import time
+
+import pytest
+
+from app.monitor.flush_scheduler import FlushScheduler
+from app.monitor.memory_redis import MemoryRedis
+
+
+def test_interval_follows_flush_cost():
+    """Test that expensive flushes stretch the interval up to the ceiling."""
+    scheduler = FlushScheduler(0.1, 5.0, max_flush_share=0.1, smoothing=1.0)
+    assert scheduler.interval == 0.1
+
+    scheduler.record_flush(duration=0.05, events=0, elapsed=1.0)
+    assert scheduler.interval == pytest.approx(0.5)
+    scheduler.record_flush(duration=10.0, events=0, elapsed=1.0)
+    assert scheduler.interval == 5.0
+    scheduler.record_flush(duration=0.001, events=0, elapsed=1.0)
+    assert scheduler.interval == 0.1
+
+
+def test_busy_event_stream_lowers_flush_share():
+    """Test that the same flush cost gets a longer interval at a higher event rate."""
+    scheduler = FlushScheduler(0.01, 60.0, max_flush_share=0.1, rate_scale=1000.0, smoothing=1.0)
+    scheduler.record_flush(duration=0.05, events=0, elapsed=1.0)
+    quiet = scheduler.interval
+    scheduler.record_flush(duration=0.05, events=3000, elapsed=1.0)
+
+    assert scheduler.interval == pytest.approx(quiet * 4)
+
+
+def test_fixed_interval():
+    """Test that equal bounds keep the interval fixed."""
+    scheduler = FlushScheduler(0.5, 0.5)
+    scheduler.record_flush(duration=2.0, events=100000, elapsed=0.5)
+    assert scheduler.interval == 0.5
+
+
+def test_invalid_bounds():
+    """Test that a floor above the ceiling is rejected."""
+    with pytest.raises(ValueError):
+        FlushScheduler(1.0, 0.5)
+
+
+def test_next_flush_coalesces_bursts(clock):
+    """Test that a change after a quiet period waits out the floor before flushing."""
+    scheduler = FlushScheduler(0.2, 0.2, clock=clock)
+    assert scheduler.next_flush(last_flush=900.0) == pytest.approx(900.2)
+
+    scheduler.notify()
+    clock.now += 0.1
+    # Later changes do not push the flush back
+    scheduler.notify()
+    assert scheduler.next_flush(last_flush=900.0) == pytest.approx(1000.2)
+
+    scheduler.flushing()
+    assert scheduler.next_flush(last_flush=1000.2) == pytest.approx(1000.4)
+
+
+def test_wait_returns_on_notify():
+    """Test that a waiting thread wakes up as soon as it is notified."""
+    scheduler = FlushScheduler(0.1, 0.1)
+    assert not scheduler.wait(0.01)
+
+    timer = threading.Timer(0.05, scheduler.notify)
+    timer.start()
+    start = time.monotonic()
+    assert scheduler.wait(10.0)
+    assert time.monotonic() - start < 5.0
+    timer.join()
+
+
+def test_updater_sleeps_until_metrics_change(exporter_factory):
+    """Test that an idle exporter does not write to Redis and a change is flushed after the floor."""
+    redis_client = MemoryRedis()
+    exporter = exporter_factory(redis_client, checkpoint=False,
+                                     flush_interval_min=0.05, flush_interval_max=1.0)
+    exporter._monitor_events = lambda: None
+    exporter.start()
+    try:
+        time.sleep(0.2)
+        idle_round_trips = redis_client.round_trips
+        time.sleep(0.3)
+        assert redis_client.round_trips == idle_round_trips
+
+        exporter.handlers['task-received']({'uuid': 'a', 'name': 'tasks.add', 'timestamp': time.time()})
+        deadline = time.monotonic() + 5.0
+        while redis_client.round_trips == idle_round_trips and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert redis_client.round_trips == idle_round_trips + 1
+        assert b'celery_task_received_total{name="tasks.add"} 1.0' in redis_client.get(exporter.metrics_key)
+    finally:
+        exporter.stop()
+
+    interval = exporter.registry.get_sample_value('celery_exporter_flush_interval_seconds')
+    assert 0.05 <= interval <= 1.0
+
+
+@pytest.mark.parametrize('lean', [False, True], ids=['default', 'lean'])
+def test_handlers_notify_once_per_flush(lean, exporter_factory):
+    """Test that only the first event after a flush wakes the updater."""
+    exporter = exporter_factory(checkpoint=False, lean=lean)
+    scheduler = exporter.flush_scheduler
+    handle = exporter.handlers['task-received']
+
+    handle({'uuid': 'a', 'name': 'tasks.add', 'timestamp': time.time()})
+    assert exporter._metrics_dirty
+    assert scheduler.wait(0)
+    handle({'uuid': 'b', 'name': 'tasks.add', 'timestamp': time.time()})
+    assert not scheduler.wait(0)
+
+    exporter._store_metrics()
+    handle({'uuid': 'c', 'name': 'tasks.add', 'timestamp': time.time()})
+    assert scheduler.wait(0)
+
+
+def test_first_event_visible_within_min_interval(exporter_factory):
+    """Test that an idle exporter flushes the first event once the floor elapsed, not a poll later."""
+    redis_client = MemoryRedis()
+    exporter = exporter_factory(redis_client, checkpoint=False, flush_interval_min=0.2, flush_interval_max=1.0)
+    exporter._monitor_events = lambda: None
+    version_key = f'{exporter.metrics_key}:version'
+    exporter.start()
+    try:
+        time.sleep(0.5)
+        version = redis_client.get(version_key)
+        start = time.monotonic()
+        exporter.handlers['task-received']({'uuid': 'a', 'name': 'tasks.add', 'timestamp': time.time()})
+        while redis_client.get(version_key) == version and time.monotonic() - start < 5.0:
+            time.sleep(0.005)
+        elapsed = time.monotonic() - start
+    finally:
+        exporter.stop()
+
+    # The coalescing floor, plus scheduling slack
+    assert 0.2 <= elapsed < 0.3
+
+
+@pytest.mark.parametrize('storage_mode', ['text', 'hash'])
+def test_idle_updater_confirms_freshness(storage_mode, exporter_factory):
+    """Test that an idle exporter rewrites its flush time and version every freshness interval."""
+    redis_client = MemoryRedis()
+    exporter = exporter_factory(redis_client, checkpoint=False,
+                                     storage_mode=storage_mode, flush_interval_min=0.05, flush_interval_max=1.0,
+                                     freshness_interval=0.2)
+    exporter._monitor_events = lambda: None
+    flushed_at_key = f'{exporter.metrics_key}:flushed_at'
+    version_key = f'{exporter.metrics_key}:version'
+    exporter.start()
+    try:
+        time.sleep(0.1)
+        flushed_at, version = float(redis_client.get(flushed_at_key)), int(redis_client.get(version_key))
+        deadline = time.monotonic() + 5.0
+        while float(redis_client.get(flushed_at_key)) == flushed_at and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        exporter.stop()
+
+    assert float(redis_client.get(flushed_at_key)) - flushed_at >= 0.2
+    assert int(redis_client.get(version_key)) > version
@@ -0,0 +1,107 @@
+"""
+Tests for serving /metrics from the exporter process.
+"""
+import base64
+import gzip
+import urllib.error
+import urllib.request
+
+import pytest
+
+from app.monitor.http_server import MetricsServer, check_basic_auth
+
+
+def basic(username, password):
+    return 'Basic ' + base64.b64encode(f'{username}:{password}'.encode()).decode()
+
+
+@pytest.fixture
+def exporter(exporter_factory):
+    return exporter_factory(checkpoint=False)
+
+
+@pytest.fixture
+def serve(exporter):
+    servers = []
+
+    def start(**kwargs):
+        server = MetricsServer(exporter.registry, host='127.0.0.1', port=0, **kwargs)
+        server.start()
+        servers.append(server)
+        host, port = server.server_address
+        return f'http://{host}:{port}'
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def fetch(url, headers=None):
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {}), timeout=5) as response:
+        return response.headers, response.read()
+
+
+def test_serves_live_registry(exporter, serve):
+    """Test that scrapes see handled events before any flush to Redis."""
+    url = serve()
+    exporter.handlers['task-received']({'uuid': 'a', 'name': 'tasks.add', 'timestamp': 1.0})
+
+    headers, body = fetch(url + '/metrics')
+
+    assert b'celery_task_received_total{name="tasks.add"} 1.0' in body
+    assert headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    # Not flushed yet
+    assert b'tasks.add' not in (exporter.redis_client.get(exporter.metrics_key) or b'')
+
+
+def test_compressed_response(exporter, serve):
+    """Test that a scraper accepting gzip gets a compressed body."""
+    url = serve()
+    headers, body = fetch(url + '/metrics', {'Accept-Encoding': 'gzip'})
+
+    assert headers['Content-Encoding'] == 'gzip'
+    assert b'celery_exporter_flush_interval_seconds' in gzip.decompress(body)
+
+
+def test_openmetrics_response(exporter, serve):
+    """Test that OpenMetrics scrapers get the task uuid as exemplar of its runtime bucket."""
+    url = serve()
+    exporter.handlers['task-received']({'uuid': 'a1b2', 'name': 'tasks.add', 'timestamp': 1.0})
+    exporter.handlers['task-succeeded']({'uuid': 'a1b2', 'runtime': 0.3, 'timestamp': 2.0})
+
+    headers, body = fetch(url + '/metrics', {'Accept': 'application/openmetrics-text;version=1.0.0'})
+
+    assert headers['Content-Type'].startswith('application/openmetrics-text')
+    assert b'celery_task_runtime_seconds_bucket{le="0.5",state="success",task_name="tasks.add"} 1.0 ' \
+           b'# {task_uuid="a1b2"} 0.3' in body
+    assert body.endswith(b'# EOF\n')
+
+
+def test_basic_auth(serve):
+    """Test that configured credentials are required."""
+    url = serve(auth_user='prometheus', auth_pass='secret')
+    for headers in ({}, {'Authorization': basic('prometheus', 'wrong')}):
+        with pytest.raises(urllib.error.HTTPError) as error:
+            fetch(url + '/metrics', headers)
+        assert error.value.code == 401
+        assert error.value.headers['WWW-Authenticate'].startswith('Basic')
+
+    _, body = fetch(url + '/metrics', {'Authorization': basic('prometheus', 'secret')})
+    assert b'celery_exporter_flush_interval_seconds' in body
+
+
+def test_unknown_path(serve):
+    """Test that only /metrics is served."""
+    url = serve()
+    with pytest.raises(urllib.error.HTTPError) as error:
+        fetch(url + '/admin')
+    assert error.value.code == 404
+
+
+def test_check_basic_auth():
+    """Test header parsing, including malformed headers."""
+    assert check_basic_auth(None, '', '')
+    assert check_basic_auth(basic('u', 'p:with:colons'), 'u', 'p:with:colons')
+    assert not check_basic_auth('Basic not-base64!', 'u', 'p')
+    assert not check_basic_auth('Bearer token', 'u', 'p')
+    assert not check_basic_auth(None, 'u', 'p')
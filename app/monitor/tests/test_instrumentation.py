@@ -0,0 +1,172 @@
+"""
+Tests for the exporter's self-instrumentation.
+"""
+import time
+
+import pytest
+
+from app.monitor.instrumentation import EventStats
+from app.monitor.memory_redis import MemoryRedis
+from app.monitor.storage import STORAGE_HASH
+
+
+class FailingPipeline:
+    """Pipeline whose execute() fails like an unreachable Redis."""
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        raise ConnectionError("Redis is down")
+
+
+def test_event_stats_histograms():
+    """Test that handler time and event lag are counted per bucket."""
+    stats = EventStats(handler_buckets=(1.0,), lag_buckets=(1.0, 10.0), clock=lambda: 100.0)
+    handler = stats.instrument('task-succeeded', lambda event: None)
+    handler({'timestamp': 99.5})
+    handler({'timestamp': 95.0})
+    # Worker clock ahead of the exporter
+    handler({'timestamp': 101.0})
+    # No timestamp, no lag observation
+    handler({})
+
+    families = {family.name: family for family in stats.collect()}
+    processed = families['celery_exporter_events_processed'].samples
+    assert [(s.labels, s.value) for s in processed] == [({'type': 'task-succeeded'}, 4)]
+
+    lag = {(s.name, s.labels.get('le')): s.value for s in families['celery_exporter_event_lag_seconds'].samples}
+    assert lag[('celery_exporter_event_lag_seconds_bucket', '1.0')] == 2
+    assert lag[('celery_exporter_event_lag_seconds_bucket', '10.0')] == 3
+    assert lag[('celery_exporter_event_lag_seconds_count', None)] == 3
+    assert lag[('celery_exporter_event_lag_seconds_sum', None)] == 5.5
+
+
+def test_event_stats_oldest_event():
+    """Test that the first event timestamp stands in for the oldest, is taken once and can be put back."""
+    stats = EventStats(handler_buckets=(1.0,), lag_buckets=(1.0,), clock=lambda: 100.0)
+    handler = stats.instrument('task-received', lambda event: None)
+    assert stats.take_oldest() is None
+
+    handler({'timestamp': 95.0})
+    handler({'timestamp': 98.0})
+    assert stats.take_oldest() == 95.0
+    assert stats.take_oldest() is None
+
+    # A first event without a timestamp leaves the flush without one
+    handler({})
+    handler({'timestamp': 96.0})
+    assert stats.take_oldest() is None
+
+    # A failed flush gives its events back
+    handler({'timestamp': 99.5})
+    stats.keep_oldest(95.0)
+    assert stats.take_oldest() == 95.0
+
+
+def test_event_stats_counts_only():
+    """Test that without details events are counted and the first timestamp is kept, without histograms."""
+    stats = EventStats(handler_buckets=(1.0,), lag_buckets=(1.0,), clock=lambda: 100.0, detailed=False)
+    handler = stats.instrument('task-received', lambda event: None)
+    handler({'timestamp': 95.0})
+    handler({'timestamp': 98.0})
+
+    families = {family.name: family for family in stats.collect()}
+    assert list(families) == ['celery_exporter_events_processed']
+    assert [s.value for s in families['celery_exporter_events_processed'].samples] == [2]
+    assert stats.processed() == 2
+    assert stats.take_oldest() == 95.0
+
+
+@pytest.mark.parametrize('detailed', [True, False], ids=['detailed', 'counts'])
+def test_event_stats_on_first(detailed):
+    """Test that only the first event after each take_oldest() calls on_first."""
+    calls = []
+    stats = EventStats(handler_buckets=(1.0,), lag_buckets=(1.0,), clock=lambda: 100.0, detailed=detailed,
+                       on_first=lambda: calls.append(1))
+    handler = stats.instrument('task-received', lambda event: None)
+    handler({})
+    handler({'timestamp': 99.0})
+    assert len(calls) == 1
+
+    stats.take_oldest()
+    handler({'timestamp': 99.5})
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize('lean', [False, True], ids=['default', 'lean'])
+def test_handlers_are_instrumented(lean, exporter_factory):
+    """Test that handled events show up in the exporter registry."""
+    exporter = exporter_factory(lean=lean, event_stats=True)
+    exporter.handlers['task-received']({'uuid': 'a', 'name': 'tasks.add', 'timestamp': 1.0})
+    exporter.handlers['task-succeeded']({'uuid': 'a', 'runtime': 0.5, 'timestamp': 2.0})
+
+    registry = exporter.registry
+    assert registry.get_sample_value('celery_exporter_events_processed_total', {'type': 'task-received'}) == 1
+    assert registry.get_sample_value('celery_exporter_handler_duration_seconds_count', {'type': 'task-succeeded'}) == 1
+    assert registry.get_sample_value('celery_exporter_event_lag_seconds_count') == 2
+
+
+def test_lean_mode_counts_events_only(exporter_factory):
+    """Test that lean mode skips the handler and lag histograms unless asked."""
+    exporter = exporter_factory(lean=True)
+    exporter.handlers['task-received']({'uuid': 'a', 'name': 'tasks.add', 'timestamp': 1.0})
+
+    registry = exporter.registry
+    assert registry.get_sample_value('celery_exporter_events_processed_total', {'type': 'task-received'}) == 1
+    assert registry.get_sample_value('celery_exporter_event_lag_seconds_count') is None
+
+
+@pytest.mark.parametrize('storage_mode', ['text', STORAGE_HASH])
+def test_flush_metrics(storage_mode, exporter_factory):
+    """Test that flushes record their duration, payload size and time."""
+    redis_client = MemoryRedis()
+    exporter = exporter_factory(redis_client, storage_mode=storage_mode)
+    exporter.handlers['task-received']({'uuid': 'a', 'name': 'tasks.add'})
+    exporter._store_metrics()
+
+    registry = exporter.registry
+    # The initial store and this one
+    assert registry.get_sample_value('celery_exporter_flush_duration_seconds_count') == 2
+    assert registry.get_sample_value('celery_exporter_flush_payload_bytes') > 0
+    assert registry.get_sample_value('celery_exporter_last_flush_timestamp_seconds') == exporter._last_update_time
+    assert float(redis_client.get('celery_metrics:flushed_at')) <= exporter._last_update_time
+    # The stored payload would always show ~0, readers derive the age from the flush time
+    assert registry.get_sample_value('celery_exporter_seconds_since_last_flush') is None
+
+
+def test_event_visible_delay(exporter_factory):
+    """Test that a flush reports how long its oldest event waited to become visible."""
+    exporter = exporter_factory()
+    now = time.time()
+    exporter.handlers['task-received']({'uuid': 'a', 'name': 'tasks.add', 'timestamp': now - 3.0})
+    exporter.handlers['task-succeeded']({'uuid': 'a', 'runtime': 0.5, 'timestamp': now - 1.0})
+    exporter._store_metrics()
+
+    delay = exporter.registry.get_sample_value('celery_exporter_event_visible_delay_seconds')
+    assert 3.0 <= delay < 8.0
+
+
+def test_redis_errors(exporter_factory):
+    """Test that failed flushes are counted and do not move the last flush time."""
+    exporter = exporter_factory()
+    last_flush = exporter.registry.get_sample_value('celery_exporter_last_flush_timestamp_seconds')
+    exporter.redis_client.pipeline = lambda transaction=True: FailingPipeline()
+    exporter._store_metrics()
+
+    registry = exporter.registry
+    assert registry.get_sample_value('celery_exporter_redis_errors_total', {'operation': 'flush'}) == 1
+    assert registry.get_sample_value('celery_exporter_last_flush_timestamp_seconds') == last_flush
+    assert exporter._metrics_dirty
+
+
+def test_failed_flush_keeps_event_delay(exporter_factory):
+    """Test that events of a failed flush count towards the delay of the next successful one."""
+    exporter = exporter_factory()
+    pipeline = exporter.redis_client.pipeline
+    exporter.handlers['task-received']({'uuid': 'a', 'name': 'tasks.add', 'timestamp': time.time() - 30.0})
+    exporter.redis_client.pipeline = lambda transaction=True: FailingPipeline()
+    exporter._store_metrics()
+    exporter.redis_client.pipeline = pipeline
+    exporter._store_metrics()
+
+    assert exporter.registry.get_sample_value('celery_exporter_event_visible_delay_seconds') >= 30.0
@@ -0,0 +1,68 @@
+"""
+Tests for the queue wait and start latency histograms.
+"""
+import pytest
+
+
+@pytest.fixture(params=[False, True], ids=['default', 'lean'])
+def exporter(request, exporter_factory):
+    """Exporter in default and lean mode."""
+    return exporter_factory(lean=request.param)
+
+
+def feed(exporter, uuid, sent, received, started):
+    handlers = exporter.handlers
+    handlers['task-sent']({'type': 'task-sent', 'uuid': uuid, 'name': 'tasks.add', 'timestamp': sent})
+    handlers['task-received']({'type': 'task-received', 'uuid': uuid, 'name': 'tasks.add', 'timestamp': received})
+    handlers['task-started']({'type': 'task-started', 'uuid': uuid, 'timestamp': started})
+    handlers['task-succeeded']({'type': 'task-succeeded', 'uuid': uuid, 'runtime': 1.0, 'timestamp': started + 1})
+
+
+def test_latencies_per_task_name(exporter):
+    """Test that sent->received and received->started latencies are observed per task name."""
+    feed(exporter, 'a', sent=100.0, received=145.0, started=145.5)
+    feed(exporter, 'b', sent=100.0, received=115.0, started=115.5)
+
+    registry = exporter.registry
+    labels = {'task_name': 'tasks.add'}
+    assert registry.get_sample_value('celery_task_queue_wait_seconds_count', labels) == 2
+    assert registry.get_sample_value('celery_task_queue_wait_seconds_sum', labels) == 60.0
+    assert registry.get_sample_value('celery_task_queue_wait_seconds_bucket', {**labels, 'le': '30.0'}) == 1
+    assert registry.get_sample_value('celery_task_start_latency_seconds_sum', labels) == 1.0
+
+
+def test_missing_sent_event(exporter):
+    """Test that tasks without a task-sent event only get a start latency."""
+    exporter.handlers['task-received']({'uuid': 'a', 'name': 'tasks.add', 'timestamp': 10.0})
+    exporter.handlers['task-started']({'uuid': 'a', 'timestamp': 12.0})
+
+    registry = exporter.registry
+    # Lean mode creates the (empty) series up front
+    assert not registry.get_sample_value('celery_task_queue_wait_seconds_count', {'task_name': 'tasks.add'})
+    assert registry.get_sample_value('celery_task_start_latency_seconds_sum', {'task_name': 'tasks.add'}) == 2.0
+
+
+def test_late_sent_event(exporter):
+    """Test that a task-sent handled after task-received does not leak queue wait into the start latency."""
+    exporter.handlers['task-received']({'uuid': 'a', 'name': 'tasks.add', 'timestamp': 10.0})
+    exporter.handlers['task-sent']({'uuid': 'a', 'name': 'tasks.add', 'timestamp': 4.0})
+    exporter.handlers['task-started']({'uuid': 'a', 'timestamp': 12.0})
+
+    assert exporter.registry.get_sample_value('celery_task_start_latency_seconds_sum', {'task_name': 'tasks.add'}) == 2.0
+
+
+def test_clock_skew_is_clamped(exporter):
+    """Test that a worker clock behind the sender does not produce negative latencies."""
+    exporter.handlers['task-sent']({'uuid': 'a', 'name': 'tasks.add', 'timestamp': 10.0})
+    exporter.handlers['task-received']({'uuid': 'a', 'name': 'tasks.add', 'timestamp': 9.5})
+
+    assert exporter.registry.get_sample_value('celery_task_queue_wait_seconds_sum', {'task_name': 'tasks.add'}) == 0
+
+
+def test_lean_timestamps_are_bounded(exporter_factory):
+    """Test that sent tasks whose later events never arrive do not grow the lean maps."""
+    exporter = exporter_factory(lean=True, lean_name_map_size=10)
+    for i in range(100):
+        exporter.handlers['task-sent']({'uuid': str(i), 'name': 'tasks.add', 'timestamp': float(i)})
+
+    assert len(exporter._lean_timestamps) == 10
@@ -0,0 +1,301 @@
+"""
+Tests for the metrics view, with Redis replaced by an in-memory stand-in.
+"""
+import asyncio
+import gzip
+
+import pytest
+from django.test import RequestFactory
+
+from app.monitor import views
+from app.monitor.exporter import CelerySuccessExporter
+from app.monitor.memory_redis import AsyncMemoryRedis, MemoryRedis
+from app.monitor.redis_pool import CircuitBreaker, RedisAccess
+
+
+@pytest.fixture
+def factory():
+    """Request factory fixture."""
+    return RequestFactory()
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    """In-memory Redis used by the view instead of a real connection."""
+    client = MemoryRedis()
+    access = RedisAccess(client, CircuitBreaker(failure_threshold=1))
+    monkeypatch.setattr(views, 'get_redis', lambda url: access)
+    views._scrape_cache.clear()
+    views._openmetrics_scrape_cache.clear()
+    yield client
+    views._scrape_cache.clear()
+    views._openmetrics_scrape_cache.clear()
+
+
+def store_payload(redis_client, payload, compressed=False):
+    """Store a payload the way the exporter does in text mode."""
+    redis_client.set(views.METRICS_KEY, payload)
+    if compressed:
+        redis_client.set(f'{views.METRICS_KEY}:gzip', gzip.compress(payload))
+    redis_client.incr(f'{views.METRICS_KEY}:version')
+
+
+def test_no_metrics(factory, redis_client):
+    """Test the placeholder response when the exporter has not stored anything."""
+    response = views.metrics_view(factory.get('/metrics/'))
+
+    assert response.status_code == 200
+    assert response.content == b"# No metrics available\n"
+
+
+def test_metrics_with_etag(factory, redis_client):
+    """Test that the stored payload is served with its version as ETag."""
+    store_payload(redis_client, b'celery_task_succeeded_total 1.0\n')
+
+    response = views.metrics_view(factory.get('/metrics/'))
+
+    assert response.status_code == 200
+    assert response.content == b'celery_task_succeeded_total 1.0\n'
+    assert response['ETag'] == '"v1"'
+
+
+def test_if_none_match_returns_304(factory, redis_client):
+    """Test that a scraper holding the current ETag gets 304 Not Modified."""
+    store_payload(redis_client, b'celery_task_succeeded_total 1.0\n')
+
+    response = views.metrics_view(factory.get('/metrics/', HTTP_IF_NONE_MATCH='"v1"'))
+    assert response.status_code == 304
+    assert response['ETag'] == '"v1"'
+
+    response = views.metrics_view(factory.get('/metrics/', HTTP_IF_NONE_MATCH='"v0"'))
+    assert response.status_code == 200
+
+
+def test_gzip_payload_is_served_to_gzip_scrapers(factory, redis_client):
+    """Test that the pre-compressed payload is served when the scraper accepts gzip."""
+    payload = b'celery_task_succeeded_total 1.0\n'
+    store_payload(redis_client, payload, compressed=True)
+
+    response = views.metrics_view(factory.get('/metrics/', HTTP_ACCEPT_ENCODING='gzip'))
+
+    assert response['Content-Encoding'] == 'gzip'
+    assert response['ETag'] == '"v1-gzip"'
+    assert response['Vary'] == 'Accept, Accept-Encoding'
+    assert gzip.decompress(response.content) == payload
+
+
+def test_plain_payload_for_scrapers_without_gzip(factory, redis_client):
+    """Test that scrapers not accepting gzip get plain text decoded from the stored gzip."""
+    payload = b'celery_task_succeeded_total 1.0\n'
+    store_payload(redis_client, payload, compressed=True)
+
+    response = views.metrics_view(factory.get('/metrics/', HTTP_ACCEPT_ENCODING='gzip;q=0'))
+
+    assert not response.has_header('Content-Encoding')
+    assert response.content == payload
+
+
+PROMETHEUS_ACCEPT = 'application/openmetrics-text;version=1.0.0,text/plain;version=0.0.4;q=0.5,*/*;q=0.1'
+
+
+def flush_exporter(redis_client, **kwargs):
+    """Store the payloads of an exporter that handled one successful task."""
+    exporter = CelerySuccessExporter('memory://', redis_client=redis_client, checkpoint=False, **kwargs)
+    exporter.handlers['task-received']({'uuid': 'a1b2', 'name': 'tasks.add', 'timestamp': 1.0})
+    exporter.handlers['task-succeeded']({'uuid': 'a1b2', 'runtime': 0.3, 'timestamp': 2.0})
+    exporter._store_metrics()
+
+
+def without_age(body):
+    """A response body without the age line, which differs between any two scrapes."""
+    return b''.join(line for line in body.splitlines(True) if not line.startswith(b'celery_exporter_payload_age'))
+
+
+def test_openmetrics_negotiation(factory, redis_client):
+    """Test that OpenMetrics scrapers get the pre-rendered payload with exemplars, others the text format."""
+    flush_exporter(redis_client)
+
+    response = views.metrics_view(factory.get('/metrics/', HTTP_ACCEPT=PROMETHEUS_ACCEPT))
+    assert response['Content-Type'].startswith('application/openmetrics-text; version=1.0.0')
+    assert response['Vary'] == 'Accept, Accept-Encoding'
+    assert b'# {task_uuid="a1b2"} 0.3' in response.content
+    assert response.content.endswith(b'# EOF\n')
+    openmetrics_etag = response['ETag']
+
+    response = views.metrics_view(factory.get('/metrics/', HTTP_ACCEPT='text/plain'))
+    assert response['Content-Type'] == 'text/plain'
+    assert b'task_uuid' not in response.content
+    assert response['ETag'] != openmetrics_etag
+
+
+def test_payload_age(factory, redis_client):
+    """Test that the age of the exporter's last flush is served as a header and as metrics."""
+    flush_exporter(redis_client)
+
+    response = views.metrics_view(factory.get('/metrics/'))
+
+    age = float(response['X-Metrics-Age'])
+    assert 0 <= age < 5
+    assert b'celery_exporter_payload_age_seconds ' in response.content
+    assert response.content.endswith(b'celery_exporter_payload_stale 0\n')
+    # The age changes every scrape, the payload only with the version
+    etag = response['ETag']
+    assert etag.startswith('W/"v')
+    for if_none_match in (etag, etag.removeprefix('W/')):
+        response = views.metrics_view(factory.get('/metrics/', HTTP_IF_NONE_MATCH=if_none_match))
+        assert response.status_code == 304
+        assert 'X-Metrics-Age' in response
+
+    response = views.metrics_view(factory.get('/metrics/', HTTP_ACCEPT=PROMETHEUS_ACCEPT))
+    assert b'celery_exporter_payload_age_seconds ' in response.content
+    assert response.content.endswith(b'celery_exporter_payload_stale 0\n# EOF\n')
+
+
+def test_payload_age_with_compressed_payload(factory, redis_client):
+    """Test that the age metrics appended to a pre-compressed payload decompress with it."""
+    flush_exporter(redis_client, compression=('gzip',))
+
+    response = views.metrics_view(factory.get('/metrics/', HTTP_ACCEPT_ENCODING='gzip'))
+
+    assert response['Content-Encoding'] == 'gzip'
+    body = gzip.decompress(response.content)
+    assert b'celery_task_succeeded_total{name="tasks.add"} 1.0' in body
+    assert body.endswith(b'celery_exporter_payload_stale 0\n')
+
+
+def test_openmetrics_falls_back_to_text(factory, redis_client):
+    """Test that OpenMetrics scrapers get the text format when the exporter does not store OpenMetrics."""
+    flush_exporter(redis_client, openmetrics=False)
+
+    response = views.metrics_view(factory.get('/metrics/', HTTP_ACCEPT=PROMETHEUS_ACCEPT))
+
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'text/plain'
+    assert b'celery_task_succeeded_total{name="tasks.add"} 1.0' in response.content
+
+
+@pytest.mark.parametrize('lean, exemplars, expected', [
+    (True, None, False),
+    (True, True, True),
+    (False, None, True),
+    (False, False, False),
+])
+def test_exemplars_default_off_in_lean_mode(factory, redis_client, lean, exemplars, expected):
+    """Test that lean mode records no exemplars unless asked, and full mode records them unless disabled."""
+    flush_exporter(redis_client, lean=lean, exemplars=exemplars)
+
+    response = views.metrics_view(factory.get('/metrics/', HTTP_ACCEPT=PROMETHEUS_ACCEPT))
+
+    assert response['Content-Type'].startswith('application/openmetrics-text')
+    assert (b'# {task_uuid="a1b2"} 0.3' in response.content) == expected
+
+
+def test_last_known_good_payload_when_redis_fails(factory, redis_client, monkeypatch):
+    """Test that the last payload is served, flagged as stale, while Redis is down."""
+    store_payload(redis_client, b'celery_task_succeeded_total 1.0\n')
+    assert views.metrics_view(factory.get('/metrics/')).status_code == 200
+
+    def fail(*args, **kwargs):
+        raise ConnectionError("Redis is down")
+    monkeypatch.setattr(redis_client, 'get', fail)
+    monkeypatch.setattr(views._scrape_cache, 'max_staleness', 0)
+
+    response = views.metrics_view(factory.get('/metrics/'))
+
+    assert response.status_code == 200
+    assert response.content == b'celery_task_succeeded_total 1.0\n'
+    assert response['X-Metrics-Stale'] == 'true'
+
+
+def test_stale_payload_age_keeps_growing(factory, redis_client, monkeypatch):
+    """Test that the fallback payload is flagged as stale and its age is not reset."""
+    flush_exporter(redis_client)
+    first = views.metrics_view(factory.get('/metrics/'))
+
+    def fail(*args, **kwargs):
+        raise ConnectionError("Redis is down")
+    monkeypatch.setattr(redis_client, 'get', fail)
+    monkeypatch.setattr(views._scrape_cache, 'max_staleness', 0)
+
+    response = views.metrics_view(factory.get('/metrics/'))
+
+    assert response['X-Metrics-Stale'] == 'true'
+    assert float(response['X-Metrics-Age']) >= float(first['X-Metrics-Age'])
+    assert response.content.endswith(b'celery_exporter_payload_stale 1\n')
+
+
+def test_error_without_cached_payload(factory, redis_client, monkeypatch):
+    """Test that a Redis failure with nothing cached is reported as an error."""
+    def fail(*args, **kwargs):
+        raise ConnectionError("Redis is down")
+    monkeypatch.setattr(redis_client, 'get', fail)
+
+    response = views.metrics_view(factory.get('/metrics/'))
+
+    assert response.status_code == 500
+
+
+@pytest.fixture
+def async_redis_client(redis_client, monkeypatch):
+    """The same in-memory Redis behind an asyncio client for the async view."""
+    access = RedisAccess(AsyncMemoryRedis(redis_client), CircuitBreaker(failure_threshold=1))
+    monkeypatch.setattr(views, 'get_async_redis', lambda url: access)
+    views._async_scrape_cache.clear()
+    views._async_openmetrics_scrape_cache.clear()
+    yield redis_client
+    views._async_scrape_cache.clear()
+    views._async_openmetrics_scrape_cache.clear()
+
+
+def test_async_view_matches_sync_view(factory, async_redis_client):
+    """Test that the async view serves the same payload, encoding and ETag as the sync view."""
+    payload = b'celery_task_succeeded_total 1.0\n'
+    store_payload(async_redis_client, payload, compressed=True)
+
+    for accept in ('gzip', 'gzip;q=0'):
+        request = factory.get('/metrics/', HTTP_ACCEPT_ENCODING=accept)
+        expected = views.metrics_view(request)
+        response = asyncio.run(views.metrics_view_async(request))
+        assert response.status_code == 200
+        assert response.content == expected.content
+        assert response['ETag'] == expected['ETag']
+
+    response = asyncio.run(views.metrics_view_async(factory.get('/metrics/', HTTP_IF_NONE_MATCH='"v1"')))
+    assert response.status_code == 304
+
+
+def test_async_view_serves_stale_payload_when_redis_fails(factory, async_redis_client, monkeypatch):
+    """Test that the async view falls back to the last payload while Redis is down."""
+    store_payload(async_redis_client, b'celery_task_succeeded_total 1.0\n')
+    assert asyncio.run(views.metrics_view_async(factory.get('/metrics/'))).status_code == 200
+
+    def fail(*args, **kwargs):
+        raise ConnectionError("Redis is down")
+    monkeypatch.setattr(async_redis_client, 'get', fail)
+    monkeypatch.setattr(views._async_scrape_cache, 'max_staleness', 0)
+
+    response = asyncio.run(views.metrics_view_async(factory.get('/metrics/')))
+
+    assert response.status_code == 200
+    assert response['X-Metrics-Stale'] == 'true'
+
+
+def test_async_view_rejects_other_methods(factory, async_redis_client):
+    """Test that the async view only answers GET, like require_GET on the sync view."""
+    response = asyncio.run(views.metrics_view_async(factory.post('/metrics/')))
+
+    assert response.status_code == 405
+
+
+def test_async_view_serves_openmetrics(factory, async_redis_client):
+    """Test that the async view negotiates the exposition format like the sync view."""
+    flush_exporter(async_redis_client, compression=('gzip',))
+    request = factory.get('/metrics/', HTTP_ACCEPT=PROMETHEUS_ACCEPT, HTTP_ACCEPT_ENCODING='gzip')
+
+    expected = views.metrics_view(request)
+    response = asyncio.run(views.metrics_view_async(request))
+
+    assert response['Content-Type'] == expected['Content-Type']
+    assert response['Content-Encoding'] == 'gzip'
+    assert without_age(gzip.decompress(response.content)) == without_age(gzip.decompress(expected.content))
+    assert b'task_uuid' in gzip.decompress(response.content)
@@ -0,0 +1,151 @@
+"""
+Tests for multi-process event aggregation.
+"""
+import multiprocessing
+import time
+from array import array
+
+import pytest
+
+from app.monitor import multiprocess
+from app.monitor.memory_redis import MemoryRedis
+from app.monitor.multiprocess import (
+    FAILED, RECEIVED, SENT, STARTED, SUCCEEDED, TRACKED, UNKNOWN_SLOT, MultiProcessExporter, SlotLayout, apply_batch
+)
+
+
+def task_events(uuid, name='tasks.add', runtime=0.5, failed=False):
+    return [
+        {'type': 'task-sent', 'uuid': uuid, 'name': name, 'timestamp': 100.0},
+        {'type': 'task-received', 'uuid': uuid, 'name': name, 'timestamp': 100.5},
+        {'type': 'task-started', 'uuid': uuid, 'timestamp': 101.0},
+        {'type': 'task-failed', 'uuid': uuid, 'timestamp': 102.0} if failed else
+        {'type': 'task-succeeded', 'uuid': uuid, 'runtime': runtime, 'timestamp': 102.0},
+    ]
+
+
+def test_apply_batch():
+    """Test that a worker aggregates counters and histograms into its slot."""
+    layout = SlotLayout((0.1, 1.0, float('inf')), (0.25, 1.0, float('inf')), slots=3)
+    values = array('d', bytes(layout.size))
+    tasks = {}
+    apply_batch(values, tasks, [
+        (SENT, 'a', UNKNOWN_SLOT, 100.0, None),
+        (RECEIVED, 'a', 2, 100.5, None),
+        (STARTED, 'a', UNKNOWN_SLOT, 100.6, None),
+    ], layout, max_tasks=10)
+    assert values[TRACKED] == 1
+
+    apply_batch(values, tasks, [(SUCCEEDED, 'a', UNKNOWN_SLOT, 101.0, 0.5), (FAILED, 'b', UNKNOWN_SLOT, 101.0, None)],
+                layout, max_tasks=10)
+    base = layout.base(2)
+    assert values[base:base + 3].tolist() == [1, 1, 0]
+    assert values[base + layout.runtime:base + layout.runtime + 4].tolist() == [0, 1, 0, 0.5]
+    assert values[base + layout.queue_wait:base + layout.queue_wait + 4].tolist() == [0, 1, 0, 0.5]
+    assert values[base + layout.start_latency:base + layout.start_latency + 4].tolist() == [1, 0, 0, pytest.approx(0.1)]
+    # Terminal events of unknown tasks go to the unknown slot
+    assert values[layout.base(UNKNOWN_SLOT) + 2] == 1
+    assert values[TRACKED] == 0
+
+
+def test_apply_batch_capacity():
+    """Test that the oldest in-flight task is dropped when a worker's map is full."""
+    layout = SlotLayout((float('inf'),), (float('inf'),), slots=2)
+    values = array('d', bytes(layout.size))
+    tasks = {}
+    apply_batch(values, tasks, [(RECEIVED, str(i), UNKNOWN_SLOT, 100.0, None) for i in range(3)], layout, max_tasks=2)
+
+    assert list(tasks) == ['1', '2']
+    assert values[TRACKED] == 2
+    assert values[1] == 1
+
+
+def test_multiprocess_matches_single_process(exporter_factory):
+    """Test that aggregating in worker processes yields the same metrics as the single-process exporter."""
+    events = []
+    for i in range(200):
+        events += task_events(str(i), name=f'tasks.t{i % 3}', runtime=0.01 * i, failed=i % 10 == 0)
+    events.append({'type': 'task-succeeded', 'uuid': 'never-received', 'runtime': 1.0, 'timestamp': 102.0})
+
+    single = exporter_factory(checkpoint=False)
+    for event in events:
+        single.handlers[event['type']](event)
+
+    redis_client = MemoryRedis()
+    exporter = MultiProcessExporter('memory://', processes=2, redis_client=redis_client, checkpoint=False)
+    exporter._monitor_events = lambda: None
+    exporter.start()
+    try:
+        for event in events:
+            exporter.event_buffer.put(event)
+    finally:
+        exporter.stop()
+
+    samples = [
+        ('celery_task_received_total', {'name': 'tasks.t1'}),
+        ('celery_task_succeeded_total', {'name': 'tasks.t0'}),
+        ('celery_task_succeeded_total', {'name': 'unknown'}),
+        ('celery_task_failed_total', {'name': 'tasks.t0'}),
+        ('celery_task_runtime_seconds_sum', {'task_name': 'tasks.t2', 'state': 'success'}),
+        ('celery_task_runtime_seconds_bucket', {'task_name': 'tasks.t2', 'state': 'success', 'le': '1.0'}),
+        ('celery_task_queue_wait_seconds_count', {'task_name': 'tasks.t1'}),
+        ('celery_task_start_latency_seconds_sum', {'task_name': 'tasks.t0'}),
+    ]
+    for name, labels in samples:
+        expected = single.registry.get_sample_value(name, labels)
+        assert expected
+        assert exporter.registry.get_sample_value(name, labels) == pytest.approx(expected), name
+    assert b'celery_task_received_total{name="tasks.t0"} 67.0' in redis_client.get(exporter.metrics_key)
+    assert exporter.registry.get_sample_value('celery_exporter_task_table_size') == 0
+
+
+def test_demoted_name_moves_to_other():
+    """Test that counts of a name folded by the cardinality guard keep adding up under 'other'."""
+    exporter = MultiProcessExporter('memory://', processes=1, redis_client=MemoryRedis(), checkpoint=False,
+                                    max_task_names=1)
+    exporter.task_names.rebalance_every = 5
+    exporter._monitor_events = lambda: None
+    exporter.start()
+    try:
+        events = task_events('a', name='tasks.old')
+        # Only task-received is counted by the guard: the fifth one promotes tasks.new
+        for i in range(4):
+            events += task_events(f'new{i}', name='tasks.new')
+        events += task_events('b', name='tasks.old')
+        for event in events:
+            exporter.event_buffer.put(event)
+    finally:
+        exporter.stop()
+
+    assert exporter.registry.get_sample_value('celery_task_succeeded_total', {'name': 'tasks.old'}) is None
+    assert exporter.registry.get_sample_value('celery_task_succeeded_total', {'name': 'tasks.new'}) == 1
+    assert exporter.registry.get_sample_value('celery_task_succeeded_total', {'name': 'other'}) == 5
+
+
+def test_stuck_worker_is_terminated(monkeypatch):
+    """Test that shutdown does not wait forever for a worker that stopped reading its pipe."""
+    monkeypatch.setattr(multiprocess, 'WORKER_STOP_TIMEOUT', 0.2)
+    exporter = MultiProcessExporter('memory://', processes=1, redis_client=MemoryRedis(), checkpoint=False)
+
+    def spawn_stuck_worker(shm):
+        context = multiprocessing.get_context('spawn')
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=time.sleep, args=(60,), daemon=True)
+        process.start()
+        return process, sender
+
+    monkeypatch.setattr(exporter, '_spawn_worker', spawn_stuck_worker)
+    exporter._start_workers()
+    process = exporter._workers[0][0]
+    start = time.monotonic()
+    exporter._stop_workers()
+
+    assert time.monotonic() - start < 10.0
+    assert not process.is_alive()
+    assert exporter._workers == []
+
+
+def test_runtime_sketches_rejected():
+    """Test that runtime sketches cannot be combined with multi-process aggregation."""
+    with pytest.raises(ValueError):
+        MultiProcessExporter('memory://', redis_client=MemoryRedis(), runtime_sketches=True)
@@ -0,0 +1,108 @@
+"""
+Tests for the bounded event buffer and the exporter's pipeline mode.
+"""
+import threading
+
+import pytest
+
+from app.monitor.pipeline import EventBuffer, OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_OBSERVATIONS
+
+
+def make_event(event_type, uuid):
+    """Minimal event body."""
+    return {'type': event_type, 'uuid': uuid}
+
+
+def test_drain_returns_batches_in_order():
+    """Test that events come out in FIFO order, limited by the batch size."""
+    buffer = EventBuffer(maxsize=10)
+    for i in range(5):
+        buffer.put(make_event('task-received', str(i)))
+
+    assert [e['uuid'] for e in buffer.drain(3)] == ['0', '1', '2']
+    assert [e['uuid'] for e in buffer.drain(3)] == ['3', '4']
+    assert buffer.drain(3, timeout=0.01) == []
+
+
+def test_drop_oldest_policy():
+    """Test that a full buffer discards the oldest event."""
+    dropped = []
+    buffer = EventBuffer(maxsize=2, overflow=OVERFLOW_DROP_OLDEST, on_drop=dropped.append)
+    for i in range(3):
+        assert buffer.put(make_event('task-received', str(i)))
+
+    assert [e['uuid'] for e in buffer.drain(10)] == ['1', '2']
+    assert dropped == [1]
+
+
+def test_drop_observations_policy_keeps_counts():
+    """Test that a full buffer tallies new events by type instead of queueing them."""
+    dropped = []
+    buffer = EventBuffer(maxsize=1, overflow=OVERFLOW_DROP_OBSERVATIONS, on_drop=dropped.append)
+    assert buffer.put(make_event('task-received', '0'))
+    assert not buffer.put(make_event('task-succeeded', '1'))
+    assert not buffer.put(make_event('task-succeeded', '2'))
+
+    assert len(buffer.drain(10)) == 1
+    assert buffer.take_overflow() == {'task-succeeded': 2}
+    assert buffer.take_overflow() == {}
+    assert dropped == [1, 1]
+
+
+def test_block_policy_waits_for_room():
+    """Test that a full buffer blocks the producer until the consumer drains it."""
+    buffer = EventBuffer(maxsize=1, overflow=OVERFLOW_BLOCK)
+    buffer.put(make_event('task-received', '0'))
+
+    assert not buffer.put(make_event('task-received', '1'), timeout=0.01)
+
+    producer = threading.Thread(target=buffer.put, args=(make_event('task-received', '2'),))
+    producer.start()
+    assert [e['uuid'] for e in buffer.drain(1)] == ['0']
+    producer.join(timeout=1.0)
+
+    assert not producer.is_alive()
+    assert [e['uuid'] for e in buffer.drain(1)] == ['2']
+
+
+def test_close_releases_blocked_producer():
+    """Test that closing the buffer wakes up a blocked producer."""
+    buffer = EventBuffer(maxsize=1)
+    buffer.put(make_event('task-received', '0'))
+    results = []
+
+    producer = threading.Thread(target=lambda: results.append(buffer.put(make_event('task-received', '1'))))
+    producer.start()
+    buffer.close()
+    producer.join(timeout=1.0)
+
+    assert results == [False]
+
+
+def test_unknown_policy():
+    """Test that an unknown overflow policy is rejected."""
+    with pytest.raises(ValueError):
+        EventBuffer(overflow='spill')
+
+
+def test_exporter_counts_overflowed_events(exporter_factory):
+    """Test that the exporter folds overflowed events into its counters."""
+    exporter = exporter_factory(pipeline=True, queue_size=2, overflow=OVERFLOW_DROP_OBSERVATIONS)
+    exporter._enqueue_event({'type': 'task-received', 'uuid': 'a', 'name': 'tasks.add'})
+    exporter._enqueue_event({'type': 'task-succeeded', 'uuid': 'a', 'runtime': 0.5})
+    exporter._enqueue_event({'type': 'task-succeeded', 'uuid': 'b', 'runtime': 0.5})
+
+    exporter._process_batch(exporter.event_buffer.drain(10))
+
+    registry = exporter.registry
+    assert registry.get_sample_value('celery_task_received_total', {'name': 'tasks.add'}) == 1
+    assert registry.get_sample_value('celery_task_succeeded_total', {'name': 'tasks.add'}) == 1
+    # The overflowed event lost its details
+    assert registry.get_sample_value('celery_task_succeeded_total', {'name': 'unknown'}) == 1
+    assert registry.get_sample_value(
+        'celery_task_runtime_seconds_count', {'task_name': 'tasks.add', 'state': 'success'}
+    ) == 1
+    assert registry.get_sample_value(
+        'celery_exporter_events_dropped_total', {'policy': OVERFLOW_DROP_OBSERVATIONS}
+    ) == 1
+    assert registry.get_sample_value('celery_exporter_event_batch_size_count') == 1
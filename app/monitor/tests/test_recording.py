@@ -0,0 +1,130 @@
+"""
+Tests for recording and replaying the event stream.
+"""
+import pytest
+
+from app.monitor.recording import (
+    EventRecorder, EventReplayer, RecordingError, read_events, segment_path, segment_paths
+)
+
+
+def task_events(uuid, timestamp=100.0):
+    return [
+        {'type': 'task-received', 'uuid': uuid, 'name': 'tasks.add', 'timestamp': timestamp},
+        {'type': 'task-succeeded', 'uuid': uuid, 'runtime': 0.5, 'timestamp': timestamp + 1},
+    ]
+
+
+@pytest.mark.parametrize('compress', [False, True], ids=['plain', 'zlib'])
+def test_round_trip(tmp_path, compress, clock):
+    """Test that recorded events read back in order with their receive times."""
+    path = str(tmp_path / 'events')
+    recorder = EventRecorder(path, compress=compress, block_size=100, clock=clock)
+    events = [{'type': 'task-sent', 'uuid': str(i), 'name': 'tâches.ünïcode'} for i in range(50)]
+    for event in events:
+        recorder.record(event)
+        clock.now += 0.5
+    recorder.close()
+
+    read = list(read_events(path))
+    assert [event for _, event in read] == events
+    assert [received_at for received_at, _ in read] == [1000.0 + 0.5 * i for i in range(50)]
+
+
+def test_rotation(tmp_path):
+    """Test that the log rotates into numbered segments and a new recorder appends after them."""
+    path = str(tmp_path / 'events')
+    recorder = EventRecorder(path, max_bytes=200, block_size=1)
+    for i in range(20):
+        recorder.record({'type': 'task-sent', 'uuid': str(i)})
+    recorder.close()
+    segments = segment_paths(path)
+    assert len(segments) > 1
+
+    recorder = EventRecorder(path)
+    recorder.record({'type': 'task-sent', 'uuid': 'last'})
+    recorder.close()
+
+    assert segment_paths(path)[-1] == segment_path(path, len(segments))
+    assert [event['uuid'] for _, event in read_events(path)] == [str(i) for i in range(20)] + ['last']
+    # A single segment can be read on its own
+    assert [event['uuid'] for _, event in read_events(segments[0])][0] == '0'
+
+
+def test_truncated_frame_is_ignored(tmp_path):
+    """Test that a frame cut short by a crash ends the segment without an error."""
+    path = str(tmp_path / 'events')
+    recorder = EventRecorder(path, block_size=1)
+    for i in range(3):
+        recorder.record({'type': 'task-sent', 'uuid': str(i)})
+    recorder.close()
+    segment = segment_paths(path)[0]
+    with open(segment, 'r+b') as f:
+        f.truncate(f.seek(0, 2) - 5)
+
+    assert [event['uuid'] for _, event in read_events(path)] == ['0', '1']
+
+
+def test_invalid_logs(tmp_path):
+    """Test that missing and foreign files are reported."""
+    with pytest.raises(RecordingError):
+        list(read_events(str(tmp_path / 'missing')))
+    other = tmp_path / 'other'
+    other.write_bytes(b'not an event log')
+    with pytest.raises(RecordingError):
+        list(read_events(str(other)))
+
+
+def test_replay_pacing(tmp_path, clock):
+    """Test that replay waits out the recorded gaps divided by the speed."""
+    path = str(tmp_path / 'events')
+    recorder = EventRecorder(path, clock=clock)
+    for i in range(3):
+        recorder.record({'type': 'task-sent', 'uuid': str(i)})
+        clock.now += 10.0
+    recorder.close()
+
+    waits = []
+    replayer = EventReplayer(path, speed=2.0, sleep=lambda delay: waits.append(delay))
+    handled = []
+    assert replayer.replay({'task-sent': handled.append}) == 3
+
+    assert [event['uuid'] for event in handled] == ['0', '1', '2']
+    assert waits == [pytest.approx(5.0, abs=0.1), pytest.approx(10.0, abs=0.1)]
+
+
+def test_replay_as_fast_as_possible(tmp_path, clock):
+    """Test that speed 0 never waits and unhandled types go to the fallback handler."""
+    path = str(tmp_path / 'events')
+    recorder = EventRecorder(path, clock=clock)
+    recorder.record({'type': 'task-sent', 'uuid': 'a'})
+    clock.now += 60.0
+    recorder.record({'type': 'task-revoked', 'uuid': 'a'})
+    recorder.close()
+
+    other = []
+    replayer = EventReplayer(path, speed=0, sleep=lambda delay: pytest.fail("replay waited"))
+    assert replayer.replay({'task-sent': lambda event: None, '*': other.append}) == 2
+    assert other == [{'type': 'task-revoked', 'uuid': 'a'}]
+
+
+def test_record_and_replay_through_exporter(tmp_path, exporter_factory):
+    """Test that replaying a recording reproduces the exporter's counters."""
+    path = str(tmp_path / 'events')
+    recorder = EventRecorder(path)
+    exporter = exporter_factory(recorder=recorder)
+    handlers = exporter._receiver_handlers()
+    for i in range(5):
+        for event in task_events(str(i)):
+            handlers[event['type']](event)
+    # Events without a handler are recorded as well
+    handlers['*']({'type': 'task-revoked', 'uuid': '0'})
+    recorder.close()
+
+    replayer = EventReplayer(path, speed=0)
+    replayed = exporter_factory(event_source=replayer.replay)
+    replayed._monitor_events()
+
+    assert replayer.replayed == 11
+    for exporter_ in (exporter, replayed):
+        assert exporter_.registry.get_sample_value('celery_task_succeeded_total', {'name': 'tasks.add'}) == 5
@@ -0,0 +1,123 @@
+"""
+Tests for the shared Redis access layer.
+"""
+import asyncio
+
+import pytest
+import redis
+
+from app.monitor.memory_redis import MemoryRedis
+from app.monitor.redis_pool import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, describe_redis_client, redis_url_with_tls
+)
+
+
+def fail():
+    raise ConnectionError("Redis is down")
+
+
+@pytest.mark.parametrize('url,expected', [
+    ('redis://localhost:6379/0', 'redis://localhost:6379/0'),
+    ('rediss://h:6380/0', 'rediss://h:6380/0?ssl_cert_reqs=none'),
+    ('rediss://h:6380/0?timeout=1', 'rediss://h:6380/0?timeout=1&ssl_cert_reqs=none'),
+    ('rediss://h:6380/0?ssl_cert_reqs=required', 'rediss://h:6380/0?ssl_cert_reqs=required'),
+])
+def test_redis_url_with_tls(url, expected):
+    """Test that TLS options are added once and only for rediss:// URLs."""
+    assert redis_url_with_tls(url) == expected
+
+
+def test_describe_redis_client():
+    """Test that injected clients are described by their connection, or their class without one."""
+    assert describe_redis_client(redis.Redis(host='cache', port=6380, db=2)) == 'cache:6380/2'
+    assert describe_redis_client(redis.Redis(unix_socket_path='/tmp/redis.sock')) == '/tmp/redis.sock/0'
+    assert describe_redis_client(MemoryRedis()) == 'MemoryRedis'
+
+
+def test_exporter_logs_injected_client(capsys, exporter_factory):
+    """Test that the startup message names the injected client instead of the default URL."""
+    exporter_factory()
+
+    err = capsys.readouterr().err
+    assert 'redis=MemoryRedis' in err
+    assert 'redis://localhost' not in err
+
+
+def test_circuit_opens_after_threshold(clock):
+    """Test that the circuit opens after consecutive failures and rejects calls."""
+    breaker = CircuitBreaker(failure_threshold=2, base_backoff=1.0, clock=clock)
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            breaker.call(fail)
+
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: 'ok')
+
+
+def test_half_open_trial_closes_circuit(clock):
+    """Test that a successful trial after the backoff closes the circuit."""
+    breaker = CircuitBreaker(failure_threshold=1, base_backoff=1.0, clock=clock)
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+
+    clock.now += 1.0
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Only one trial call at a time
+    assert not breaker.allow()
+
+    assert breaker.record_success() == HALF_OPEN
+    assert breaker.state == CLOSED
+
+
+def test_backoff_doubles_up_to_max(clock):
+    """Test that failed trials grow the backoff exponentially up to the maximum."""
+    breaker = CircuitBreaker(failure_threshold=1, base_backoff=1.0, max_backoff=3.0, clock=clock)
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+
+    for backoff in (1.0, 2.0, 3.0, 3.0):
+        clock.now += backoff - 0.01
+        assert not breaker.allow()
+        clock.now += 0.01
+        # The trial call fails again
+        with pytest.raises(ConnectionError):
+            breaker.call(fail)
+
+
+def test_async_calls_share_the_breaker(clock):
+    """Test that awaited calls open and are refused by the circuit like sync ones."""
+    breaker = CircuitBreaker(failure_threshold=1, clock=clock)
+
+    async def fail_async():
+        fail()
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(breaker.call_async(fail_async))
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(breaker.call_async(fail_async))
+
+
+def test_cancelled_trial_does_not_block_the_circuit(clock):
+    """Test that a half-open trial cancelled mid-call lets the next call try again."""
+    breaker = CircuitBreaker(failure_threshold=1, base_backoff=1.0, clock=clock)
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    clock.now += 1.0
+
+    async def scrape():
+        task = asyncio.ensure_future(breaker.call_async(asyncio.sleep, 10))
+        await asyncio.sleep(0)
+        assert breaker.state == HALF_OPEN
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scrape())
+
+    assert breaker.state == OPEN
+    assert breaker.call(lambda: 'ok') == 'ok'
+    assert breaker.state == CLOSED
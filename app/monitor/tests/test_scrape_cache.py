@@ -0,0 +1,146 @@
+"""
+Tests for the per-process scrape cache.
+"""
+import asyncio
+import gzip
+import threading
+import time
+
+from app.monitor.scrape_cache import CachedPayload, ScrapeCache
+
+
+class FakeStore:
+    """Versioned payload store counting how often it is read."""
+    def __init__(self):
+        self.version = 1
+        self.payload = b'celery_task_succeeded_total 1.0\n'
+        self.version_reads = 0
+        self.payload_reads = 0
+
+    def fetch_version(self):
+        self.version_reads += 1
+        return self.version
+
+    def fetch_payload(self):
+        self.payload_reads += 1
+        return {'identity': self.payload}
+
+
+def test_fresh_payload_is_served_from_memory(clock):
+    """Test that scrapes within max_staleness do not touch the store."""
+    store = FakeStore()
+    cache = ScrapeCache(max_staleness=0.5, clock=clock)
+
+    first = cache.get(store.fetch_version, store.fetch_payload)
+    clock.now += 0.2
+    second = cache.get(store.fetch_version, store.fetch_payload)
+
+    assert first is second
+    assert first.etag() == '"v1"'
+    assert first.etag('gzip') == '"v1-gzip"'
+    assert (store.version_reads, store.payload_reads) == (1, 1)
+
+
+def test_unchanged_version_skips_payload_fetch(clock):
+    """Test that a stale entry only re-checks the version if nothing changed."""
+    store = FakeStore()
+    cache = ScrapeCache(max_staleness=0.5, clock=clock)
+
+    cache.get(store.fetch_version, store.fetch_payload)
+    clock.now += 1
+    cache.get(store.fetch_version, store.fetch_payload)
+
+    assert (store.version_reads, store.payload_reads) == (2, 1)
+
+    store.version, store.payload = 2, b'celery_task_succeeded_total 2.0\n'
+    clock.now += 1
+    entry = cache.get(store.fetch_version, store.fetch_payload)
+
+    assert entry.body() == store.payload
+    assert entry.etag() == '"v2"'
+    assert store.payload_reads == 2
+
+
+def test_payload_with_flush_time(clock):
+    """Test that a payload fetched with the exporter's flush time keeps it on the entry."""
+    cache = ScrapeCache(max_staleness=0.5, clock=clock)
+
+    entry = cache.get(lambda: 3, lambda: ({'identity': b'up 1\n'}, 1234.5))
+
+    assert entry.body() == b'up 1\n'
+    assert entry.flushed_at == 1234.5
+    assert cache.get(lambda: 3, lambda: {'identity': b'up 1\n'}).flushed_at == 1234.5
+
+
+def test_unversioned_payload_uses_checksum_etag(clock):
+    """Test that payloads without a published version are always re-read."""
+    store = FakeStore()
+    store.version = None
+    cache = ScrapeCache(max_staleness=0, clock=clock)
+
+    first = cache.get(store.fetch_version, store.fetch_payload)
+    second = cache.get(store.fetch_version, store.fetch_payload)
+
+    assert first.etag() == second.etag()
+    assert first.etag().startswith('"c')
+    assert store.payload_reads == 2
+
+
+def test_concurrent_scrapes_share_one_fetch():
+    """Test that concurrent refreshes are coalesced into one store read."""
+    store = FakeStore()
+    cache = ScrapeCache(max_staleness=10)
+    release = threading.Event()
+
+    def slow_fetch_payload():
+        release.wait(1.0)
+        return store.fetch_payload()
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get(store.fetch_version, slow_fetch_payload)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=1.0)
+
+    assert len(results) == 8
+    assert len({id(entry) for entry in results}) == 1
+    assert store.payload_reads == 1
+
+
+def test_identity_body_is_derived_from_gzip():
+    """Test that a cache entry holding only gzip can still serve plain text."""
+    entry = CachedPayload(3, {'gzip': gzip.compress(b'celery_task_succeeded_total 1.0\n')})
+
+    assert entry.body('identity') == b'celery_task_succeeded_total 1.0\n'
+    assert entry.body('zstd') is None
+
+
+def test_concurrent_async_scrapes_share_one_fetch():
+    """Test that concurrent coroutines refreshing the cache share one store read."""
+    store = FakeStore()
+    cache = ScrapeCache(max_staleness=10)
+
+    async def fetch_version():
+        return store.fetch_version()
+
+    async def slow_fetch_payload():
+        await asyncio.sleep(0.05)
+        return store.fetch_payload()
+
+    async def main():
+        return await asyncio.gather(*(cache.get_async(fetch_version, slow_fetch_payload) for _ in range(8)))
+
+    results = asyncio.run(main())
+
+    assert len({id(entry) for entry in results}) == 1
+    assert store.payload_reads == 1
+    # A later event loop gets its own lock; the version did not change
+    cache.max_staleness = 0
+    assert asyncio.run(cache.get_async(fetch_version, slow_fetch_payload)) is results[0]
+    assert store.payload_reads == 1
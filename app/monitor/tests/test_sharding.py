@@ -0,0 +1,95 @@
+"""
+Tests for merging the metrics of several exporter instances.
+"""
+import time
+
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+
+from app.monitor import views
+from app.monitor.exporter import CelerySuccessExporter
+from app.monitor.memory_redis import MemoryRedis
+from app.monitor.sharding import instances_key, merge_instances, parse_exposition
+from app.monitor.storage import render_hash_metrics
+
+
+def sample_values(text):
+    """Map (sample name, sorted labels) -> value for an exposition text."""
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(text)
+        for sample in family.samples
+    }
+
+
+def run_instance(redis_client, instance_id, task_count, storage_mode):
+    """Start an exporter instance, feed it tasks and flush."""
+    exporter = CelerySuccessExporter(
+        'memory://', redis_client=redis_client, instance_id=instance_id, storage_mode=storage_mode
+    )
+    for i in range(task_count):
+        uuid = f'{instance_id}-{i}'
+        exporter._handle_task_received({'uuid': uuid, 'name': 'tasks.add'})
+        exporter._handle_task_succeeded({'uuid': uuid, 'runtime': 0.2})
+    exporter._store_metrics()
+    return exporter
+
+
+def test_merge_sums_counters_and_labels_gauges():
+    """Test that counters and buckets are summed and gauges kept per instance."""
+    text_a = b'''# HELP jobs_total Jobs
+# TYPE jobs_total counter
+jobs_total 2.0
+# HELP depth Depth
+# TYPE depth gauge
+depth 3.0
+# HELP runtime Runtime
+# TYPE runtime histogram
+runtime_bucket{le="1.0"} 1.0
+runtime_bucket{le="+Inf"} 2.0
+runtime_count 2.0
+runtime_sum 3.5
+'''
+    text_b = text_a.replace(b'jobs_total 2.0', b'jobs_total 5.0').replace(b'depth 3.0', b'depth 1.0')
+
+    merged = render_hash_metrics(*merge_instances([
+        ('a',) + parse_exposition(text_a),
+        ('b',) + parse_exposition(text_b),
+    ]))
+    values = sample_values(merged)
+
+    assert values[('jobs_total', ())] == 7
+    assert values[('runtime_bucket', (('le', '+Inf'),))] == 4
+    assert values[('runtime_sum', ())] == 7
+    assert values[('depth', (('instance', 'a'),))] == 3
+    assert values[('depth', (('instance', 'b'),))] == 1
+
+
+@pytest.mark.parametrize('storage_mode', ['text', 'hash'])
+def test_view_merges_live_instances(monkeypatch, storage_mode):
+    """Test that the metrics view merges every instance that is still heartbeating."""
+    monkeypatch.setattr(views, 'METRICS_SHARDED', True)
+    monkeypatch.setattr(views, 'METRICS_STORAGE_MODE', storage_mode)
+
+    redis_client = MemoryRedis()
+    run_instance(redis_client, 'a', 2, storage_mode)
+    run_instance(redis_client, 'b', 3, storage_mode)
+    run_instance(redis_client, 'dead', 10, storage_mode)
+    # The dead instance stopped heartbeating a while ago
+    redis_client.zadd(instances_key('celery_metrics'), {'dead': time.time() - 120})
+
+    version = views._fetch_version(redis_client)
+    bodies, flushed_at = views._fetch_metrics(redis_client)
+    values = sample_values(bodies['identity'])
+
+    assert version is not None
+    # As old as the stalest live instance
+    assert flushed_at == float(redis_client.get('celery_metrics:instance:a:flushed_at'))
+    assert values[('celery_task_succeeded_total', (('name', 'tasks.add'),))] == 5
+    assert values[('celery_task_runtime_seconds_count', (('state', 'success'), ('task_name', 'tasks.add')))] == 5
+    assert values[('celery_exporter_task_table_size', (('instance', 'a'),))] == 2
+
+    run_instance(redis_client, 'b', 1, storage_mode)
+    assert views._fetch_version(redis_client) != version
@@ -0,0 +1,175 @@
+"""
+Tests for the runtime quantile sketches.
+"""
+import random
+
+import pytest
+
+from app.monitor import views
+from app.monitor.exporter import CelerySuccessExporter
+from app.monitor.memory_redis import MemoryRedis
+from app.monitor.sketch import DDSketch, SketchError, merge_sketches, render_quantiles
+
+
+def exact_quantile(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))]
+
+
+def test_quantiles_within_relative_accuracy():
+    """Test that quantiles of long-running tasks stay within the relative accuracy."""
+    rng = random.Random(7)
+    # 30s to 10min, the range the fixed buckets cannot resolve
+    values = [rng.uniform(30, 600) for _ in range(10000)]
+    sketch = DDSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    for q in (0.5, 0.9, 0.99):
+        exact = exact_quantile(values, q)
+        assert abs(sketch.quantile(q) - exact) <= 0.01 * exact
+
+
+def test_merge_matches_single_sketch():
+    """Test that merging sketches gives the same result as sketching all values at once."""
+    rng = random.Random(1)
+    values = [rng.lognormvariate(0, 2) for _ in range(2000)]
+    whole, first, second = DDSketch(), DDSketch(), DDSketch()
+    for i, value in enumerate(values):
+        whole.add(value)
+        (first if i % 2 else second).add(value)
+
+    first.merge(second)
+
+    assert first.count == whole.count
+    assert first.quantile(0.9) == whole.quantile(0.9)
+
+
+def test_merge_rejects_different_accuracy():
+    """Test that sketches of different accuracy cannot be merged."""
+    with pytest.raises(SketchError):
+        DDSketch(0.01).merge(DDSketch(0.05))
+
+
+def test_serialization_roundtrip():
+    """Test that a sketch survives serialization, including zero values."""
+    sketch = DDSketch()
+    for value in (0.0, 0.5, 2.0, 2.0, 300.0):
+        sketch.add(value)
+
+    restored = DDSketch.from_bytes(sketch.to_bytes())
+
+    assert restored.count == 5
+    assert restored.zero_count == 1
+    assert restored.sum == pytest.approx(304.5)
+    assert restored.quantile(0.5) == sketch.quantile(0.5)
+
+
+def test_collapse_bounds_bins():
+    """Test that the lowest bins are folded once max_bins is reached."""
+    sketch = DDSketch(max_bins=10)
+    for i in range(1, 1000):
+        sketch.add(i / 10)
+
+    assert len(sketch) == 10
+    assert sketch.count == 999
+    assert sketch.quantile(0.99) == pytest.approx(98.9, rel=0.01)
+
+
+def test_serialization_survives_concurrent_collapse():
+    """Test that a collapse by a handler thread while the updater serializes does not break the flush."""
+    sketch = DDSketch(max_bins=10)
+    for i in range(1, 11):
+        sketch.add(float(i))
+
+    class CollapsingBins(dict):
+        def __getitem__(self, index):
+            # A handler thread adds a new bin and collapses the lowest ones
+            if len(self) <= sketch.max_bins:
+                sketch.add(1000.0)
+            return dict.__getitem__(self, index)
+
+    sketch.bins = CollapsingBins(sketch.bins)
+    restored = DDSketch.from_bytes(sketch.to_bytes())
+
+    assert restored.count == 10
+    assert restored.sum == pytest.approx(55.0)
+
+
+def test_merge_sketches_skips_unreadable():
+    """Test that corrupt sketches are ignored when merging."""
+    sketch = DDSketch()
+    sketch.add(1.0)
+
+    merged = merge_sketches([{b'tasks.add': sketch.to_bytes()}, {b'tasks.add': b'junk', b'tasks.mul': b'junk'}])
+
+    assert list(merged) == ['tasks.add']
+    assert b'celery_task_runtime_quantile_seconds{task_name="tasks.add",quantile="0.5"}' in render_quantiles(merged)
+
+
+def run_exporter(redis_client, runtimes, instance_id=None):
+    """Feed task runtimes to an exporter with sketches enabled and flush."""
+    exporter = CelerySuccessExporter(
+        'memory://', redis_client=redis_client, runtime_sketches=True, instance_id=instance_id
+    )
+    for i, runtime in enumerate(runtimes):
+        uuid = f'{instance_id}-{i}'
+        exporter._handle_task_received({'uuid': uuid, 'name': 'tasks.add'})
+        exporter._handle_task_succeeded({'uuid': uuid, 'runtime': runtime})
+    exporter._store_metrics()
+    return exporter
+
+
+def quantile_value(payload, q):
+    prefix = f'celery_task_runtime_quantile_seconds{{task_name="tasks.add",quantile="{q}"}} '
+    for line in payload.decode('utf-8').splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return None
+
+
+def test_view_exposes_quantiles(monkeypatch):
+    """Test that the metrics view renders quantiles from the stored sketches."""
+    monkeypatch.setattr(views, 'METRICS_RUNTIME_SKETCHES', True)
+    redis_client = MemoryRedis()
+    run_exporter(redis_client, [float(i) for i in range(1, 101)])
+
+    payload = views._fetch_metrics(redis_client)[0]['identity']
+
+    assert b'celery_task_succeeded_total{name="tasks.add"} 100.0' in payload
+    assert quantile_value(payload, 0.5) == pytest.approx(50, rel=0.01)
+    assert quantile_value(payload, 0.99) == pytest.approx(99, rel=0.01)
+
+
+def test_view_merges_instance_sketches(monkeypatch):
+    """Test that quantiles are computed over the sketches of every live instance."""
+    monkeypatch.setattr(views, 'METRICS_RUNTIME_SKETCHES', True)
+    monkeypatch.setattr(views, 'METRICS_SHARDED', True)
+    redis_client = MemoryRedis()
+    run_exporter(redis_client, [1.0] * 90, instance_id='a')
+    run_exporter(redis_client, [100.0] * 10, instance_id='b')
+
+    payload = views._fetch_metrics(redis_client)[0]['identity']
+
+    assert quantile_value(payload, 0.5) == pytest.approx(1, rel=0.01)
+    assert quantile_value(payload, 0.99) == pytest.approx(100, rel=0.01)
+
+
+def test_failed_flush_retries_sketches(monkeypatch, exporter_factory):
+    """Test that sketches are written again after a failed flush."""
+    redis_client = MemoryRedis()
+    exporter = exporter_factory(redis_client, runtime_sketches=True)
+    exporter._handle_task_received({'uuid': '1', 'name': 'tasks.add'})
+    exporter._handle_task_succeeded({'uuid': '1', 'runtime': 2.0})
+
+    def broken_pipeline(transaction=True):
+        raise ConnectionError('down')
+
+    monkeypatch.setattr(redis_client, 'pipeline', broken_pipeline)
+    exporter._store_metrics()
+    monkeypatch.undo()
+    exporter._store_metrics()
+
+    stored = [key for key in redis_client.data if key.startswith('celery_metrics:sketches:')]
+    assert len(stored) == 1
+    assert b'tasks.add' in redis_client.data[stored[0]]
@@ -0,0 +1,155 @@
+"""
+Tests for the hash storage layout of exporter metrics.
+"""
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client.parser import text_string_to_metric_families
+
+from app.monitor.memory_redis import MemoryRedis
+from app.monitor.storage import HashMetricsWriter, families_key, render_hash_metrics, samples_key
+
+METRICS_KEY = 'celery_metrics'
+
+
+def build_registry():
+    """Registry with one metric of each type the exporter uses."""
+    registry = CollectorRegistry()
+    counter = Counter('celery_task_succeeded_total', 'Succeeded tasks', registry=registry)
+    gauge = Gauge('celery_exporter_task_table_size', 'Task table size', registry=registry)
+    histogram = Histogram('celery_task_runtime_seconds', 'Task runtime', ['task_name', 'state'],
+                          registry=registry, buckets=(0.1, 1.0))
+    return registry, counter, gauge, histogram
+
+
+def render(redis_client):
+    """Render the stored hashes like metrics_view does."""
+    return render_hash_metrics(
+        redis_client.hgetall(families_key(METRICS_KEY)),
+        redis_client.hgetall(samples_key(METRICS_KEY))
+    ).decode('utf-8')
+
+
+def sample_values(text):
+    """Map (sample name, sorted labels) -> value for an exposition text."""
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(text)
+        for sample in family.samples
+    }
+
+
+def test_only_changed_samples_are_written():
+    """Test that a flush sends nothing for samples that did not move."""
+    registry, counter, gauge, histogram = build_registry()
+    redis_client = MemoryRedis()
+    writer = HashMetricsWriter(METRICS_KEY)
+
+    counter.inc()
+    histogram.labels(task_name='tasks.add', state='success').observe(0.5)
+    assert writer.write(redis_client, registry) > 0
+    assert writer.write(redis_client, registry) == 0
+
+    counter.inc(2)
+    # Only the counter moved
+    assert writer.write(redis_client, registry) == 1
+    assert redis_client.round_trips == 2
+
+
+def test_nan_gauge_is_written_once():
+    """Test that a gauge staying NaN does not count as a change on every flush."""
+    registry, counter, gauge, histogram = build_registry()
+    redis_client = MemoryRedis()
+    writer = HashMetricsWriter(METRICS_KEY)
+    gauge.set(float('nan'))
+
+    assert writer.write(redis_client, registry) > 0
+    assert writer.prepare(registry) is None
+
+    gauge.set(1)
+    assert writer.write(redis_client, registry) == 1
+
+
+def test_rendered_text_matches_registry():
+    """Test that rendering the hashes gives the same samples as the registry."""
+    registry, counter, gauge, histogram = build_registry()
+    redis_client = MemoryRedis()
+    writer = HashMetricsWriter(METRICS_KEY)
+
+    counter.inc(3)
+    gauge.set(7)
+    histogram.labels(task_name='tasks.add', state='success').observe(0.05)
+    writer.write(redis_client, registry)
+    histogram.labels(task_name='tasks.add', state='success').observe(2.0)
+    histogram.labels(task_name='tasks "quoted"', state='success').observe(0.5)
+    gauge.set(4)
+    writer.write(redis_client, registry)
+
+    text = render(redis_client)
+    values = sample_values(text)
+
+    assert '# TYPE celery_task_runtime_seconds histogram' in text
+    assert values[('celery_task_succeeded_total', ())] == 3
+    assert values[('celery_exporter_task_table_size', ())] == 4
+    assert values[('celery_task_runtime_seconds_count', (('state', 'success'), ('task_name', 'tasks.add')))] == 2
+    assert values[('celery_task_runtime_seconds_bucket',
+                   (('le', '0.1'), ('state', 'success'), ('task_name', 'tasks.add')))] == 1
+    assert values[('celery_task_runtime_seconds_bucket',
+                   (('le', '+Inf'), ('state', 'success'), ('task_name', 'tasks "quoted"')))] == 1
+
+
+def test_counters_accumulate_across_writers():
+    """Test that a restarted exporter keeps adding to the stored counters."""
+    redis_client = MemoryRedis()
+    for _ in range(2):
+        registry, counter, _, _ = build_registry()
+        counter.inc(5)
+        HashMetricsWriter(METRICS_KEY).write(redis_client, registry)
+
+    assert sample_values(render(redis_client))[('celery_task_succeeded_total', ())] == 10
+
+
+def test_removed_series_give_back_their_counts():
+    """Test that a series removed from the registry no longer adds to the stored totals."""
+    redis_client = MemoryRedis()
+    registry = CollectorRegistry()
+    counter = Counter('celery_task_failed_total', 'Failed tasks', ['name'], registry=registry)
+    gauge = Gauge('depth', 'Depth', ['queue'], registry=registry)
+    writer = HashMetricsWriter(METRICS_KEY)
+    counter.labels(name='tasks.add').inc(3)
+    gauge.labels(queue='a').set(1)
+    writer.write(redis_client, registry)
+
+    # Fold the series into 'other' like the cardinality guard does
+    counter.labels(name='other').inc(3)
+    counter.remove('tasks.add')
+    gauge.remove('a')
+    writer.write(redis_client, registry)
+
+    values = sample_values(render(redis_client))
+    assert values[('celery_task_failed_total', (('name', 'other'),))] == 3
+    assert values[('celery_task_failed_total', (('name', 'tasks.add'),))] == 0
+    assert ('depth', (('queue', 'a'),)) not in values
+
+
+def test_restarted_writer_removes_stale_gauges():
+    """Test that a new writer deletes gauges a previous process left and keeps accumulating counters."""
+    redis_client = MemoryRedis()
+    registry, counter, gauge, histogram = build_registry()
+    worker_up = Gauge('celery_worker_up', 'Worker up', ['hostname'], registry=registry)
+    worker_up.labels(hostname='w1').set(1)
+    counter.inc(3)
+    HashMetricsWriter(METRICS_KEY).write(redis_client, registry)
+
+    # The restarted process no longer knows w1
+    registry, counter, gauge, histogram = build_registry()
+    Gauge('celery_worker_up', 'Worker up', ['hostname'], registry=registry)
+    counter.inc()
+    writer = HashMetricsWriter(METRICS_KEY)
+    assert writer.load(redis_client)
+    writer.write(redis_client, registry)
+
+    body = render_hash_metrics(redis_client.hgetall(families_key(METRICS_KEY)),
+                               redis_client.hgetall(samples_key(METRICS_KEY))).decode()
+    assert 'celery_worker_up{' not in body
+    assert 'celery_task_succeeded_total 4.0' in body
+    # Nothing left over for the next flush
+    assert writer.prepare(registry) is None
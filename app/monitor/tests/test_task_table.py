@@ -0,0 +1,95 @@
+"""
+Tests for the bounded exporter task table.
+"""
+import pytest
+
+from app.monitor.task_table import TaskTable
+
+
+@pytest.fixture
+def evictions():
+    """Collects (reason, count) tuples reported by the table."""
+    return []
+
+
+@pytest.fixture
+def table(clock, evictions):
+    """Small task table with a short TTL."""
+    return TaskTable(max_entries=3, ttl=10.0, on_evict=lambda reason, n: evictions.append((reason, n)), clock=clock)
+
+
+def test_name_lookup(table):
+    """Test that names recorded on task-received resolve on terminal events."""
+    table.received('a', name='tasks.add', timestamp=1.0)
+    table.started('a', timestamp=2.0)
+
+    record = table.finished('a')
+
+    assert record.name == 'tasks.add'
+    assert record.received == 1.0
+    assert record.started == 2.0
+    assert table.name('missing') == 'unknown'
+
+
+def test_terminal_tasks_expire_after_ttl(table, clock, evictions):
+    """Test that terminal tasks are evicted once the TTL has passed."""
+    table.received('a', name='tasks.add')
+    table.received('b', name='tasks.add')
+    table.finished('a')
+
+    clock.now += 5
+    assert table.sweep() == 0
+    assert 'a' in table
+
+    clock.now += 6
+    assert table.sweep() == 1
+    assert 'a' not in table
+    assert 'b' in table  # still in flight
+    assert evictions == [('ttl', 1)]
+
+
+def test_capacity_evicts_terminal_tasks_first(table, evictions):
+    """Test that a full table drops terminal tasks before in-flight ones."""
+    table.received('a', name='tasks.add')
+    table.received('b', name='tasks.add')
+    table.received('c', name='tasks.add')
+    table.finished('b')
+
+    table.received('d', name='tasks.add')
+
+    assert len(table) == 3
+    assert 'b' not in table
+    assert 'a' in table
+    assert evictions == [('capacity', 1)]
+
+
+def test_capacity_evicts_oldest_in_flight(table, evictions):
+    """Test that the oldest in-flight task goes when nothing is terminal."""
+    for uuid in 'abcd':
+        table.received(uuid, name='tasks.add')
+
+    assert len(table) == 3
+    assert 'a' not in table
+    assert evictions == [('capacity', 1)]
+
+
+def test_retried_task_is_not_expired(table, clock):
+    """Test that a task received again after a terminal event stays in flight."""
+    table.received('a', name='tasks.add')
+    table.finished('a')
+    table.received('a', name='tasks.add')
+
+    clock.now += 60
+    table.sweep()
+
+    assert 'a' in table
+
+
+def test_sent_then_received(table):
+    """Test that a task-sent record is completed by task-received."""
+    table.sent('a', name='tasks.add', timestamp=1.0)
+    record = table.received('a', timestamp=3.0)
+
+    assert record.name == 'tasks.add'
+    assert record.sent == 1.0
+    assert record.received == 3.0
@@ -0,0 +1,111 @@
+"""
+Tests for the worker heartbeat registry.
+"""
+import pytest
+
+from app.monitor.memory_redis import MemoryRedis
+from app.monitor.storage import STORAGE_HASH, families_key, render_hash_metrics, samples_key
+from app.monitor.workers import WorkerRegistry
+
+
+@pytest.fixture
+def workers(clock):
+    """Registry forgetting workers after a minute."""
+    return WorkerRegistry(expire_after=60.0, clock=clock)
+
+
+def heartbeat(hostname, active=0, processed=0, freq=2.0):
+    return {
+        'type': 'worker-heartbeat', 'hostname': hostname, 'freq': freq, 'active': active,
+        'processed': processed, 'loadavg': [1.5, 1.0, 0.5], 'timestamp': 0.0
+    }
+
+
+def samples(registry):
+    """Map (metric name, labels) -> value for everything the registry collects."""
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in registry.collect()
+        for sample in family.samples
+    }
+
+
+def test_heartbeat_gauges(workers, clock):
+    """Test that a heartbeat exposes the worker's state."""
+    workers.heartbeat(heartbeat('celery@a', active=20, processed=1234))
+    clock.now += 1.5
+
+    values = samples(workers)
+
+    assert values[('celery_worker_up', (('hostname', 'celery@a'),))] == 1
+    assert values[('celery_worker_tasks_active', (('hostname', 'celery@a'),))] == 20
+    assert values[('celery_worker_tasks_processed', (('hostname', 'celery@a'),))] == 1234
+    assert values[('celery_worker_load_average', (('hostname', 'celery@a'), ('period', '5m')))] == 1.0
+    assert values[('celery_worker_last_heartbeat_age_seconds', (('hostname', 'celery@a'),))] == 1.5
+
+
+def test_missed_heartbeats_mark_worker_down(workers, clock):
+    """Test that a worker is down after missing two heartbeat intervals."""
+    workers.heartbeat(heartbeat('celery@a'))
+    clock.now += 5
+
+    assert samples(workers)[('celery_worker_up', (('hostname', 'celery@a'),))] == 0
+
+
+def test_offline_worker_is_down(workers):
+    """Test that worker-offline marks the worker down right away."""
+    workers.heartbeat(heartbeat('celery@a', active=3))
+    workers.offline({'hostname': 'celery@a'})
+
+    values = samples(workers)
+    assert values[('celery_worker_up', (('hostname', 'celery@a'),))] == 0
+    assert values[('celery_worker_tasks_active', (('hostname', 'celery@a'),))] == 0
+
+
+def test_vanished_workers_expire(workers, clock):
+    """Test that workers not heard from for expire_after seconds are forgotten."""
+    workers.heartbeat(heartbeat('celery@old'))
+    clock.now += 50
+    workers.heartbeat(heartbeat('celery@new'))
+    clock.now += 20
+
+    assert workers.expire() == 1
+    assert workers.get('celery@old') is None
+    assert workers.get('celery@new') is not None
+
+
+def test_exporter_handles_worker_events(exporter_factory):
+    """Test that the exporter feeds worker events to its registry in both modes."""
+    for lean in (False, True):
+        exporter = exporter_factory(lean=lean)
+        exporter.handlers['worker-online']({'hostname': 'celery@a', 'freq': 2.0})
+        exporter.handlers['worker-heartbeat'](heartbeat('celery@a', active=7))
+
+        assert exporter.registry.get_sample_value('celery_worker_tasks_active', {'hostname': 'celery@a'}) == 7
+        exporter.handlers['worker-offline']({'hostname': 'celery@a'})
+        assert exporter.registry.get_sample_value('celery_worker_up', {'hostname': 'celery@a'}) == 0
+
+
+def test_hash_storage_expires_workers_across_restarts(exporter_factory):
+    """Test that worker gauges stored in hash mode go away on expiry, also when the exporter restarted."""
+    redis_client = MemoryRedis()
+
+    def stored_body():
+        return render_hash_metrics(redis_client.hgetall(families_key('celery_metrics')),
+                                   redis_client.hgetall(samples_key('celery_metrics'))).decode()
+
+    exporter = exporter_factory(redis_client, storage_mode=STORAGE_HASH, checkpoint=False)
+    exporter.handlers['worker-heartbeat'](heartbeat('celery@b', active=2))
+    exporter.handlers['worker-heartbeat'](heartbeat('celery@a', active=5))
+    exporter._store_metrics()
+    assert 'celery_worker_tasks_active{hostname="celery@a"} 5.0' in stored_body()
+
+    # celery@b expires within the same process
+    exporter.workers.get('celery@b').last_seen -= 600
+    exporter._store_metrics()
+    assert 'celery@b' not in stored_body()
+    assert 'celery@a' in stored_body()
+
+    # celery@a dies while the exporter restarts and is never heard from again
+    exporter_factory(redis_client, storage_mode=STORAGE_HASH, checkpoint=False)
+    assert 'celery_worker_' not in stored_body()
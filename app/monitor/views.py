@@ -1,65 +1,432 @@
 """
 Views for metrics endpoints.
 """
+import asyncio
 import os
-import redis
+import time
 import base64
 from functools import wraps
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotAllowed, HttpResponseNotModified
+from django.utils.http import parse_etags
 from django.views.decorators.http import require_GET
 from django.conf import settings
 
+from .redis_pool import get_async_redis, get_redis
+from .encoding import (
+    FORMAT_OPENMETRICS, GZIP, IDENTITY, OPENMETRICS_CONTENT_TYPE, available_encodings, choose_encoding, choose_format,
+    compress, encoded_key
+)
+from .scrape_cache import ScrapeCache
+from .sharding import (
+    combined_version, instance_metrics_key, merge_instances, parse_instance_metrics, parse_instance_versions,
+    parse_live_instances, queue_instance_metrics, queue_instance_versions, queue_live_instances
+)
+from .sketch import merge_sketches, render_quantiles, sketch_window_key, window_starts
+from .storage import (
+    OPENMETRICS_EOF, STORAGE_HASH, STORAGE_TEXT, families_key, flushed_at_key, openmetrics_key, render_hash_metrics,
+    samples_key, version_key
+)
+
 # Get Redis URL from settings or environment
 REDIS_URL = getattr(settings, 'REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
 METRICS_KEY = 'celery_metrics'
+# Must match the exporter's storage layout, see app.monitor.storage
+METRICS_STORAGE_MODE = getattr(settings, 'METRICS_STORAGE_MODE', os.getenv('METRICS_STORAGE_MODE', 'text'))
+# Merge the metrics of several exporter instances (EXPORTER_INSTANCE_ID) at scrape time
+METRICS_SHARDED = str(getattr(settings, 'METRICS_SHARDED', os.getenv('METRICS_SHARDED', 'false'))).lower() == 'true'
+# Instances that have not heartbeated for this many seconds are left out
+METRICS_INSTANCE_TTL = float(getattr(settings, 'METRICS_INSTANCE_TTL', os.getenv('METRICS_INSTANCE_TTL', '30')))
+# Seconds a cached payload is served without asking Redis whether it changed
+METRICS_CACHE_MAX_STALENESS = float(getattr(
+    settings, 'METRICS_CACHE_MAX_STALENESS', os.getenv('METRICS_CACHE_MAX_STALENESS', '0.5')
+))
+
+# Runtime quantiles from the exporter's sketches (METRICS_RUNTIME_SKETCHES on the exporter)
+METRICS_RUNTIME_SKETCHES = str(getattr(
+    settings, 'METRICS_RUNTIME_SKETCHES', os.getenv('METRICS_RUNTIME_SKETCHES', 'false')
+)).lower() == 'true'
+# Length of the exporter's sketch windows, and how many seconds of windows are merged per scrape
+METRICS_SKETCH_INTERVAL = float(getattr(settings, 'METRICS_SKETCH_INTERVAL', os.getenv('METRICS_SKETCH_INTERVAL', '60')))
+METRICS_SKETCH_WINDOW = float(getattr(settings, 'METRICS_SKETCH_WINDOW', os.getenv('METRICS_SKETCH_WINDOW', '300')))
+
+# The exporter pre-renders OpenMetrics (with exemplars) in the plain text layout only;
+# scrapers asking for it get the classic text format otherwise
+OPENMETRICS_AVAILABLE = (
+    METRICS_STORAGE_MODE == STORAGE_TEXT and not METRICS_SHARDED and not METRICS_RUNTIME_SKETCHES
+)
+
+# Shared by all request threads of this worker process
+_scrape_cache = ScrapeCache(max_staleness=METRICS_CACHE_MAX_STALENESS)
+_openmetrics_scrape_cache = ScrapeCache(max_staleness=METRICS_CACHE_MAX_STALENESS)
+# Shared by the coroutines of the async view
+_async_scrape_cache = ScrapeCache(max_staleness=METRICS_CACHE_MAX_STALENESS)
+_async_openmetrics_scrape_cache = ScrapeCache(max_staleness=METRICS_CACHE_MAX_STALENESS)
+
+
+def _run(steps):
+    """
+    Run a fetch generator against a sync Redis client.
+
+    The fetch functions below are generators that yield a queued pipeline and
+    get its results back, so the sync and async views share them.
+    """
+    try:
+        pipe = next(steps)
+        while True:
+            pipe = steps.send(pipe.execute())
+    except StopIteration as done:
+        return done.value
+
+
+async def _run_async(steps):
+    """Run a fetch generator against a ``redis.asyncio`` client."""
+    try:
+        pipe = next(steps)
+        while True:
+            pipe = steps.send(await pipe.execute())
+    except StopIteration as done:
+        return done.value
+
+
+def _live_instance_steps(redis_client):
+    pipe = redis_client.pipeline(transaction=False)
+    queue_live_instances(pipe, METRICS_KEY, time.time(), METRICS_INSTANCE_TTL)
+    (members,) = yield pipe
+    return parse_live_instances(members)
+
+
+def _version_steps(redis_client):
+    """Read the version of the stored metrics payload, None if not published."""
+    if METRICS_SHARDED:
+        instance_ids = yield from _live_instance_steps(redis_client)
+        pipe = redis_client.pipeline(transaction=False)
+        queue_instance_versions(pipe, METRICS_KEY, instance_ids)
+        version = combined_version(parse_instance_versions(instance_ids, (yield pipe)))
+    else:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(version_key(METRICS_KEY))
+        (version,) = yield pipe
+        version = int(version) if version is not None else None
+    if METRICS_RUNTIME_SKETCHES and version is not None:
+        # Quantiles change when the oldest sketch window leaves the merged span
+        version = f'{version}.{int(time.time() // METRICS_SKETCH_INTERVAL)}'
+    return version
+
+
+def _quantile_steps(redis_client, metrics_keys):
+    """Merge the recent sketch windows of every exporter key and render the runtime quantiles."""
+    windows = window_starts(time.time(), METRICS_SKETCH_INTERVAL, METRICS_SKETCH_WINDOW)
+    pipe = redis_client.pipeline(transaction=False)
+    for metrics_key in metrics_keys:
+        for window in windows:
+            pipe.hgetall(sketch_window_key(metrics_key, window))
+    return render_quantiles(merge_sketches((yield pipe)))
+
+
+def _metrics_steps(redis_client):
+    """
+    Read the metrics payload from Redis in the configured storage layout.
+    
+    Returns a dict mapping content encodings to payload bytes, and the time
+    the exporter stored it (None if unknown).
+    """
+    if METRICS_SHARDED:
+        # Sum counters and buckets of all live instances
+        instance_ids = yield from _live_instance_steps(redis_client)
+        hash_layout = METRICS_STORAGE_MODE == STORAGE_HASH
+        pipe = redis_client.pipeline(transaction=False)
+        queue_instance_metrics(pipe, METRICS_KEY, instance_ids, hash_layout)
+        for instance_id in instance_ids:
+            pipe.get(flushed_at_key(instance_metrics_key(METRICS_KEY, instance_id)))
+        results = yield pipe
+        flush_times = results[len(results) - len(instance_ids):]
+        instances = parse_instance_metrics(instance_ids, results[:len(results) - len(instance_ids)], hash_layout)
+        if not instances:
+            return {}, None
+        metrics = render_hash_metrics(*merge_instances(instances))
+        if METRICS_RUNTIME_SKETCHES:
+            metrics += yield from _quantile_steps(
+                redis_client, [instance_metrics_key(METRICS_KEY, instance_id) for instance_id in instance_ids]
+            )
+        # The merged payload is as old as its stalest instance
+        flush_times = [_flush_time(value) for value in flush_times]
+        flushed_at = None if None in flush_times else min(flush_times)
+        return {IDENTITY: metrics, GZIP: compress(metrics, GZIP)}, flushed_at
+    
+    if METRICS_STORAGE_MODE == STORAGE_HASH:
+        # Read both hashes in one round-trip and render at scrape time
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.hgetall(families_key(METRICS_KEY))
+        pipe.hgetall(samples_key(METRICS_KEY))
+        pipe.get(flushed_at_key(METRICS_KEY))
+        families, samples, flushed_at = yield pipe
+        if not samples:
+            return {}, None
+        metrics = render_hash_metrics(families, samples)
+        if METRICS_RUNTIME_SKETCHES:
+            metrics += yield from _quantile_steps(redis_client, [METRICS_KEY])
+        # Compressed once per payload version thanks to the scrape cache
+        return {IDENTITY: metrics, GZIP: compress(metrics, GZIP)}, _flush_time(flushed_at)
+    
+    if METRICS_RUNTIME_SKETCHES:
+        # The quantiles are appended here, so the pre-compressed payloads cannot be used
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.get(METRICS_KEY)
+        pipe.get(flushed_at_key(METRICS_KEY))
+        metrics, flushed_at = yield pipe
+        if metrics is None:
+            return {}, None
+        metrics += yield from _quantile_steps(redis_client, [METRICS_KEY])
+        return {IDENTITY: metrics, GZIP: compress(metrics, GZIP)}, _flush_time(flushed_at)
+    
+    return (yield from _stored_payload_steps(redis_client, METRICS_KEY))
+
+
+def _stored_payload_steps(redis_client, key):
+    """Read a payload stored in the text layout, in every encoding the exporter stores, and its flush time."""
+    # Prefer the pre-compressed payloads the exporter stores, they are much smaller
+    encodings = available_encodings()
+    pipe = redis_client.pipeline(transaction=True)
+    for encoding in encodings:
+        pipe.get(encoded_key(key, encoding))
+    pipe.get(flushed_at_key(METRICS_KEY))
+    *results, flushed_at = yield pipe
+    bodies = {
+        encoding: body
+        for encoding, body in zip(encodings, results)
+        if body is not None
+    }
+    if not bodies:
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.get(key)
+        pipe.get(flushed_at_key(METRICS_KEY))
+        metrics, flushed_at = yield pipe
+        if metrics is not None:
+            bodies[IDENTITY] = metrics
+    return bodies, _flush_time(flushed_at)
+
+
+def _flush_time(value):
+    """Parse a stored flush time, None if the exporter did not store one."""
+    return float(value) if value is not None else None
+
+
+def _openmetrics_version_steps(redis_client):
+    """Version of the OpenMetrics payload, distinct from the text one so their ETags differ."""
+    version = yield from _version_steps(redis_client)
+    return f'{version}-om' if version is not None else None
+
+
+def _fetch_version(redis_client):
+    """Read the version of the stored metrics payload, None if not published."""
+    return _run(_version_steps(redis_client))
+
+
+def _fetch_metrics(redis_client):
+    """Read the metrics payload, a dict mapping content encodings to payload bytes."""
+    return _run(_metrics_steps(redis_client))
+
+
+async def _fetch_version_async(redis_client):
+    return await _run_async(_version_steps(redis_client))
+
+
+async def _fetch_metrics_async(redis_client):
+    return await _run_async(_metrics_steps(redis_client))
+
+
+def _fetch_openmetrics_version(redis_client):
+    return _run(_openmetrics_version_steps(redis_client))
+
+
+def _fetch_openmetrics(redis_client):
+    return _run(_stored_payload_steps(redis_client, openmetrics_key(METRICS_KEY)))
+
+
+async def _fetch_openmetrics_version_async(redis_client):
+    return await _run_async(_openmetrics_version_steps(redis_client))
+
+
+async def _fetch_openmetrics_async(redis_client):
+    return await _run_async(_stored_payload_steps(redis_client, openmetrics_key(METRICS_KEY)))
+
+def _auth_failure(request, auth_user, auth_pass):
+    """Return the 401 response for a request without the configured credentials, None if it may pass."""
+    # Skip authentication if credentials are not configured
+    if not auth_user or not auth_pass:
+        return None
+    
+    # Check for authorization header
+    auth_header = request.META.get('HTTP_AUTHORIZATION', '')
+    
+    if not auth_header.startswith('Basic '):
+        return HttpResponse(
+            'Unauthorized: Basic authentication required',
+            status=401,
+            headers={'WWW-Authenticate': 'Basic realm="Metrics Authentication"'}
+        )
+    
+    try:
+        # Decode the base64 credentials
+        auth_decoded = base64.b64decode(auth_header[6:]).decode('utf-8')
+        username, password = auth_decoded.split(':', 1)
+        
+        # Check if credentials match
+        if username == auth_user and password == auth_pass:
+            return None
+    except Exception:
+        pass
+    
+    # If we get here, authentication failed
+    return HttpResponse(
+        'Unauthorized: Invalid credentials',
+        status=401,
+        headers={'WWW-Authenticate': 'Basic realm="Metrics Authentication"'}
+    )
 
 # Simplified decorator with empty defaults since we pass values explicitly when using it
 def basic_auth_required(auth_user='', auth_pass=''):
     """
-    Decorator that enforces HTTP Basic Authentication for a view.
+    Decorator that enforces HTTP Basic Authentication for a view, sync or async.
     
     Args:
         auth_user (str, optional): Username for authentication. Defaults to empty string.
         auth_pass (str, optional): Password for authentication. Defaults to empty string.
     """
     def decorator(view_func):
+        if asyncio.iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                failure = _auth_failure(request, auth_user, auth_pass)
+                if failure is not None:
+                    return failure
+                return await view_func(request, *args, **kwargs)
+            
+            return async_wrapper
+        
         @wraps(view_func)
         def wrapper(request, *args, **kwargs):
-            # Skip authentication if credentials are not configured
-            if not auth_user or not auth_pass:
-                return view_func(request, *args, **kwargs)
-            
-            # Check for authorization header
-            auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-            
-            if not auth_header.startswith('Basic '):
-                return HttpResponse(
-                    'Unauthorized: Basic authentication required',
-                    status=401,
-                    headers={'WWW-Authenticate': 'Basic realm="Metrics Authentication"'}
-                )
-            
-            try:
-                # Decode the base64 credentials
-                auth_decoded = base64.b64decode(auth_header[6:]).decode('utf-8')
-                username, password = auth_decoded.split(':', 1)
-                
-                # Check if credentials match
-                if username == auth_user and password == auth_pass:
-                    return view_func(request, *args, **kwargs)
-            except Exception:
-                pass
-            
-            # If we get here, authentication failed
-            return HttpResponse(
-                'Unauthorized: Invalid credentials',
-                status=401,
-                headers={'WWW-Authenticate': 'Basic realm="Metrics Authentication"'}
-            )
+            failure = _auth_failure(request, auth_user, auth_pass)
+            if failure is not None:
+                return failure
+            return view_func(request, *args, **kwargs)
         
         return wrapper
     return decorator
 
+
+def _load(cache, redis_access, fetch_version, fetch_payload):
+    """
+    Return (payload, stale) from ``cache``, refreshing it from Redis if needed.
+    
+    The last known good payload is served, flagged as stale, while Redis is unavailable.
+    """
+    try:
+        return cache.get(
+            lambda: redis_access.call(fetch_version),
+            lambda: redis_access.call(fetch_payload)
+        ), False
+    except Exception:
+        cached = cache.last()
+        if cached is None:
+            raise
+        return cached, True
+
+
+async def _load_async(cache, redis_access, fetch_version, fetch_payload):
+    """``_load`` for the async view."""
+    try:
+        return await cache.get_async(
+            lambda: redis_access.call_async(fetch_version),
+            lambda: redis_access.call_async(fetch_payload)
+        ), False
+    except Exception:
+        cached = cache.last()
+        if cached is None:
+            raise
+        return cached, True
+
+
+def _freshness_metrics(age, stale):
+    """Metrics the view appends to the stored payload, telling how current it is."""
+    return (
+        '# HELP celery_exporter_payload_age_seconds Seconds since the exporter stored the served metrics\n'
+        '# TYPE celery_exporter_payload_age_seconds gauge\n'
+        f'celery_exporter_payload_age_seconds {age:.3f}\n'
+        '# HELP celery_exporter_payload_stale Whether the served metrics are a fallback while Redis is unavailable\n'
+        '# TYPE celery_exporter_payload_stale gauge\n'
+        f'celery_exporter_payload_stale {1 if stale else 0}\n'
+    ).encode('utf-8')
+
+
+def _metrics_response(request, cached, stale, openmetrics=False):
+    """Build the scrape response for a cached payload."""
+    if not cached:
+        return HttpResponse(
+            "# No metrics available\n",
+            content_type="text/plain"
+        )
+    
+    # Pick the best stored encoding the scraper accepts
+    offered = set(cached.bodies) | {IDENTITY}
+    encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), offered) or IDENTITY
+    etag = cached.etag(encoding)
+    
+    # Age of the payload, growing for as long as the exporter does not flush
+    tail = b''
+    headers = {'Vary': 'Accept, Accept-Encoding'}
+    if cached.flushed_at is not None:
+        age = max(0.0, time.time() - cached.flushed_at)
+        tail = _freshness_metrics(age, stale)
+        headers['X-Metrics-Age'] = f'{age:.3f}'
+        # The body now changes with every scrape, the payload it carries only with the version
+        etag = f'W/{etag}'
+    
+    # Nothing changed since the scraper's last fetch (weak comparison, RFC 9110 13.1.2)
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+        if '*' in etags or etag.removeprefix('W/') in etags:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            for name, value in headers.items():
+                response[name] = value
+            return response
+    
+    if openmetrics:
+        # Stored without its terminator, which must come last
+        tail += OPENMETRICS_EOF
+    body = cached.body(encoding)
+    if tail:
+        # Concatenated gzip members (RFC 1952) and zstd frames (RFC 8878) decode as one
+        # body, so the stored payload is served without being decompressed
+        body += compress(tail, encoding)
+    
+    # Return metrics in the negotiated format
+    response = HttpResponse(
+        body,
+        content_type=OPENMETRICS_CONTENT_TYPE if openmetrics else "text/plain"
+    )
+    if encoding != IDENTITY:
+        response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    for name, value in headers.items():
+        response[name] = value
+    if stale:
+        response['X-Metrics-Stale'] = 'true'
+    return response
+
+
+def _error_response(error):
+    # Log the error and return a meaningful error message
+    error_message = f"Error connecting to Redis: {str(error)}"
+    return HttpResponse(
+        f"# Error: {error_message}\n",
+        content_type="text/plain",
+        status=500
+    )
+
+
 @require_GET
 # Example of passing environment variables directly in the decorator
 @basic_auth_required(
@@ -70,38 +437,46 @@ def metrics_view(request):
     """
     Endpoint that serves Prometheus metrics from Redis.
     """
-    # Connect to Redis with SSL certificate handling
-    redis_url = REDIS_URL
-    if redis_url.startswith('rediss://'):
-        # Add SSL certificate verification parameter for secure Redis connections
-        if '?' not in redis_url:
-            redis_url += '?ssl_cert_reqs=none'
-        else:
-            redis_url += '&ssl_cert_reqs=none'
+    try:
+        # Process-wide pooled client, only used when the cache needs a refresh
+        redis_access = get_redis(REDIS_URL)
+        if OPENMETRICS_AVAILABLE and choose_format(request.META.get('HTTP_ACCEPT', '')) == FORMAT_OPENMETRICS:
+            cached, stale = _load(_openmetrics_scrape_cache, redis_access, _fetch_openmetrics_version, _fetch_openmetrics)
+            # Exporters with OpenMetrics disabled only store the text format
+            if cached:
+                return _metrics_response(request, cached, stale, openmetrics=True)
+        cached, stale = _load(_scrape_cache, redis_access, _fetch_version, _fetch_metrics)
+        return _metrics_response(request, cached, stale)
+    except Exception as e:
+        return _error_response(e)
+
+
+@basic_auth_required(
+    auth_user=os.getenv('PROMETHEUS_METRICS_ENDPOINT_AUTH_USERNAME', ''),
+    auth_pass=os.getenv('PROMETHEUS_METRICS_ENDPOINT_AUTH_PASSWORD', '')
+)
+async def metrics_view_async(request):
+    """
+    ``metrics_view`` for ASGI deployments (core/asgi.py).
     
+    Redis is read through a pooled ``redis.asyncio`` client, so a slow Redis
+    holds a coroutine instead of one of the server's threads.
+    """
+    # require_GET does not wrap async views before Django 5.0
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
     try:
-        # Connect to Redis
-        redis_client = redis.Redis.from_url(redis_url)
-        
-        # Get metrics from Redis
-        metrics_data = redis_client.get(METRICS_KEY)
-        
-        if not metrics_data:
-            return HttpResponse(
-                "# No metrics available\n",
-                content_type="text/plain"
+        redis_access = get_async_redis(REDIS_URL)
+        if OPENMETRICS_AVAILABLE and choose_format(request.META.get('HTTP_ACCEPT', '')) == FORMAT_OPENMETRICS:
+            cached, stale = await _load_async(
+                _async_openmetrics_scrape_cache, redis_access, _fetch_openmetrics_version_async,
+                _fetch_openmetrics_async
             )
-        
-        # Return metrics as plain text
-        return HttpResponse(
-            metrics_data,
-            content_type="text/plain"
+            if cached:
+                return _metrics_response(request, cached, stale, openmetrics=True)
+        cached, stale = await _load_async(
+            _async_scrape_cache, redis_access, _fetch_version_async, _fetch_metrics_async
         )
+        return _metrics_response(request, cached, stale)
     except Exception as e:
-        # Log the error and return a meaningful error message
-        error_message = f"Error connecting to Redis: {str(e)}"
-        return HttpResponse(
-            f"# Error: {error_message}\n",
-            content_type="text/plain",
-            status=500
-        ) 
\ No newline at end of file
+        return _error_response(e)
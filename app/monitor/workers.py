@@ -0,0 +1,147 @@
+"""
+Registry of Celery workers fed by worker-heartbeat/online/offline events.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from prometheus_client.core import GaugeMetricFamily
+
+# A worker is considered down after missing this many heartbeats (same as celery.events.state)
+HEARTBEAT_TOLERANCE = 2.0
+
+# Heartbeat interval assumed when a worker does not report one (Celery's default)
+DEFAULT_HEARTBEAT_FREQ = 2.0
+
+LOADAVG_PERIODS = ('1m', '5m', '15m')
+
+
+class WorkerRecord:
+    """Latest state reported by a worker."""
+    __slots__ = ('hostname', 'last_seen', 'freq', 'active', 'processed', 'loadavg', 'online')
+
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.last_seen = None
+        self.freq = DEFAULT_HEARTBEAT_FREQ
+        self.active = 0
+        self.processed = 0
+        self.loadavg = None
+        self.online = True
+
+
+class WorkerRegistry:
+    """
+    Tracks workers by hostname in O(1) per event.
+
+    Workers are kept in the order they were last heard from, so workers that
+    stopped sending heartbeats are found at the front and expired without
+    scanning the others. A worker is up while it is online and its last
+    heartbeat is younger than ``HEARTBEAT_TOLERANCE`` heartbeat intervals;
+    it is forgotten (and its series disappear) ``expire_after`` seconds
+    after it was last heard from.
+
+    Args:
+        expire_after (float): Seconds after the last event before a worker is forgotten.
+        clock (callable, optional): Time source, defaults to time.time.
+    """
+    def __init__(self, expire_after: float = 300.0, clock=time.time):
+        self.expire_after = expire_after
+        self.clock = clock
+        self._workers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._workers)
+
+    def get(self, hostname):
+        """Return the record of ``hostname`` or None."""
+        return self._workers.get(hostname)
+
+    def _touch(self, hostname):
+        """Return the record of ``hostname`` moved to the back, creating it if needed."""
+        workers = self._workers
+        record = workers.get(hostname)
+        if record is None:
+            record = workers[hostname] = WorkerRecord(hostname)
+        else:
+            workers.move_to_end(hostname)
+        record.last_seen = self.clock()
+        return record
+
+    def heartbeat(self, event):
+        """Record a worker-heartbeat (or worker-online) event."""
+        hostname = event.get('hostname')
+        if not hostname:
+            return
+        with self._lock:
+            record = self._touch(hostname)
+            record.online = True
+            record.freq = event.get('freq') or DEFAULT_HEARTBEAT_FREQ
+            record.active = event.get('active', record.active) or 0
+            record.processed = event.get('processed', record.processed) or 0
+            loadavg = event.get('loadavg')
+            if loadavg:
+                record.loadavg = loadavg
+
+    def offline(self, event):
+        """Record a worker-offline event; the worker is reported down until it expires."""
+        hostname = event.get('hostname')
+        if not hostname:
+            return
+        with self._lock:
+            record = self._touch(hostname)
+            record.online = False
+            record.active = 0
+
+    def expire(self, now=None) -> int:
+        """Forget workers not heard from for ``expire_after`` seconds. Returns the number forgotten."""
+        if now is None:
+            now = self.clock()
+        deadline = now - self.expire_after
+        expired = 0
+        with self._lock:
+            workers = self._workers
+            while workers:
+                record = next(iter(workers.values()))
+                if record.last_seen > deadline:
+                    break
+                workers.popitem(last=False)
+                expired += 1
+        return expired
+
+    def is_up(self, record, now) -> bool:
+        """Whether ``record`` is online and heartbeating."""
+        return record.online and now - record.last_seen <= record.freq * HEARTBEAT_TOLERANCE
+
+    def collect(self):
+        """Yield the worker gauges (prometheus_client custom collector interface)."""
+        now = self.clock()
+        self.expire(now)
+        with self._lock:
+            records = list(self._workers.values())
+
+        up = GaugeMetricFamily('celery_worker_up', 'Whether the worker is online and heartbeating', labels=['hostname'])
+        active = GaugeMetricFamily(
+            'celery_worker_tasks_active', 'Tasks the worker is currently executing', labels=['hostname']
+        )
+        processed = GaugeMetricFamily(
+            'celery_worker_tasks_processed', 'Tasks the worker processed since it started', labels=['hostname']
+        )
+        load = GaugeMetricFamily(
+            'celery_worker_load_average', 'Load average of the worker host', labels=['hostname', 'period']
+        )
+        age = GaugeMetricFamily(
+            'celery_worker_last_heartbeat_age_seconds', 'Seconds since the worker was last heard from',
+            labels=['hostname']
+        )
+        for record in records:
+            hostname = record.hostname
+            up.add_metric([hostname], 1 if self.is_up(record, now) else 0)
+            active.add_metric([hostname], record.active)
+            processed.add_metric([hostname], record.processed)
+            if record.loadavg:
+                for period, value in zip(LOADAVG_PERIODS, record.loadavg):
+                    load.add_metric([hostname, period], value)
+            age.add_metric([hostname], max(0.0, now - record.last_seen))
+        return [up, active, processed, load, age]
@@ -15,4 +15,18 @@ def add(self, x, y, delay=0, failure=False):
         return x + y
     except Exception as exc:
         logger.error(f"Error in add task: {exc}")
-        self.retry(exc=exc, countdown=5)
\ No newline at end of file
+        self.retry(exc=exc, countdown=5)
+
+
+@shared_task(bind=True, max_retries=0)
+def multiply(self, x, y, delay=0, failure=False):
+    """Sample task that multiplies two numbers, a second task name for load mixes."""
+    try:
+        if delay > 0:
+            time.sleep(delay)
+        if failure:
+            raise Exception("Task failed as requested")
+        return x * y
+    except Exception as exc:
+        logger.error(f"Error in multiply task: {exc}")
+        self.retry(exc=exc, countdown=5)
@@ -0,0 +1,103 @@
+"""
+Tests for bulk publishing of sample tasks.
+"""
+import json
+import random
+
+import pytest
+from celery import current_app
+from django.test import RequestFactory
+from kombu import Connection, Exchange, Queue
+
+from app.core.celery import app as celery_app
+from app.tasks import views
+from app.tasks.batch import enqueue_batch, parse_mix, plan_batch
+
+
+@pytest.fixture
+def connection():
+    """In-memory broker connection, with the project's app as the one shared tasks publish through."""
+    # Exporter tests leave their own apps current, without task-sent events
+    previous = current_app._get_current_object()
+    celery_app.set_current()
+    with Connection('memory://') as conn:
+        yield conn
+    previous.set_current()
+
+
+def drain(connection, queue):
+    """Return the messages published to ``queue``."""
+    simple = connection.SimpleQueue(queue)
+    messages = []
+    while simple.qsize():
+        message = simple.get(block=False)
+        message.ack()
+        messages.append(message)
+    simple.close()
+    return messages
+
+
+def test_parse_mix():
+    """Test task mix parsing and validation."""
+    tasks = {'add': None, 'multiply': None}
+    assert parse_mix('add:3, multiply', tasks) == {'add': 3.0, 'multiply': 1.0}
+    for text in ('subtract', 'add:0', 'add:x'):
+        with pytest.raises(ValueError):
+            parse_mix(text, tasks)
+
+
+def test_plan_batch():
+    """Test that the plan follows the mix, mean delay and failure ratio."""
+    plan = list(plan_batch(20000, {'add': 3, 'multiply': 1}, delay=2.0, distribution='exponential',
+                           failure_ratio=0.1, rng=random.Random(1)))
+
+    assert len(plan) == 20000
+    assert sum(name == 'add' for name, _, _ in plan) / len(plan) == pytest.approx(0.75, abs=0.02)
+    assert sum(delay for _, delay, _ in plan) / len(plan) == pytest.approx(2.0, rel=0.05)
+    assert sum(failure for _, _, failure in plan) / len(plan) == pytest.approx(0.1, abs=0.01)
+    with pytest.raises(ValueError):
+        plan_batch(1, {'add': 1}, distribution='pareto')
+
+
+def test_enqueue_batch(connection):
+    """Test that each task is published as its own message, with its task-sent event."""
+    plan = [('add', 0.5, False), ('multiply', 0.0, True), ('add', 0.0, False)]
+    Queue('events', Exchange('celeryev', type='topic'), routing_key='task.#')(connection.default_channel).declare()
+
+    published, elapsed = enqueue_batch(views.BATCH_TASKS, plan, producer=connection.Producer())
+
+    assert published == 3
+    assert elapsed > 0
+    messages = drain(connection, 'celery')
+    assert [message.headers['task'] for message in messages] == [
+        'app.tasks.tasks.add', 'app.tasks.tasks.multiply', 'app.tasks.tasks.add'
+    ]
+    assert messages[1].payload[1] == {'delay': 0.0, 'failure': True}
+    assert messages[0].headers['kwargsrepr'] == "{'delay': 0.5, 'failure': False}"
+    events = drain(connection, 'events')
+    assert [event.payload['type'] for event in events] == ['task-sent'] * 3
+
+
+def test_trigger_batch_rejects_bad_parameters(monkeypatch):
+    """Test that invalid parameters are rejected before anything is published."""
+    monkeypatch.setattr(views, 'enqueue_batch', lambda *args: pytest.fail("published"))
+    factory = RequestFactory()
+    for query in ('count=0', f'count={views.TRIGGER_BATCH_MAX_COUNT + 1}', 'tasks=subtract',
+                  'delay_dist=pareto', 'failure_ratio=2', 'failure_ratio=nan', 'delay=-1',
+                  'delay=nan', 'delay=inf', 'delay=-inf'):
+        response = views.trigger_batch(factory.get(f'/trigger/batch/?{query}'))
+        assert response.status_code == 400, query
+
+
+def test_trigger_batch_reports_throughput(monkeypatch):
+    """Test the response of a published batch."""
+    monkeypatch.setattr(views, 'enqueue_batch', lambda tasks, plan: (len(list(plan)), 0.5))
+
+    response = views.trigger_batch(RequestFactory().post(
+        '/trigger/batch/', {'count': 100, 'tasks': 'add:1,multiply:1', 'failure_ratio': 0.05}
+    ))
+
+    body = json.loads(response.content)
+    assert body['enqueued'] == 100
+    assert body['tasks_per_second'] == 200.0
+    assert body['parameters']['tasks'] == {'add': 1.0, 'multiply': 1.0}
@@ -1,6 +1,16 @@
+import math
+import os
+import random
+
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
-from .tasks import add
+from .batch import DELAY_FIXED, enqueue_batch, parse_mix, plan_batch
+from .tasks import add, multiply
+
+# Tasks a batch can mix
+BATCH_TASKS = {'add': add, 'multiply': multiply}
+# A batch holds the request thread until it is published
+TRIGGER_BATCH_MAX_COUNT = int(os.getenv('TRIGGER_BATCH_MAX_COUNT', '100000'))
 
 # Create your views here.
 
@@ -21,3 +31,42 @@ def trigger_task(request):
             "failure": failure
         }
     })
+
+
+@csrf_exempt
+def trigger_batch(request):
+    """Endpoint to publish a batch of sample tasks over one broker connection."""
+    params = request.POST if request.method == 'POST' else request.GET
+    try:
+        count = int(params.get('count', 1000))
+        mix = parse_mix(params.get('tasks', 'add'), BATCH_TASKS)
+        delay = float(params.get('delay', 0))
+        distribution = params.get('delay_dist', DELAY_FIXED)
+        failure_ratio = float(params.get('failure_ratio', 0))
+        seed = params.get('seed')
+        if not 0 < count <= TRIGGER_BATCH_MAX_COUNT:
+            raise ValueError(f"count must be between 1 and {TRIGGER_BATCH_MAX_COUNT}")
+        # NaN and infinity fail every comparison or overflow the delay sampling
+        if not math.isfinite(delay) or delay < 0 or not 0 <= failure_ratio <= 1:
+            raise ValueError("delay must be a finite number >= 0 and failure_ratio between 0 and 1")
+        plan = plan_batch(count, mix, delay, distribution, failure_ratio, random.Random(seed))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    
+    published, elapsed = enqueue_batch(BATCH_TASKS, plan)
+    
+    return JsonResponse({
+        "message": "Tasks triggered successfully",
+        "parameters": {
+            "count": count,
+            "tasks": mix,
+            "delay": delay,
+            "delay_dist": distribution,
+            "failure_ratio": failure_ratio,
+            "seed": seed
+        },
+        "enqueued": published,
+        "elapsed_seconds": round(elapsed, 6),
+        "tasks_per_second": round(published / elapsed, 1) if elapsed > 0 else None
+    })
+
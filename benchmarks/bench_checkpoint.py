@@ -0,0 +1,55 @@
+"""
+Measure checkpoint size, encode time and restore time for a large registry.
+
+The registry holds task counters and runtime histograms for enough task names
+to produce the requested number of exposition series (each histogram child is
+15 buckets + sum + count).
+
+Usage:
+    python -m benchmarks.bench_checkpoint [number_of_series]
+"""
+import sys
+import time
+
+from prometheus_client import CollectorRegistry, Counter, Histogram
+
+from app.monitor.checkpoint import decode_checkpoint, encode_checkpoint, restore_checkpoint
+
+SERIES_PER_CHILD = len(Histogram.DEFAULT_BUCKETS) + 2
+
+
+def build_metrics():
+    """Task runtime histogram labeled like the exporter's, plus a counter."""
+    registry = CollectorRegistry()
+    counter = Counter('celery_task_succeeded_total', 'Succeeded tasks', registry=registry)
+    histogram = Histogram('celery_task_runtime_seconds', 'Task runtime', ['task_name', 'state'], registry=registry)
+    return [counter, histogram]
+
+
+def main():
+    series = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    task_names = [f'tasks.generated.task_{i}' for i in range(max(1, series // SERIES_PER_CHILD))]
+    metrics = build_metrics()
+    counter, histogram = metrics
+    for i, name in enumerate(task_names):
+        histogram.labels(task_name=name, state='success').observe(0.01 * (i % 500))
+    counter.inc(len(task_names))
+
+    start = time.perf_counter()
+    data = encode_checkpoint(metrics, time.time())
+    encode_ms = (time.perf_counter() - start) * 1000
+
+    fresh_metrics = build_metrics()
+    start = time.perf_counter()
+    _, records = decode_checkpoint(data)
+    restored = restore_checkpoint(fresh_metrics, records)
+    restore_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{len(task_names) * SERIES_PER_CHILD + 1} series ({restored} children)")
+    print(f"checkpoint size: {len(data) / 1024:.1f} KiB")
+    print(f"encode:  {encode_ms:.1f} ms")
+    print(f"restore: {restore_ms:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+Broker-free throughput benchmark suite for the exporter.
+
+Synthetic event dicts are fed straight into the exporter's handlers and
+flushed to the in-memory Redis stand-in, so the numbers cover handler and
+flush cost only (no broker, receiver or network I/O). The event stream is
+meant to look like production traffic: task names follow a Zipf
+distribution, runtimes are log-normal per task name, a share of the tasks
+fail and workers heartbeat in between.
+
+Each mode and task count runs in a forked process of its own, twice on the
+same event stream:
+
+- throughput: events/sec through the handlers, with a flush every
+  ``--flush-every`` events (flush time is reported separately), and the
+  growth of the process' peak RSS
+- latency: every handler call timed on its own, for the p99
+
+Results can be saved with ``--save`` and compared against a saved run with
+``--baseline``; the script exits with status 1 if the throughput of any run
+dropped by more than ``--tolerance``.
+
+Usage:
+    python -m benchmarks.bench_exporter [--sizes 1000,100000,1000000] [--modes default,lean]
+        [--storage text] [--save results.json] [--baseline results.json]
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import random
+import resource
+import sys
+import time
+from array import array
+
+from app.monitor.exporter import CelerySuccessExporter
+from app.monitor.memory_redis import MemoryRedis
+from app.monitor.storage import STORAGE_MODES, STORAGE_TEXT
+
+MODES = {'default': False, 'lean': True}
+
+
+def make_events(tasks, task_names=200, failure_ratio=0.05, workers=8, seed=0):
+    """
+    Yield the events of ``tasks`` synthetic tasks, one task at a time.
+
+    Every task sends task-sent, task-received, task-started and task-succeeded
+    (or task-failed) events. Task names are drawn from a Zipf distribution
+    with a log-normal runtime around a per-name median, and every worker
+    heartbeats once per thousand tasks. Events are generated lazily so that
+    the event stream itself does not show up in the exporter's memory.
+    """
+    rng = random.Random(seed)
+    names = [f'tasks.generated.task_{i}' for i in range(task_names)]
+    weights = [1.0 / (rank + 1) ** 1.1 for rank in range(task_names)]
+    # Median runtimes from 1ms to 10s
+    medians = {name: 10 ** rng.uniform(-3, 1) for name in names}
+    hostnames = [f'celery@worker-{i}' for i in range(workers)]
+    now = time.time()
+    for i in range(tasks):
+        name = rng.choices(names, weights)[0]
+        task_id = f'{seed:08x}{i:024x}'
+        hostname = hostnames[i % workers]
+        sent = now + i * 0.001
+        received = sent + rng.expovariate(20.0)
+        started = received + rng.expovariate(100.0)
+        runtime = rng.lognormvariate(0.0, 0.5) * medians[name]
+        yield {'type': 'task-sent', 'uuid': task_id, 'name': name, 'timestamp': sent}
+        yield {'type': 'task-received', 'uuid': task_id, 'name': name, 'hostname': hostname, 'timestamp': received}
+        yield {'type': 'task-started', 'uuid': task_id, 'hostname': hostname, 'timestamp': started}
+        if rng.random() < failure_ratio:
+            yield {'type': 'task-failed', 'uuid': task_id, 'hostname': hostname, 'exception': 'Exception()',
+                   'timestamp': started + runtime}
+        else:
+            yield {'type': 'task-succeeded', 'uuid': task_id, 'hostname': hostname, 'runtime': runtime,
+                   'timestamp': started + runtime}
+        if i % 1000 == 0:
+            for worker, worker_hostname in enumerate(hostnames):
+                yield {'type': 'worker-heartbeat', 'hostname': worker_hostname, 'freq': 2.0, 'active': worker % 4,
+                       'processed': i, 'loadavg': [1.0, 1.0, 1.0], 'timestamp': sent}
+
+
+def chunks(events, size):
+    """Split an event stream into lists of ``size`` events."""
+    while True:
+        chunk = list(itertools.islice(events, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def make_exporter(lean, storage_mode):
+    return CelerySuccessExporter('memory://', redis_client=MemoryRedis(), lean=lean, storage_mode=storage_mode,
+                                 checkpoint=False)
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in KiB on Linux and in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def measure_throughput(tasks, lean, storage_mode, flush_every):
+    """Return (events, handler seconds, flush seconds per flush, peak RSS growth in bytes)."""
+    peak_before = peak_rss()
+    exporter = make_exporter(lean, storage_mode)
+    handlers = exporter.handlers
+    perf_counter = time.perf_counter
+    count, elapsed, flushes = 0, 0.0, []
+    # Chunks are built outside the timed loop
+    for chunk in chunks(make_events(tasks), flush_every):
+        start = perf_counter()
+        for event in chunk:
+            handlers[event['type']](event)
+        elapsed += perf_counter() - start
+        count += len(chunk)
+
+        start = perf_counter()
+        exporter._store_metrics()
+        flushes.append(perf_counter() - start)
+    # Includes up to one chunk of events next to the exporter
+    return count, elapsed, flushes, peak_rss() - peak_before
+
+
+def measure_latency(tasks, lean, storage_mode, flush_every):
+    """Return the sorted handler call durations in seconds."""
+    exporter = make_exporter(lean, storage_mode)
+    handlers = exporter.handlers
+    perf_counter = time.perf_counter
+    durations = array('d')
+    for chunk in chunks(make_events(tasks), flush_every):
+        for event in chunk:
+            handler = handlers[event['type']]
+            start = perf_counter()
+            handler(event)
+            durations.append(perf_counter() - start)
+        exporter._store_metrics()
+    return sorted(durations)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted ``values``."""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(tasks, mode, storage_mode, flush_every):
+    """Run both passes for one mode and size and return the result row."""
+    lean = MODES[mode]
+    events, elapsed, flushes, peak_memory = measure_throughput(tasks, lean, storage_mode, flush_every)
+    latencies = measure_latency(tasks, lean, storage_mode, flush_every)
+    return {
+        'mode': mode,
+        'storage': storage_mode,
+        'tasks': tasks,
+        'events': events,
+        'events_per_sec': events / elapsed,
+        'handler_p99_us': percentile(latencies, 0.99) * 1e6,
+        'flush_mean_ms': sum(flushes) / len(flushes) * 1000,
+        'flush_max_ms': max(flushes) * 1000,
+        'peak_rss_growth_mib': peak_memory / 2 ** 20,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print throughput changes against ``baseline`` and return the regressed rows."""
+    previous = {(row['mode'], row['storage'], row['tasks']): row for row in baseline}
+    regressions = []
+    for row in results:
+        old = previous.get((row['mode'], row['storage'], row['tasks']))
+        if old is None:
+            continue
+        change = row['events_per_sec'] / old['events_per_sec'] - 1
+        print(f"{row['mode']:<8} {row['tasks']:>9,} tasks: {change:+.1%} events/sec vs baseline")
+        if change < -tolerance:
+            regressions.append(row)
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+                        help='Comma separated numbers of tasks (each task sends 4 events)')
+    parser.add_argument('--modes', default=','.join(MODES), help='Comma separated exporter modes')
+    parser.add_argument('--storage', default=STORAGE_TEXT, choices=STORAGE_MODES, help='Redis storage mode')
+    parser.add_argument('--flush-every', type=int, default=10000, help='Events between flushes')
+    parser.add_argument('--save', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against results saved with --save')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Throughput drop vs the baseline that counts as a regression (default: 0.2)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    modes = args.modes.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            raise SystemExit(f"Unknown mode {mode!r}, expected one of {tuple(MODES)}")
+
+    print(f"{'mode':<8} {'tasks':>9} {'events':>9} {'events/sec':>12} {'p99 us':>8} {'flush ms':>9} "
+          f"{'max ms':>8} {'RSS+ MiB':>9}")
+    results = []
+    for tasks in sizes:
+        for mode in modes:
+            # A fresh process per run, so the peak RSS is that run's own
+            with multiprocessing.get_context('fork').Pool(1) as pool:
+                row = pool.apply(run, (tasks, mode, args.storage, args.flush_every))
+            results.append(row)
+            print(f"{mode:<8} {tasks:>9,} {row['events']:>9,} {row['events_per_sec']:>12,.0f} "
+                  f"{row['handler_p99_us']:>8.1f} {row['flush_mean_ms']:>9.2f} {row['flush_max_ms']:>8.2f} "
+                  f"{row['peak_rss_growth_mib']:>9.1f}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} run(s) regressed by more than {args.tolerance:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""
+Compare event ingestion throughput of the default and lean exporter paths.
+
+Synthetic event bodies are fed through the same receiver class the exporter
+uses for each mode, so the numbers include event decoding overhead but no
+broker I/O.
+
+Usage:
+    python -m benchmarks.bench_ingest [number_of_tasks]
+"""
+import sys
+import time
+import uuid
+
+from celery.events.receiver import EventReceiver
+
+from app.monitor.exporter import CelerySuccessExporter
+from app.monitor.memory_redis import MemoryRedis
+from app.monitor.receiver import LeanEventReceiver
+
+TASK_NAMES = ['tasks.tasks.add', 'tasks.tasks.send_email', 'tasks.tasks.resize_image', 'tasks.tasks.sync']
+
+
+def make_events(count):
+    """Build received/started/succeeded event bodies for ``count`` tasks."""
+    events = []
+    now = time.time()
+    for i in range(count):
+        task_id = str(uuid.uuid4())
+        common = {'uuid': task_id, 'hostname': 'celery@bench', 'utcoffset': 0, 'pid': 1, 'clock': i}
+        events.append(dict(common, type='task-received', name=TASK_NAMES[i % len(TASK_NAMES)],
+                           args='(4, 4)', kwargs='{}', retries=0, timestamp=now))
+        events.append(dict(common, type='task-started', timestamp=now))
+        if i % 10 == 0:
+            events.append(dict(common, type='task-failed', exception='Exception()', timestamp=now))
+        else:
+            events.append(dict(common, type='task-succeeded', result='8', runtime=0.01 * (i % 50), timestamp=now))
+    return events
+
+
+def run(lean, events, event_stats=None):
+    """Feed ``events`` through an exporter and return events/sec."""
+    exporter = CelerySuccessExporter('memory://', lean=lean, redis_client=MemoryRedis(), event_stats=event_stats)
+    receiver_class = LeanEventReceiver if lean else EventReceiver
+    receiver = receiver_class(None, handlers=exporter.handlers, app=exporter.app)
+    receive = receiver._receive
+
+    start = time.perf_counter()
+    for event in events:
+        # The receiver mutates bodies, hand it a fresh copy like the broker would
+        receive(dict(event), None)
+    elapsed = time.perf_counter() - start
+    return len(events) / elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    events = make_events(count)
+    default_rate = run(False, events)
+    lean_rate = run(True, events)
+    # Lean handlers with the handler time and event lag histograms of the default path
+    stats_rate = run(True, events, event_stats=True)
+    print(f"{len(events)} events")
+    print(f"default:      {default_rate:,.0f} events/sec")
+    print(f"lean:         {lean_rate:,.0f} events/sec ({lean_rate / default_rate:.2f}x)")
+    print(f"lean + stats: {stats_rate:,.0f} events/sec ({stats_rate / default_rate:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
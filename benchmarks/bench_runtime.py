@@ -0,0 +1,125 @@
+"""
+Compare the threaded and asyncio exporter runtimes.
+
+Each runtime is started as in production, except that the receive thread is
+fed synthetic event bodies instead of reading from a broker and Redis is the
+in-memory stand-in. Two things are measured:
+
+- throughput: events/sec and process CPU seconds until every event of a
+  burst has been handled and flushed
+- idle: process CPU seconds burned over a few seconds without any events
+
+Usage:
+    python -m benchmarks.bench_runtime [number_of_tasks] [idle_seconds]
+"""
+import asyncio
+import sys
+import time
+
+from app.monitor.async_exporter import AsyncCeleryExporter
+from app.monitor.exporter import CelerySuccessExporter
+from app.monitor.memory_redis import AsyncMemoryRedis, MemoryRedis
+from app.monitor.receiver import LeanEventReceiver
+from benchmarks.bench_ingest import make_events
+
+
+def feeder(exporter, events):
+    """Replacement for _monitor_events that feeds ``events`` through the lean receiver."""
+    def monitor_events():
+        receiver = LeanEventReceiver(None, handlers=exporter._receiver_handlers(), app=exporter.app)
+        receive = receiver._receive
+        for event in events:
+            receive(dict(event), None)
+    return monitor_events
+
+
+def processed(exporter):
+    """Number of events the aggregator has run the handlers for (pipeline mode)."""
+    return exporter.registry.get_sample_value('celery_exporter_event_batch_size_sum') or 0
+
+
+def run_threaded(events, pipeline):
+    """Return (events/sec, CPU seconds) for the threaded runtime."""
+    exporter = CelerySuccessExporter('memory://', lean=True, redis_client=MemoryRedis(), pipeline=pipeline,
+                                     checkpoint=False)
+    exporter._monitor_events = feeder(exporter, events)
+    cpu, start = time.process_time(), time.perf_counter()
+    exporter.start()
+    if pipeline:
+        while processed(exporter) < len(events):
+            time.sleep(0.001)
+    else:
+        # Handlers run on the receive thread, which exits once everything is fed
+        exporter._monitor_thread.join()
+    exporter._store_metrics()
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    exporter.stop()
+    return len(events) / elapsed, cpu
+
+
+async def run_asyncio_async(events):
+    exporter = AsyncCeleryExporter('memory://', lean=True, redis_client=MemoryRedis(),
+                                   async_redis_client=AsyncMemoryRedis(), checkpoint=False)
+    exporter._monitor_events = feeder(exporter, events)
+    cpu, start = time.process_time(), time.perf_counter()
+    runner = asyncio.create_task(exporter.run())
+    while processed(exporter) < len(events):
+        await asyncio.sleep(0.001)
+    await exporter._store_metrics_async()
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    exporter.stop()
+    await runner
+    return len(events) / elapsed, cpu
+
+
+def run_asyncio(events):
+    """Return (events/sec, CPU seconds) for the asyncio runtime."""
+    return asyncio.run(run_asyncio_async(events))
+
+
+def idle_threaded(seconds):
+    """CPU seconds the threaded runtime burns while no events arrive."""
+    exporter = CelerySuccessExporter('memory://', lean=True, redis_client=MemoryRedis(), checkpoint=False)
+    exporter._monitor_events = lambda: None
+    exporter.start()
+    cpu = time.process_time()
+    time.sleep(seconds)
+    cpu = time.process_time() - cpu
+    exporter.stop()
+    return cpu
+
+
+async def idle_asyncio_async(seconds):
+    exporter = AsyncCeleryExporter('memory://', lean=True, redis_client=MemoryRedis(),
+                                   async_redis_client=AsyncMemoryRedis(), checkpoint=False)
+    exporter._monitor_events = lambda: None
+    runner = asyncio.create_task(exporter.run())
+    await asyncio.sleep(0)
+    cpu = time.process_time()
+    await asyncio.sleep(seconds)
+    cpu = time.process_time() - cpu
+    exporter.stop()
+    await runner
+    return cpu
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    idle_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    events = make_events(count)
+
+    results = [
+        ('threaded', run_threaded(events, pipeline=False), idle_threaded(idle_seconds)),
+        ('threaded+pipeline', run_threaded(events, pipeline=True), None),
+        ('asyncio', run_asyncio(events), asyncio.run(idle_asyncio_async(idle_seconds))),
+    ]
+
+    print(f"{len(events)} events, {idle_seconds:.0f}s idle")
+    print(f"{'runtime':<18} {'events/sec':>12} {'CPU s':>8} {'idle CPU ms':>12}")
+    for name, (rate, cpu), idle in results:
+        idle_text = f"{idle * 1000:.1f}" if idle is not None else '-'
+        print(f"{name:<18} {rate:>12,.0f} {cpu:>8.2f} {idle_text:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Load test the Django metrics endpoint under WSGI (gthread) and ASGI (uvicorn).
+
+Both servers are started the way ``start.sh`` starts gunicorn (2 workers; 2
+threads each for WSGI) against the same Redis. Redis is an in-process fake
+server behind a proxy that delays every request by ``--redis-delay`` ms, to
+model a slow or distant Redis. A flusher stores a realistic payload and bumps
+its version every 0.5s, like the exporter. For each concurrency level,
+scrapers hit /metrics/ in a closed loop while a probe requests /trigger/ (the
+Celery broker is in-memory) at a fixed rate, showing whether scrapes starve
+the rest of the app.
+
+Usage:
+    python -m benchmarks.bench_scrape [--concurrency 1,16,64] [--duration 5] [--redis-delay 20]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from array import array
+
+import redis
+from fakeredis import TcpFakeServer
+
+from app.monitor.exporter import CelerySuccessExporter
+from benchmarks.bench_exporter import make_events, percentile
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app')
+
+SERVERS = {
+    'wsgi': ['core.wsgi:application', '--workers', '2', '--threads', '2', '--worker-class', 'gthread'],
+    'asgi': ['core.asgi:application', '--workers', '2', '--worker-class', 'uvicorn.workers.UvicornWorker'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_redis(delay):
+    """Start a fake Redis behind a delaying proxy on background threads. Returns its URL."""
+    backend_port, proxy_port = free_port(), free_port()
+    server = TcpFakeServer(('127.0.0.1', backend_port), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    async def pipe(reader, writer, delay):
+        try:
+            while data := await reader.read(65536):
+                if delay:
+                    await asyncio.sleep(delay)
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle(client_reader, client_writer):
+        backend_reader, backend_writer = await asyncio.open_connection('127.0.0.1', backend_port)
+        asyncio.ensure_future(pipe(client_reader, backend_writer, delay))
+        asyncio.ensure_future(pipe(backend_reader, client_writer, 0))
+
+    ready = threading.Event()
+
+    def run_proxy():
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(asyncio.start_server(handle, '127.0.0.1', proxy_port))
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run_proxy, daemon=True).start()
+    ready.wait()
+    return f'redis://127.0.0.1:{proxy_port}/0'
+
+
+def start_flusher(redis_url, stop):
+    """Store a payload from a populated exporter registry every 0.5s, as the exporter does."""
+    exporter = CelerySuccessExporter('memory://', redis_client=redis.Redis.from_url(redis_url), checkpoint=False)
+    handlers = exporter.handlers
+    for event in make_events(5000, task_names=20):
+        handler = handlers.get(event['type'])
+        if handler is not None:
+            handler(event)
+
+    def flush():
+        while not stop.wait(0.5):
+            exporter._store_metrics()
+
+    exporter._store_metrics()
+    threading.Thread(target=flush, daemon=True).start()
+    return len(redis.Redis.from_url(redis_url).get(exporter.metrics_key))
+
+
+def start_server(kind, redis_url, port):
+    env = dict(
+        os.environ,
+        REDIS_URL=redis_url,
+        CLOUDAMQP_URL='memory://',
+        METRICS_CACHE_MAX_STALENESS='0',
+        # Plain HTTP, without the production HTTPS redirect
+        DJANGO_DEBUG='true',
+        DJANGO_SETTINGS_MODULE='core.settings',
+    )
+    process = subprocess.Popen(
+        ['gunicorn', *SERVERS[kind], '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+        cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{kind} server did not start")
+
+
+async def get(port, path):
+    """One HTTP/1.0 GET; returns the status code."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.0\r\nHost: localhost\r\nAccept-Encoding: gzip\r\n\r\n'.encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    await reader.read()
+    writer.close()
+    return status
+
+
+async def load(port, concurrency, duration, probe_interval=0.1):
+    """Closed-loop scrapers plus a fixed-rate /trigger/ probe for ``duration`` seconds."""
+    scrapes, probes = array('d'), array('d')
+    errors = 0
+    end = time.monotonic() + duration
+
+    async def timed(path, latencies):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(get(port, path), 30)
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            status = None
+        if status != 200:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+
+    async def scraper():
+        while time.monotonic() < end:
+            await timed('/metrics/', scrapes)
+
+    async def probe():
+        while time.monotonic() < end:
+            await asyncio.gather(timed('/trigger/', probes), asyncio.sleep(probe_interval))
+
+    start = time.perf_counter()
+    await asyncio.gather(probe(), *(scraper() for _ in range(concurrency)))
+    return len(scrapes) / (time.perf_counter() - start), sorted(scrapes), sorted(probes), errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--concurrency', default='1,16,64', help='Comma separated numbers of concurrent scrapers')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per concurrency level')
+    parser.add_argument('--redis-delay', type=float, default=20.0, help='Milliseconds added to every Redis request')
+    parser.add_argument('--servers', default=','.join(SERVERS), help='Comma separated servers to test')
+    args = parser.parse_args(argv)
+
+    redis_url = start_redis(args.redis_delay / 1000)
+    stop = threading.Event()
+    payload_size = start_flusher(redis_url, stop)
+    print(f"Payload {payload_size / 1024:.0f} KiB, Redis delay {args.redis_delay:g}ms, {args.duration:g}s per level")
+    print(f"{'server':6} {'scrapers':>8} {'scrapes/s':>10} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'trigger p99 ms':>15} {'errors':>7}")
+    try:
+        for kind in args.servers.split(','):
+            port = free_port()
+            process = start_server(kind, redis_url, port)
+            try:
+                # Warm up connections and imports
+                asyncio.run(load(port, 2, 1.0))
+                for concurrency in (int(value) for value in args.concurrency.split(',')):
+                    rate, scrapes, probes, errors = asyncio.run(load(port, concurrency, args.duration))
+                    print(
+                        f"{kind:6} {concurrency:>8} {rate:>10.0f} {percentile(scrapes, 0.5) * 1000:>8.1f} "
+                        f"{percentile(scrapes, 0.99) * 1000:>8.1f} {percentile(probes, 0.99) * 1000:>15.1f} "
+                        f"{errors:>7}"
+                    )
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        stop.set()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
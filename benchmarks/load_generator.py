@@ -0,0 +1,306 @@
+"""
+Open-loop load generator for manual testing of the exporter and dashboards.
+
+Runs a declarative load profile against a running app: a list of phases,
+each with a target task rate, duration, failure ratio and delay
+distribution. Requests are sent on a schedule fixed in advance, whatever
+the server's response time (open loop), so a slow server shows up as
+growing latency instead of a silently lower rate. Latencies are measured
+from the time each request was due, not from when it was actually sent.
+
+In the background, /metrics/ is scraped to measure how long the tasks of
+each phase take to show up in the exporter's counts, end to end through
+the broker, worker, exporter and Redis.
+
+Usage:
+    python -m benchmarks.load_generator [--profile profile.json] [--url http://localhost:8787] [--rate-scale 1]
+
+A profile file is a JSON list of phases like ``PROFILE`` below.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import ssl
+import sys
+from urllib.parse import urlencode, urlsplit
+
+from dotenv import load_dotenv
+from prometheus_client.parser import text_string_to_metric_families
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Get port from environment variables
+DJANGO_PORT = os.getenv('DJANGO_PORT', '8787')
+
+# Phase keys:
+#   rate: tasks per second (0 for a quiet phase), duration: seconds
+#   failure_ratio: share of failing tasks
+#   delay, delay_dist: mean task sleep and its distribution (fixed, uniform or exponential)
+#   batch: tasks per request, >1 publishes through /trigger/batch/ for rates /trigger/ cannot reach
+#   arrivals: 'uniform' spacing or 'poisson' (exponential gaps with the same mean)
+PROFILE = [
+    {'name': 'steady', 'rate': 20, 'duration': 30},
+    {'name': 'burst', 'rate': 200, 'duration': 15},
+    {'name': 'mixed', 'rate': 20, 'duration': 30, 'failure_ratio': 0.5, 'arrivals': 'poisson'},
+    {'name': 'quiet', 'rate': 0, 'duration': 15},
+    {'name': 'delayed', 'rate': 5, 'duration': 15, 'delay': 2},
+    {'name': 'mixed delays', 'rate': 50, 'duration': 30, 'delay': 1, 'delay_dist': 'uniform'},
+    {'name': 'flood', 'rate': 2000, 'duration': 15, 'batch': 100, 'failure_ratio': 0.05},
+    {'name': 'cool down', 'rate': 0, 'duration': 30},
+]
+
+DELAY_DISTRIBUTIONS = ('fixed', 'uniform', 'exponential')
+ARRIVALS = ('uniform', 'poisson')
+
+
+def load_profile(path):
+    """Read and validate a profile, the built-in one without a path."""
+    phases = PROFILE
+    if path:
+        with open(path) as f:
+            phases = json.load(f)
+    for i, phase in enumerate(phases):
+        if phase.get('rate', 0) < 0 or phase.get('duration', 0) <= 0:
+            raise ValueError(f"Phase {i}: rate must be >= 0 and duration > 0")
+        if phase.get('delay_dist', 'fixed') not in DELAY_DISTRIBUTIONS:
+            raise ValueError(f"Phase {i}: delay_dist must be one of {', '.join(DELAY_DISTRIBUTIONS)}")
+        if phase.get('arrivals', 'uniform') not in ARRIVALS:
+            raise ValueError(f"Phase {i}: arrivals must be one of {', '.join(ARRIVALS)}")
+        if not 0 <= phase.get('failure_ratio', 0) <= 1 or phase.get('batch', 1) < 1:
+            raise ValueError(f"Phase {i}: failure_ratio must be between 0 and 1 and batch >= 1")
+    return phases
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted ``values``."""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def format_ms(values, fraction):
+    return f'{percentile(values, fraction) * 1000:.1f}' if values else '-'
+
+
+class Client:
+    """
+    Minimal asyncio HTTP/1.0 client, one connection per request like most scrapers and load tools.
+
+    ``requests`` blocks a thread per request, so keeping up to
+    ``--max-in-flight`` requests pending on schedule would take as many
+    threads, and thread scheduling would delay the sends it is meant to time.
+    The project has no asyncio HTTP client dependency, and plain GETs over
+    asyncio streams are all the open-loop schedule needs.
+    """
+
+    def __init__(self, url, auth_user='', auth_pass=''):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.headers = f'Host: {parts.netloc}\r\n'
+        if auth_user and auth_pass:
+            credentials = base64.b64encode(f'{auth_user}:{auth_pass}'.encode()).decode()
+            self.headers += f'Authorization: Basic {credentials}\r\n'
+
+    async def get(self, path):
+        """Return (status, body) of a GET."""
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        try:
+            writer.write(f'GET {path} HTTP/1.0\r\n{self.headers}\r\n'.encode())
+            await writer.drain()
+            response = await reader.read()
+        finally:
+            writer.close()
+        head, _, body = response.partition(b'\r\n\r\n')
+        return int(head.split(None, 2)[1]), body
+
+
+class PhaseResult:
+    """Outcome of one phase."""
+
+    def __init__(self, phase):
+        self.phase = phase
+        self.requests = 0
+        self.tasks = 0
+        self.errors = 0
+        self.skipped = 0
+        self.latencies = []
+        self.end = None
+
+
+def sample_delay(phase, rng):
+    delay = phase.get('delay', 0)
+    distribution = phase.get('delay_dist', 'fixed')
+    if distribution == 'uniform':
+        return rng.uniform(0, 2 * delay)
+    if distribution == 'exponential' and delay > 0:
+        return rng.expovariate(1 / delay)
+    return delay
+
+
+def request_path(phase, rng):
+    """Path of the next request of a phase and the number of tasks it enqueues."""
+    batch = phase.get('batch', 1)
+    failure_ratio = phase.get('failure_ratio', 0)
+    if batch > 1:
+        query = {'count': batch, 'delay': phase.get('delay', 0), 'delay_dist': phase.get('delay_dist', 'fixed'),
+                 'failure_ratio': failure_ratio, 'seed': rng.getrandbits(32)}
+        return f'/trigger/batch/?{urlencode(query)}', batch
+    failure = 'true' if rng.random() < failure_ratio else 'false'
+    return f'/trigger/?{urlencode({"delay": sample_delay(phase, rng), "failure": failure})}', 1
+
+
+async def run_phase(client, phase, rate_scale, max_in_flight, rng):
+    """Send the requests of a phase on schedule and wait for their responses."""
+    result = PhaseResult(phase)
+    loop = asyncio.get_running_loop()
+    duration = phase['duration']
+    request_rate = phase.get('rate', 0) * rate_scale / phase.get('batch', 1)
+    pending = set()
+
+    async def send(path, tasks, due):
+        try:
+            status, _ = await client.get(path)
+        except (OSError, ValueError, IndexError):
+            status = None
+        result.latencies.append(loop.time() - due)
+        if status == 200:
+            result.tasks += tasks
+        else:
+            result.errors += 1
+
+    start = loop.time()
+    due = start
+    while request_rate > 0:
+        due += rng.expovariate(request_rate) if phase.get('arrivals') == 'poisson' else 1 / request_rate
+        if due >= start + duration:
+            break
+        wait = due - loop.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if len(pending) >= max_in_flight:
+            # Never wait for the server: count the request as not sent instead
+            result.skipped += 1
+            continue
+        path, tasks = request_path(phase, rng)
+        result.requests += 1
+        task = asyncio.ensure_future(send(path, tasks, due))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    await asyncio.sleep(max(0.0, start + duration - loop.time()))
+    result.end = loop.time()
+    if pending:
+        await asyncio.wait(pending)
+    result.latencies.sort()
+    return result
+
+
+async def read_counts(client):
+    """(received, succeeded + failed) task totals exposed on /metrics/."""
+    status, body = await client.get('/metrics/')
+    if status != 200:
+        raise OSError(f"/metrics/ returned {status}")
+    totals = {'celery_task_received_total': 0.0, 'celery_task_succeeded_total': 0.0, 'celery_task_failed_total': 0.0}
+    for family in text_string_to_metric_families(body.decode('utf-8')):
+        for sample in family.samples:
+            if sample.name in totals:
+                totals[sample.name] += sample.value
+    return totals['celery_task_received_total'], \
+        totals['celery_task_succeeded_total'] + totals['celery_task_failed_total']
+
+
+async def poll_counts(client, samples, interval, stop):
+    """Append (time, received, done) from /metrics/ every ``interval`` seconds until ``stop`` is set."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        try:
+            samples.append((loop.time(), *await read_counts(client)))
+        except (OSError, ValueError, IndexError):
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def visibility_lag(samples, base, target, since, column):
+    """Seconds after ``since`` until ``column`` of the samples grew by ``target`` over ``base``, None if never."""
+    for sample in samples:
+        if sample[column] - base >= target:
+            return max(0.0, sample[0] - since)
+    return None
+
+
+async def run_profile(client, metrics_client, phases, rate_scale, max_in_flight, poll_interval, settle, seed):
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    base = await read_counts(metrics_client)
+    samples, stop = [], asyncio.Event()
+    poller = asyncio.ensure_future(poll_counts(metrics_client, samples, poll_interval, stop))
+
+    results = []
+    for phase in phases:
+        print(f"Phase {phase.get('name', len(results) + 1)}: {phase.get('rate', 0) * rate_scale:g} tasks/s "
+              f"for {phase['duration']:g}s", file=sys.stderr)
+        results.append(await run_phase(client, phase, rate_scale, max_in_flight, rng))
+
+    # Wait for the last tasks to show up, or give up after ``settle`` seconds
+    total = sum(result.tasks for result in results)
+    deadline = loop.time() + settle
+    while loop.time() < deadline and not (samples and samples[-1][2] - base[1] >= total):
+        await asyncio.sleep(poll_interval)
+    stop.set()
+    await poller
+    return results, base, samples
+
+
+def report(results, base, samples, rate_scale):
+    print(f"{'phase':14} {'target/s':>9} {'achieved/s':>11} {'errors':>7} {'skipped':>8} {'p50 ms':>8} "
+          f"{'p99 ms':>8} {'seen after s':>13} {'done after s':>13}")
+    cumulative = 0
+    for i, result in enumerate(results):
+        phase = result.phase
+        cumulative += result.tasks
+        target = phase.get('rate', 0) * rate_scale
+        seen = visibility_lag(samples, base[0], cumulative, result.end, 1) if result.tasks else None
+        done = visibility_lag(samples, base[1], cumulative, result.end, 2) if result.tasks else None
+        print(
+            f"{str(phase.get('name', i + 1))[:14]:14} {target:>9g} {result.tasks / phase['duration']:>11.1f} "
+            f"{result.errors:>7} {result.skipped:>8} {format_ms(result.latencies, 0.5):>8} "
+            f"{format_ms(result.latencies, 0.99):>8} "
+            f"{'-' if seen is None else f'{seen:.2f}':>13} {'-' if done is None else f'{done:.2f}':>13}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default=f'http://localhost:{DJANGO_PORT}', help='Base URL of the app')
+    parser.add_argument('--profile', help='JSON file with the phases to run, the built-in profile by default')
+    parser.add_argument('--rate-scale', type=float, default=1.0, help='Multiply the rate of every phase')
+    parser.add_argument('--max-in-flight', type=int, default=1000,
+                        help='Requests awaiting a response beyond which due requests are skipped')
+    parser.add_argument('--poll-interval', type=float, default=0.25, help='Seconds between /metrics/ scrapes')
+    parser.add_argument('--settle', type=float, default=60.0,
+                        help='Seconds to wait after the last phase for the counts to show up')
+    parser.add_argument('--seed', type=int, help='Seed for a reproducible run')
+    args = parser.parse_args(argv)
+
+    phases = load_profile(args.profile)
+    client = Client(args.url)
+    metrics_client = Client(
+        args.url,
+        os.getenv('PROMETHEUS_METRICS_ENDPOINT_AUTH_USERNAME', ''),
+        os.getenv('PROMETHEUS_METRICS_ENDPOINT_AUTH_PASSWORD', '')
+    )
+    results, base, samples = asyncio.run(run_profile(
+        client, metrics_client, phases, args.rate_scale, args.max_in_flight, args.poll_interval, args.settle,
+        args.seed
+    ))
+    report(results, base, samples, args.rate_scale)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,10 +10,18 @@ setup(
         "prometheus-client>=0.19.0",
         "python-dotenv>=1.0.1",
         "gunicorn>=21.2.0",
+        "uvicorn>=0.23.0",
         "flower>=2.0.1",
         "requests>=2.31.0",
         "whitenoise>=6.6.0",
         "dj-database-url>=2.1.0",
         "redis>=5.0.1",
     ],
+    extras_require={
+        # benchmarks/bench_scrape.py runs a fake Redis server and the ASGI server
+        "bench": [
+            "fakeredis>=2.39.0",
+            "uvicorn>=0.23.0",
+        ],
+    },
 ) 
\ No newline at end of file